@@ -2,24 +2,33 @@
 """
 app.py
 """
+import importlib
 import os
 import sys
 import threading
 import time
 import tkinter as tk
-from tkinter import Entry, Label, StringVar
-
-from pynput import keyboard
-from ahk import AHK
-import cv2
-import numpy as np
-
-from app.capture import ScreenCapture
-from app.config import ENABLE_LOGGING, ENABLE_DISCORD_RPC
+from collections import deque
+from tkinter import BooleanVar, Entry, Label, StringVar
+
+# cv2, numpy, pynput, ahk and the detection pipeline are imported where they are used, and
+# warmed up in the background once the window is drawn (see _warm_up), so the window shows at once
+from app.config import (
+    DETECTION_MODE, ENABLE_LOGGING, ENABLE_DISCORD_RPC, ENABLE_METRICS_ENDPOINT, ENABLE_SLOTS_SOCKET, GUI_REFRESH_HZ, LOG_BACKUPS,
+    LOG_COMPRESS, LOG_FILE, LOG_MAX_BYTES, LOG_MAX_RECORDS, METRICS_PORT, PREVIEW_MAX_FPS, SLOT_ROI_FILE,
+    SLOTS_SOCKET_PORT, STOP_CONFIRM_FRAMES, WAIT_FOR_SETTLE
+)
 from app.constants import RANKS, RANK_ORDER, RANK_TK_HEX
+from app.eventlog import EventLog
+from app.metrics import REGISTRY, MetricsServer, stage
 from app.theme import bg, label_fg, entry_bg, entry_fg, btn_bg, btn_fg
-from app.utils import Tooltip
-from app.processor import ImageProcessor
+from app.utils import GuiMailbox, Tooltip
+from app.profiling import PROFILER
+from app.roi import RoiStore
+
+_CLICK_SECONDS = stage("click")
+_ROLL_SECONDS = REGISTRY.histogram("roll_seconds", "Duration of one reroll, from its first click to the next one, in seconds")
+_ROLLS = REGISTRY.counter("rolls_total", "Rerolls performed")
 
 class PipRerollerApp:
     """
@@ -42,6 +51,12 @@ class PipRerollerApp:
     :ivar game_area: Bounding box defining the screen region for pip detection.
     :vartype game_area: tuple or None
 
+    :ivar exclusion_areas: Screen areas whose pips are ignored, e.g. pip-colored decorations.
+    :vartype exclusion_areas: list[tuple[int, int, int, int]]
+
+    :ivar roi_store: Keeps the learned pip slots and the exclusion areas between sessions.
+    :vartype roi_store: app.roi.RoiStore
+
     :ivar chisel_button_pos: Screen coordinates of the chisel button.
     :vartype chisel_button_pos: tuple or None
 
@@ -57,6 +72,9 @@ class PipRerollerApp:
     :ivar tolerance: Color tolerance used for pip detection.
     :vartype tolerance: int
 
+    :ivar classifier: Lookup-table rank classifier matching the current ``tolerance``, loaded on first use.
+    :vartype classifier: app.classifier.RankClassifier or None
+
     :ivar stop_at_ss: Minimum number of SS-rank pips required to stop rerolling.
     :vartype stop_at_ss: int
 
@@ -66,6 +84,20 @@ class PipRerollerApp:
     :ivar post_reroll_delay_ms: Delay in milliseconds after each reroll before next action.
     :vartype post_reroll_delay_ms: int
 
+    :ivar wait_for_settle: Continue after a reroll as soon as the pips changed and settled,
+        waiting at most ``post_reroll_delay_ms``.
+    :vartype wait_for_settle: tkinter.BooleanVar
+
+    :ivar coarse_detection: Detect in the coarse-to-fine ``"pyramid"`` mode instead of classifying
+        every pixel; applies from the next start.
+    :vartype coarse_detection: tkinter.BooleanVar
+
+    :ivar settle_enabled: Value of ``wait_for_settle``, mirrored for the reroll thread.
+    :vartype settle_enabled: bool
+
+    :ivar coarse_enabled: Value of ``coarse_detection``, mirrored for the hotkey thread.
+    :vartype coarse_enabled: bool
+
     :ivar object_tolerance: Pixel tolerance for merging detected objects.
     :vartype object_tolerance: int
 
@@ -90,13 +122,19 @@ class PipRerollerApp:
     :ivar message_var: Text variable for message label in the GUI.
     :vartype message_var: tkinter.StringVar
 
+    :ivar poll_stats_var: Text variable for the capture rate label in the GUI.
+    :vartype poll_stats_var: tkinter.StringVar
+
+    :ivar gui_mailbox: Updates posted by background threads, applied ``GUI_REFRESH_HZ`` times per second.
+    :vartype gui_mailbox: app.utils.GuiMailbox
+
     :ivar status_color: Color hex code for status label.
     :vartype status_color: str
 
-    :ivar log_buffer: Buffer holding log entries before dumping to file.
-    :vartype log_buffer: list
+    :ivar event_log: Background writer of detection events when logging is enabled.
+    :vartype event_log: app.eventlog.EventLog or None
 
-    :ivar log_button: Button widget to manually dump logs when logging is enabled.
+    :ivar log_button: Button widget to manually flush logs when logging is enabled.
     :vartype log_button: tkinter.Button or None
 
     :ivar last_detected_objs: Cache of last detected objects to prevent attribute errors.
@@ -111,14 +149,33 @@ class PipRerollerApp:
     :ivar preview_thread: Background thread for preview mode.
     :vartype preview_thread: threading.Thread or None
 
+    :ivar preview_tap: Passes the image processor's frames and detections to the preview,
+        created with the first image processor.
+    :vartype preview_tap: app.pipeline.PreviewTap or None
+
     :ivar stop_reroll_event: Event to signal stopping the reroll automation.
     :vartype stop_reroll_event: threading.Event
 
-    :ivar listener: Keyboard listener for hotkey handling.
-    :vartype listener: pynput.keyboard.Listener
+    :ivar hub: Publishes detections to the slot display and other subscribers, if ``ENABLE_SLOTS_SOCKET`` is set.
+    :vartype hub: app.hub.DetectionHub or None
 
-    :ivar ahk: AutoHotkey interface for sending inputs to the game.
-    :vartype ahk: ahk.AHK
+    :ivar metrics_server: Serves the metrics on localhost, if ``ENABLE_METRICS_ENDPOINT`` is set.
+    :vartype metrics_server: app.metrics.MetricsServer or None
+
+    :ivar metrics_window: Window of the metrics panel while it is shown.
+    :vartype metrics_window: tkinter.Toplevel or None
+
+    :ivar profile_button_var: Text of the button starting and stopping the profiler.
+    :vartype profile_button_var: tkinter.StringVar
+
+    :ivar listener: Keyboard listener for hotkey handling, started once the window is drawn.
+    :vartype listener: pynput.keyboard.Listener or None
+
+    :ivar ahk: AutoHotkey interface for sending inputs to the game, initialized once the window is drawn.
+    :vartype ahk: ahk.AHK or None
+
+    :ivar ready: Set once AHK is initialized, before the hotkeys start.
+    :vartype ready: threading.Event
 
     :meth __init__: Initializes the GUI, variables, threads, and event bindings.
     """
@@ -136,12 +193,15 @@ class PipRerollerApp:
         """
         self.root = root
         self.root.title("Auto Chiseler by Riri")
-        self.root.geometry("440x600") # Increased height for new input field
+        self.root.geometry("440x740") # Increased height for new input fields
         self.root.configure(bg=bg)
         self.root.attributes("-topmost", True) # Keep GUI on top
 
         # Configuration variables
         self.game_area = None
+        self.roi_store = RoiStore(SLOT_ROI_FILE)
+        self.exclusion_areas = list(self.roi_store.exclusions)
+        self.selection_mode = "game_area" # What the area selection overlay selects
         self.chisel_button_pos = None
         self.buy_button_pos = None
         self.preview_active = False
@@ -151,25 +211,34 @@ class PipRerollerApp:
         self.stop_at_ss = 0
         self.click_delay_ms = 50
         self.post_reroll_delay_ms = 500
+        self.wait_for_settle = BooleanVar(value=WAIT_FOR_SETTLE)
+        self.coarse_detection = BooleanVar(value=DETECTION_MODE == "pyramid")
+        # Tk variables may only be read on the main thread; the reroll and hotkey threads read these copies
+        self.settle_enabled = self.wait_for_settle.get()
+        self.coarse_enabled = self.coarse_detection.get()
+        self.wait_for_settle.trace_add("write", lambda *_: setattr(self, "settle_enabled", self.wait_for_settle.get()))
+        self.coarse_detection.trace_add("write", lambda *_: setattr(self, "coarse_enabled", self.coarse_detection.get()))
         self.object_tolerance = 10
         self.image_poll_delay_ms = 10 # How often the image processor polls
-        self.stop_confirm_delay_ms = 50 # Delay before confirming stop conditions
+        self.stop_confirm_frames = STOP_CONFIRM_FRAMES # Frames a stop condition must hold before stopping
+
+        self.classifier = None # Loaded on first use and rebuilt lazily when tolerance changes
 
         self.min_quality = "F"
         self.min_objects = 1
+        self.refresh_logged_settings() # Snapshot written to the event log, rebuilt when a setting changes
         self.game_window_title = StringVar(value="Roblox")
 
-        self.processor = ImageProcessor(self)
-        self.processor.delay_ms = self.stop_confirm_delay_ms
-
         # GUI state variables
         self.rank_counts = {rank: 0 for rank, _, _ in RANKS} # Updated by ImageProcessor via GUI callback
         self.status_var = StringVar(value="Status: Suspended")
         self.message_var = StringVar(value="")
+        self.poll_stats_var = StringVar(value="")
+        self.gui_mailbox = GuiMailbox() # Background threads post here instead of calling root.after
         self.status_color = "#ff5555"
 
         # [DEBUG] Enable/disable logging
-        self.log_buffer = []
+        self.event_log = None
         self.log_button = None
         self.last_detected_objs = [] # Prevent attribute errors if the reroll loop runs before detections
 
@@ -177,8 +246,26 @@ class PipRerollerApp:
         self.image_processor_thread = None
         self.reroll_loop_thread = None
         self.preview_thread = None
+        self.preview_tap = None # Preview shows the processor's frames while it runs
         self.stop_reroll_event = threading.Event() # Event for reroll loop to stop
 
+        # Detection hub for slots.pyw and other subscribers, kept up across runs so they stay connected
+        self.hub = None
+        if ENABLE_SLOTS_SOCKET:
+            from app.hub import DetectionHub
+            self.hub = DetectionHub("localhost", SLOTS_SOCKET_PORT)
+            self.hub.start()
+
+        # Metrics for Prometheus or a browser, see app.metrics
+        self.metrics_server = None
+        if ENABLE_METRICS_ENDPOINT:
+            self.metrics_server = MetricsServer(port=METRICS_PORT)
+            self.metrics_server.start()
+        self.metrics_window = None
+        self.profile_button_var = StringVar(value="Start Profiling")
+        self._profile_writer = None
+        self._roll_history = deque(maxlen=61) # (time, rolls) once per second while the metrics panel is shown
+
         # --- GUI Elements ---
         pad_y = 5
 
@@ -214,11 +301,30 @@ class PipRerollerApp:
         self.post_reroll_delay_entry.insert(0, str(self.post_reroll_delay_ms))
         self.post_reroll_delay_entry.bind('<KeyRelease>', self.update_post_reroll_delay)
 
+        settle_check = tk.Checkbutton(
+            root, text="Wait for Pips to Settle", variable=self.wait_for_settle,
+            fg=label_fg, bg=bg, selectcolor=entry_bg, activebackground=bg, activeforeground=label_fg
+        )
+        settle_check.pack(pady=(5, 0))
+        Tooltip(settle_check, "Reroll again as soon as the pips changed and stopped changing,\n"
+                              "instead of always waiting the full Post Reroll Delay.\n"
+                              "Post Reroll Delay becomes the longest wait.")
+
+        coarse_check = tk.Checkbutton(
+            root, text="Coarse-to-Fine Detection", variable=self.coarse_detection,
+            fg=label_fg, bg=bg, selectcolor=entry_bg, activebackground=bg, activeforeground=label_fg
+        )
+        coarse_check.pack()
+        Tooltip(coarse_check, "Check every few pixels first and only look closely around matches.\n"
+                              "Much faster on large areas; pips smaller than a few pixels may be missed.\n"
+                              "Applies from the next start.")
+
         frame_poll_delay = tk.Frame(root, bg=bg)
         frame_poll_delay.pack(pady=(10, 0))
         poll_label = make_label("Image Poll Delay (ms):")
         poll_label.pack(in_=frame_poll_delay, side="left")
-        Tooltip(poll_label, "How often to check for pips (in milliseconds).\nLower values update faster but use more CPU.\nDecrease if the macro accidentally rerolls on a suspend condition.")
+        Tooltip(poll_label, "How often to check for pips (in milliseconds).\nLower values update faster but use more CPU.\nDecrease if the macro accidentally rerolls on a suspend condition.\n"
+                            "With adaptive polling this is the delay right after a click or change;\nit grows while the pips stay the same.")
         self.image_poll_delay_entry = Entry(frame_poll_delay, bg=entry_bg, fg=entry_fg, insertbackground='white', width=6)
         self.image_poll_delay_entry.pack(side="left", padx=(10, 0))
         self.image_poll_delay_entry.insert(0, str(self.image_poll_delay_ms))
@@ -266,18 +372,19 @@ class PipRerollerApp:
 
         frame_stop_delay = tk.Frame(root, bg=bg)
         frame_stop_delay.pack(pady=(10, 0))
-        delay_confirm_label = tk.Label(frame_stop_delay, text="Stop Confirm Delay (ms):", fg=label_fg, bg=bg)
-        delay_confirm_label.pack(side="left")
-        Tooltip(delay_confirm_label, 
-                "How long to wait before confirming stop conditions.\n"
+        confirm_frames_label = tk.Label(frame_stop_delay, text="Stop Confirm Frames:", fg=label_fg, bg=bg)
+        confirm_frames_label.pack(side="left")
+        Tooltip(confirm_frames_label, 
+                "How many captured frames in a row must show the same pips meeting\n"
+                "the stop conditions before stopping.\n"
                 "Helps avoid false stops caused by the game showing the item below\n"
                 "while it's still returning the item you actually rerolled.\n"
                 "Increase this if the game takes too long to finish returning charms."
         )
-        self.stop_confirm_delay_entry = Entry(frame_stop_delay, bg=entry_bg, fg=entry_fg, insertbackground='white', width=6)
-        self.stop_confirm_delay_entry.pack(side="left", padx=5)
-        self.stop_confirm_delay_entry.insert(0, str(self.stop_confirm_delay_ms))
-        self.stop_confirm_delay_entry.bind('<KeyRelease>', self.update_stop_confirm_delay)
+        self.stop_confirm_frames_entry = Entry(frame_stop_delay, bg=entry_bg, fg=entry_fg, insertbackground='white', width=6)
+        self.stop_confirm_frames_entry.pack(side="left", padx=5)
+        self.stop_confirm_frames_entry.insert(0, str(self.stop_confirm_frames))
+        self.stop_confirm_frames_entry.bind('<KeyRelease>', self.update_stop_confirm_frames)
 
         # Minimum Quality row
         frame_quality = tk.Frame(root, bg=bg)
@@ -344,6 +451,15 @@ class PipRerollerApp:
         tk.Button(btn_frame, text="Set Chisel Button", command=self.start_chisel_button_selection, **btn_opts).grid(row=0, column=1, padx=5, pady=pad_y)
         tk.Button(btn_frame, text="Set Buy Button", command=self.start_buy_button_selection, **btn_opts).grid(row=1, column=0, padx=5, pady=pad_y)
         tk.Button(btn_frame, text="Start Preview", command=self.start_preview, **btn_opts).grid(row=1, column=1, padx=5, pady=pad_y)
+        tk.Button(btn_frame, text="Show Metrics", command=self.toggle_metrics_panel, **btn_opts).grid(row=2, column=0, padx=5, pady=pad_y)
+        tk.Button(btn_frame, textvariable=self.profile_button_var, command=self.toggle_profiling, **btn_opts).grid(row=2, column=1, padx=5, pady=pad_y)
+        exclude_button = tk.Button(btn_frame, text="Exclude Area", command=self.start_exclusion_selection, **btn_opts)
+        exclude_button.grid(row=3, column=0, padx=5, pady=pad_y)
+        Tooltip(exclude_button, "Drag over a part of the screen whose pip-colored shapes\nshould never count as pips.")
+        reset_slots_button = tk.Button(btn_frame, text="Reset Slots", command=self.reset_slots, **btn_opts)
+        reset_slots_button.grid(row=3, column=1, padx=5, pady=pad_y)
+        Tooltip(reset_slots_button, "Forget the learned pip slots and the excluded areas.\n"
+                                    "Slots are learned again from the next detections.")
 
         self.status_label = tk.Label(root, textvariable=self.status_var, fg=self.status_color,
                                      bg=bg, font=("Arial", 12, "bold"))
@@ -353,133 +469,175 @@ class PipRerollerApp:
                                       fg="#ff6666", bg=bg, font=("Arial", 10))
         self.message_label.pack()
 
-        hotkey_label = tk.Label(root, text="Toggle Running: F5", fg="#888888", bg=bg, font=("Arial", 9))
-        hotkey_label.pack(pady=(10, 5))
+        poll_stats_label = tk.Label(root, textvariable=self.poll_stats_var, fg="#888888", bg=bg, font=("Arial", 9))
+        poll_stats_label.pack(pady=(5, 0))
+        Tooltip(poll_stats_label, "Current capture rate, and how many captures adaptive polling\n"
+                                  "skipped compared to always polling at the Image Poll Delay.")
 
-        # Keyboard listener
-        self.listener = keyboard.Listener(on_press=self.on_key_press)
-        self.listener.start()
+        hotkey_label = tk.Label(root, text="Toggle Running: F5    Toggle Profiling: F6", fg="#888888", bg=bg, font=("Arial", 9))
+        hotkey_label.pack(pady=(10, 5))
+        self.update_poll_stats_gui()
+        self.pump_gui_updates()
 
-        # AHK instance (default path to AutoHotkey.exe)
+        # Keyboard listener and AHK are set up by _warm_up once the window is drawn
+        self.listener = None
+        self.ahk = None
+        self.ready = threading.Event()
         print("App started")
-        try:
-            # Running from compiled executable
-            # Nuitka inserts the __compiled__ global when building
-            if "__compiled__" in globals():
-                base_dir = os.path.dirname(os.path.abspath(__file__))
-                ahk_path = os.path.abspath(os.path.join(base_dir, '..', 'assets', 'AutoHotkey.exe'))
-                print("Resolved AHK path:", ahk_path)
-                print("Exists:", os.path.exists(ahk_path))
-                self.ahk = AHK(executable_path=ahk_path)
-                print("AHK initialized successfully")
-            else:
-                # Running from source (assumes ahk[binary] installed or manually handled)
-                self.ahk = AHK()
-                print("AHK initialized in source mode")
-        except Exception as e:
-            print("Failed to initialize AHK:", e)
+        self.root.after(0, self._start_warm_up)
 
         # Ensure threads are cleanly stopped on app close
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
 
         if ENABLE_LOGGING:
-            def log_event(self, objects, rank_counts, settings, decision):
-                """
-                Logs a detection event with details about detected objects, counts, settings, and decisions.
-            
-                Each log entry includes a timestamp in UTC, the number of detected objects,
-                their ranks and screen locations, the current rank counts, relevant settings,
-                and the decision made by the application. Entries are appended to the internal
-                log buffer.
-            
-                :param list[dict] objects: List of detected objects, each containing keys like 'rank' and 'rect' (bounding box).
-                :param dict rank_counts: Dictionary mapping pip ranks to their counts at the time of logging.
-                :param dict settings: Dictionary of current application settings relevant to the detection.
-                :param str decision: Description of the decision or event that triggered the log entry.
-                :rtype: None
-                """
-                import datetime
-                if not objects:
-                    return
-                now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-                total_objs = len(objects)
-                obj_str = "; ".join(
-                    f"{o['rank']}@({o['rect'][0]},{o['rect'][1]},{o['rect'][2]},{o['rect'][3]})"
-                    for o in objects
-                )
-                counts_str = ", ".join(f"{rank}:{rank_counts[rank]}" for rank in rank_counts)
-                settings_str = ", ".join(f"{k}={v}" for k, v in settings.items())
-                log_line = (
-                    f"{now} | Objects Detected: {total_objs} | Object Locations: {obj_str} | Counts: {counts_str} | "
-                    f"Settings: {settings_str} | Decision: {decision}"
-                )
-                self.log_buffer.append(log_line)
-        
-            def dump_logs(self):
-                """
-                Writes all buffered log entries to a timestamped text file and clears the buffer.
-            
-                If no logs are present, updates the GUI message variable to indicate there are no logs to write.
-                After successfully writing the logs, updates the message variable with the filename.
-            
-                The log file is saved in the current working directory with a name including the current date and time.
-            
-                :rtype: None
-                """
-                import datetime
-                if not self.log_buffer:
-                    self.message_var.set("No logs to write.")
-                    return
-                filename = f"auto_chiseler_log_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-                with open(filename, "w", encoding="utf-8") as f:
-                    for line in self.log_buffer:
-                        f.write(line + "\n")
-                self.message_var.set(f"Logs written to {filename}")
-                self.log_buffer.clear()
+            self.event_log = EventLog(LOG_FILE, max_records=LOG_MAX_RECORDS, max_bytes=LOG_MAX_BYTES,
+                                      backups=LOG_BACKUPS, compress=LOG_COMPRESS)
+            self.event_log.start()
 
             self.log_count_label = tk.Label(
-                root, text="Logs ready to dump: 0", 
+                root, text="Logs pending: 0",
                 bg=bg, fg="#ffcc00", font=("Arial", 9, "bold")
             )
             self.log_count_label.place(relx=1.0, y=5, anchor='ne')  # top right
-        
+
             def update_log_count_label():
                 """
-                Periodically updates the GUI label displaying the number of logs currently buffered.
-            
-                This function schedules itself to run every 1000 milliseconds (1 second)
-                to refresh the label text, reflecting the latest count of logs waiting to be written.
-            
+                Periodically updates the GUI label displaying the event log counters.
+
+                This function schedules itself to run every 1000 milliseconds (1 second).
+
                 :rtype: None
                 """
-                # Update label text with current number of logs in buffer
-                count = len(self.log_buffer)
-                self.log_count_label.config(text=f"Logs ready to dump: {count}")
-        
-                # Schedule to run again after 1000 ms (1 second)
+                stats = self.event_log.stats()
+                text = f"Logs pending: {stats['pending']}, written: {stats['written']}"
+                if stats['dropped']:
+                    text += f", dropped: {stats['dropped']}"
+                self.log_count_label.config(text=text)
                 root.after(1000, update_log_count_label)
-        
-            # Start the periodic update loop
+
             update_log_count_label()
-        
-            # Attach methods to the instance
-            self.log_event = log_event.__get__(self)
-            self.dump_logs = dump_logs.__get__(self)
-        
+
             # Show the log button
             self.log_button = tk.Button(
-                root, text="DEBUG: Dump Logs", command=self.dump_logs,
+                root, text="DEBUG: Flush Logs", command=self.flush_logs,
                 bg=bg, fg="#ffcc00", font=("Arial", 9, "bold")
             )
             self.log_button.place(x=5, y=5)
-        else:
-            self.log_event = lambda *a, **k: None
+
+    def log_event(self, objects, rank_counts, settings, decision):
+        """
+        Logs a detection event if logging is enabled.
+
+        The event is only queued here; the event log formats and writes it to ``LOG_FILE``
+        in its own thread. Settings are written once per change.
+
+        :param list[dict] objects: List of detected objects, each containing keys like 'rank' and 'rect' (bounding box).
+        :param dict rank_counts: Dictionary mapping pip ranks to their counts at the time of logging.
+        :param dict settings: Dictionary of current application settings relevant to the detection.
+        :param str decision: Description of the decision or event that triggered the log entry.
+        :rtype: None
+        """
+        if self.event_log is not None and objects:
+            self.event_log.record(decision, objects, rank_counts, settings)
+
+    def logged_settings(self):
+        """
+        Returns the settings written to the event log.
+
+        The same snapshot is returned until a setting changes, so the event log only has to
+        compare it by identity. It must not be modified.
+
+        :rtype: dict
+        """
+        return self._logged_settings
+
+    def refresh_logged_settings(self):
+        """
+        Rebuilds the settings snapshot returned by ``logged_settings``, called on the Tk
+        thread whenever a logged setting changes.
+
+        :rtype: None
+        """
+        self._logged_settings = {
+            "min_quality": self.min_quality,
+            "min_objects": self.min_objects,
+            "stop_at_ss": self.stop_at_ss,
+            "tolerance": self.tolerance,
+            "object_tolerance": self.object_tolerance,
+            "click_delay_ms": self.click_delay_ms,
+            "post_reroll_delay_ms": self.post_reroll_delay_ms,
+            "image_poll_delay_ms": self.image_poll_delay_ms,
+            "stop_confirm_frames": self.stop_confirm_frames,
+            "game_area": self.game_area,
+            "chisel_button_pos": self.chisel_button_pos,
+            "buy_button_pos": self.buy_button_pos,
+        }
+
+    def flush_logs(self):
+        """
+        Has the event log write its queued events now.
+
+        :rtype: None
+        """
+        if self.event_log is None:
+            return
+        self.event_log.flush() # Written by the event log's thread, not before this returns
+        self.message_var.set(f"Flushing logs to {self.event_log.path}")
+
+    def _start_warm_up(self):
+        """
+        Start the background initialization once the window has been drawn.
+
+        :rtype: None
+        """
+        self.root.update_idletasks() # Draw the window before the warm-up competes for the GIL
+        threading.Thread(target=self._warm_up, daemon=True, name="WarmUp").start()
+
+    def _warm_up(self):
+        """
+        Initialize the slow subsystems in the background: AHK, the hotkey listener, the
+        detection pipeline and its lookup table, so the first start does not wait for them.
+
+        :rtype: None
+        """
+        try:
+            from ahk import AHK
+            # Running from compiled executable
+            # Nuitka inserts the __compiled__ global when building
+            if "__compiled__" in globals():
+                base_dir = os.path.dirname(os.path.abspath(__file__))
+                ahk_path = os.path.abspath(os.path.join(base_dir, '..', 'assets', 'AutoHotkey.exe'))
+                print("Resolved AHK path:", ahk_path)
+                print("Exists:", os.path.exists(ahk_path))
+                self.ahk = AHK(executable_path=ahk_path)
+                print("AHK initialized successfully")
+            else:
+                # Running from source (assumes ahk[binary] installed or manually handled)
+                self.ahk = AHK()
+                print("AHK initialized in source mode")
+        except Exception as e:
+            print("Failed to initialize AHK:", e)
+        self.ready.set() # Before the hotkeys, so F5 always finds AHK initialized
+
+        try:
+            from pynput import keyboard
+            self.listener = keyboard.Listener(on_press=self.on_key_press)
+            self.listener.start()
+        except Exception as e:
+            print("Failed to start the hotkey listener:", e)
+
+        # Not needed until the first start or preview, but slow to import or build
+        # (the Nuitka build includes these modules with --include-module)
+        importlib.import_module("app.processor")
+        if ENABLE_DISCORD_RPC:
+            importlib.import_module("app.discord_rpc")
+        self.get_classifier()
 
     def _on_closing(self):
         """
         Handle graceful shutdown when the application window is closed.
     
-        This method stops background threads such as the image processor and keyboard listener,
+        This method stops background threads such as the image processor, detection hub and keyboard listener,
         waits briefly for the image processor thread to finish, signals the main reroll loop to stop,
         and finally destroys the main Tkinter window.
     
@@ -489,7 +647,14 @@ class PipRerollerApp:
         if self.image_processor_thread and self.image_processor_thread.is_alive():
             self.image_processor_thread.stop() # Tell image processor to stop and cleanup
             self.image_processor_thread.join(timeout=1.0) # Wait for it to finish
-        self.listener.stop() # Stop keyboard listener
+        if self.hub is not None:
+            self.hub.stop() # Disconnect subscribers
+        if self.event_log is not None:
+            self.event_log.stop() # Write the remaining events
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        if self.listener is not None:
+            self.listener.stop() # Stop keyboard listener
         self.root.destroy()
 
     def select_quality(self, rank):
@@ -503,6 +668,7 @@ class PipRerollerApp:
         :rtype: None
         """
         self.min_quality = rank
+        self.refresh_logged_settings()
         for r, btn in self.quality_buttons.items():
             if r == rank:
                 btn.config(relief="sunken", bg=RANK_TK_HEX[r], fg="#222222")
@@ -524,6 +690,7 @@ class PipRerollerApp:
             val = int(self.tolerance_entry.get())
             if 0 <= val <= 255:
                 self.tolerance = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -542,6 +709,7 @@ class PipRerollerApp:
             val = int(self.stop_at_entry.get())
             if val >= 0:
                 self.stop_at_ss = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -561,6 +729,7 @@ class PipRerollerApp:
             val = int(self.min_objects_entry.get())
             if val >= 1:
                 self.min_objects = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -580,6 +749,7 @@ class PipRerollerApp:
             val = int(self.click_delay_entry.get())
             if val >= 0:
                 self.click_delay_ms = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -599,6 +769,7 @@ class PipRerollerApp:
             val = int(self.post_reroll_delay_entry.get())
             if val >= 0:
                 self.post_reroll_delay_ms = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -618,6 +789,7 @@ class PipRerollerApp:
             val = int(self.image_poll_delay_entry.get())
             if val >= 0:
                 self.image_poll_delay_ms = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -637,15 +809,16 @@ class PipRerollerApp:
             val = int(self.object_tolerance_entry.get())
             if val >= 0:
                 self.object_tolerance = val
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
-    def update_stop_confirm_delay(self, event=None):
+    def update_stop_confirm_frames(self, event=None):
         try:
-            val = int(self.stop_confirm_delay_entry.get())
-            self.stop_confirm_delay_ms = val
-            if hasattr(self, "processor") and self.processor:
-                self.processor.delay_ms = val
+            val = int(self.stop_confirm_frames_entry.get())
+            if val >= 1:
+                self.stop_confirm_frames = val # Read by the image processor on every frame
+                self.refresh_logged_settings()
         except ValueError:
             pass
 
@@ -657,6 +830,27 @@ class PipRerollerApp:
         window with a crosshair cursor. This overlay captures mouse events to allow the user
         to drag and select a rectangular area of the screen for detection.
     
+        :rtype: None
+        """
+        self.selection_mode = "game_area"
+        self._open_selection_overlay()
+
+    def start_exclusion_selection(self):
+        """
+        Initiate the selection of a screen area whose pips are ignored.
+    
+        Uses the same overlay as ``start_area_selection``; the selected area is added to
+        ``exclusion_areas`` and saved with the learned slots.
+    
+        :rtype: None
+        """
+        self.selection_mode = "exclusion"
+        self._open_selection_overlay()
+
+    def _open_selection_overlay(self):
+        """
+        Show the fullscreen overlay the areas are dragged on.
+    
         :rtype: None
         """
         self.root.iconify() # Minimize main window
@@ -714,11 +908,33 @@ class PipRerollerApp:
         """
         x1, y1 = self.drag_start
         x2, y2 = event.x_root, event.y_root
-        self.game_area = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        area = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
         self.selection_overlay.destroy()
         self.root.deiconify() # Restore main window
+        if self.selection_mode == "exclusion":
+            if area[2] > area[0] and area[3] > area[1]:
+                self.exclusion_areas = self.exclusion_areas + [area] # Replaced, the processor may be iterating it
+                self.roi_store.set_exclusions(self.exclusion_areas)
+            self.message_var.set(f"Excluded areas: {len(self.exclusion_areas)}.")
+            return
+        self.game_area = area
+        self.refresh_logged_settings()
         self.message_var.set("Game area set.")
 
+    def reset_slots(self):
+        """
+        Forget the learned pip slots and the excluded areas, in this session and on disk.
+    
+        :rtype: None
+        """
+        self.exclusion_areas = []
+        self.roi_store.clear_slots()
+        self.roi_store.set_exclusions([])
+        processor = self.image_processor_thread
+        if processor is not None:
+            processor.reset_slots()
+        self.message_var.set("Learned slots and excluded areas cleared.")
+
     def start_chisel_button_selection(self):
         """
         Initiate the selection process for the 'Chisel' button position.
@@ -786,6 +1002,7 @@ class PipRerollerApp:
             self.chisel_button_pos = pos
         else:
             self.buy_button_pos = pos
+        self.refresh_logged_settings()
         overlay.destroy()
         self.root.deiconify()
         self.message_var.set(f"{button_type.capitalize()} button set at {pos}")
@@ -795,17 +1012,20 @@ class PipRerollerApp:
         Handle keyboard key presses, toggling reroller on/off when F5 is pressed.
         
         If the F5 key is detected, starts the rerolling loop if it is not running,
-        otherwise stops the running loop.
+        otherwise stops the running loop. F6 starts or stops the profiler.
         
         :param key: The key event to handle.
         :type key: pynput.keyboard.Key
         :rtype: None
         """
+        from pynput import keyboard
         if key == keyboard.Key.f5:
             if not self.running:
                 self.start_running_async()
             else:
                 self.stop_running_async()
+        elif key == keyboard.Key.f6:
+            self.gui_mailbox.send(self.toggle_profiling) # Toggled on the main thread, once per press
 
     def start_running_async(self):
         """
@@ -837,6 +1057,12 @@ class PipRerollerApp:
             self.message_var.set("Please enter a Game Window Title.") # This logic is here if we ever decide to extend support for bootstrappers that might not have the same window title
             return
 
+        if not self.ready.is_set():
+            self.message_var.set("Still starting up, please try again in a moment.") # Never wait here, the window would freeze
+            return
+        if self.ahk is None:
+            self.message_var.set("Error: AutoHotkey is not available.")
+            return
         if not self.ahk.win_exists(target_title):
             self.message_var.set(f"Error: Game window '{target_title}' not found. Please ensure it's open.")
             return
@@ -856,13 +1082,19 @@ class PipRerollerApp:
 
         # Start the Image Processor thread if not already running
         if self.image_processor_thread is None or not self.image_processor_thread.is_alive():
-            self.image_processor_thread = ImageProcessor(self)
+            from app.pipeline import PreviewTap
+            from app.processor import ImageProcessor
+            if self.preview_tap is None:
+                self.preview_tap = PreviewTap()
+            mode = "pyramid" if self.coarse_enabled else "exact"
+            self.image_processor_thread = ImageProcessor(self, hub=self.hub, preview=self.preview_tap,
+                                                         roi_store=self.roi_store, detection_mode=mode)
             self.image_processor_thread.stop_event.clear() # Clear any previous stop signal
             self.image_processor_thread.start()
         
         # Start the Reroll Loop thread if not already running
         if self.reroll_loop_thread is None or not self.reroll_loop_thread.is_alive():
-            self.reroll_loop_thread = threading.Thread(target=self.reroll_loop, daemon=True)
+            self.reroll_loop_thread = threading.Thread(target=self.reroll_loop, daemon=True, name="RerollLoop")
             self.reroll_loop_thread.start()
 
     def stop_running_async(self):
@@ -898,28 +1130,174 @@ class PipRerollerApp:
             self.status_var.set("Status: Suspended")
             self.status_label.config(fg="#ff5555")
 
+    def post_gui_update(self, key, value):
+        """
+        Post a GUI update from any thread; it is applied by ``pump_gui_updates`` on the main thread.
+    
+        Only the newest value of each kind is applied, so posting on every frame is cheap.
+    
+        :param str key: ``"detections"`` for ``update_rank_counts_gui`` or ``"message"`` for the message label.
+        :param value: The detected objects or the message text.
+        :rtype: None
+        """
+        self.gui_mailbox.post(key, value)
+
+    def pump_gui_updates(self):
+        """
+        Periodically apply the GUI updates posted by background threads.
+    
+        Runs on the Tkinter main thread ``GUI_REFRESH_HZ`` times per second and only touches
+        widgets whose values changed, so the GUI stays responsive at any detection rate.
+    
+        :rtype: None
+        """
+        updates = self.gui_mailbox.drain()
+        if "detections" in updates:
+            self.update_rank_counts_gui(updates["detections"])
+        if "message" in updates and updates["message"] != self.message_var.get():
+            self.message_var.set(updates["message"])
+        if "profile_button" in updates:
+            self.profile_button_var.set(updates["profile_button"])
+        for command in self.gui_mailbox.commands():
+            command()
+        self.root.after(max(1, int(1000 / GUI_REFRESH_HZ)), self.pump_gui_updates)
+
     def update_rank_counts_gui(self, detected_objs):
         """
         Update the rank count display in the GUI.
     
-        Called from the ImageProcessor thread via root.after() to safely update GUI elements.
-        Updates internal counts and refreshes the Tkinter StringVars to reflect detected pip counts.
+        Called on the main thread by ``pump_gui_updates`` with the newest detections.
+        Updates internal counts and refreshes the Tkinter StringVars whose counts changed.
     
         :param detected_objs: List of detected pip objects with 'rank' keys.
         :type detected_objs: list
         :rtype: None
         """
         self.last_detected_objs = detected_objs # Store latest detected objects for logging
-        # Reset counts for all ranks
-        for rank in self.rank_count_vars:
-            self.rank_counts[rank] = 0
         # Count detected objects by rank
+        counts = {rank: 0 for rank in self.rank_count_vars}
         for obj in detected_objs:
-            self.rank_counts[obj['rank']] += 1
+            counts[obj['rank']] += 1
 
-        # Update Tkinter StringVars to refresh GUI labels
-        for rank in self.rank_count_vars:
-            self.rank_count_vars[rank].set(str(self.rank_counts[rank]))
+        # Update only the Tkinter StringVars whose count changed
+        for rank, count in counts.items():
+            if count != self.rank_counts[rank]:
+                self.rank_counts[rank] = count
+                self.rank_count_vars[rank].set(str(count))
+
+    def toggle_profiling(self):
+        """
+        Start the profiler, or stop it and write its results.
+
+        The profiler samples the stacks of the image processor, capture, reroll and other
+        threads, and compares the memory use between start and stop (see ``app.profiling``).
+        Writing the results can take a few seconds, so it happens in a background thread.
+
+        :rtype: None
+        """
+        if self._profile_writer is not None and self._profile_writer.is_alive():
+            return # Still writing the previous results
+        if not PROFILER.active:
+            PROFILER.start()
+            self.profile_button_var.set("Stop Profiling")
+            self.message_var.set("Profiling... press F6 to stop and write the results.")
+            return
+
+        self.profile_button_var.set("Writing Profile...")
+        def finish():
+            files = PROFILER.stop()
+            self.post_gui_update("profile_button", "Start Profiling")
+            if files:
+                self.post_gui_update("message", f"Profile written to {os.path.dirname(files[0]) or '.'}")
+            else:
+                self.post_gui_update("message", "Profile could not be written.")
+        self._profile_writer = threading.Thread(target=finish, daemon=True, name="ProfileWriter")
+        self._profile_writer.start()
+
+    def toggle_metrics_panel(self):
+        """
+        Show or hide the metrics panel.
+
+        The panel lists the rerolls per minute, the frame counters and the p50/p99 duration
+        of every processing stage, refreshed once per second.
+
+        :rtype: None
+        """
+        if self.metrics_window is not None:
+            self.metrics_window.destroy()
+            self.metrics_window = None
+            return
+        self.metrics_window = tk.Toplevel(self.root)
+        self.metrics_window.title("Metrics")
+        self.metrics_window.configure(bg=bg)
+        self.metrics_window.attributes("-topmost", True)
+        self.metrics_window.protocol("WM_DELETE_WINDOW", self.toggle_metrics_panel)
+        label = tk.Label(self.metrics_window, fg=label_fg, bg=bg, font=("Courier New", 9), justify="left")
+        label.pack(padx=10, pady=10)
+        self._roll_history.clear()
+        self.update_metrics_panel(self.metrics_window, label)
+
+    def update_metrics_panel(self, window, label):
+        """
+        Periodically refresh the metrics panel until it is closed.
+
+        :param tkinter.Toplevel window: The panel's window.
+        :param tkinter.Label label: Label showing the metrics.
+        :rtype: None
+        """
+        if window is not self.metrics_window:
+            return # Closed
+        snapshot = REGISTRY.snapshot()
+        def total(name):
+            return sum(snapshot.get(name, {}).values())
+
+        now = time.perf_counter()
+        self._roll_history.append((now, total("rolls_total")))
+        (first_time, first_rolls), (last_time, last_rolls) = self._roll_history[0], self._roll_history[-1]
+        per_min = (last_rolls - first_rolls) * 60 / (last_time - first_time) if last_time > first_time else 0.0
+
+        lines = [
+            f"Rolls: {last_rolls} ({per_min:.1f}/min)",
+            f"Frames: {total('frames_analyzed_total')} analyzed, {total('frames_dropped_total')} dropped",
+        ]
+        processor = self.image_processor_thread
+        if processor is not None and processor.slot_rois:
+            slots = processor.get_roi_stats()
+            lines.append(f"Slots: {slots['slots']} learned, {slots['hit_rate']:.1%} hits, "
+                         f"{slots['misses']} full scans, {slots['relearns']} relearns")
+        lines += [
+            "",
+            f"{'stage':<12}{'count':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}",
+        ]
+        stages = sorted(snapshot.get("stage_seconds", {}).items(), key=lambda item: dict(item[0])["stage"])
+        for labels, stats in stages:
+            lines.append(f"{dict(labels)['stage']:<12}{stats['count']:>8}{stats[0.5] * 1000:>9.2f}"
+                         f"{stats[0.99] * 1000:>9.2f}{stats['max'] * 1000:>9.2f}")
+        for name, title in (("roll_seconds", "roll"), ("decision_latency_seconds", "decision")):
+            for stats in snapshot.get(name, {}).values():
+                lines.append(f"{title:<12}{stats['count']:>8}{stats[0.5] * 1000:>9.2f}"
+                             f"{stats[0.99] * 1000:>9.2f}{stats['max'] * 1000:>9.2f}")
+        label.config(text="\n".join(lines))
+        self.root.after(1000, self.update_metrics_panel, window, label)
+
+    def update_poll_stats_gui(self):
+        """
+        Periodically refresh the capture rate label from the running image processor.
+    
+        :rtype: None
+        """
+        processor = self.image_processor_thread
+        if processor is not None and processor.is_alive():
+            stats = processor.get_poll_stats()
+            slots = processor.get_roi_stats()
+            self.poll_stats_var.set(
+                f"Polling: {stats['fps']:.0f} fps, {stats['saved']:.0%} fewer captures, "
+                f"detection {stats['detect_ms']:.1f} ms" +
+                (f", {slots['hit_rate']:.0%} in slots" if slots["slots"] else "")
+            )
+        else:
+            self.poll_stats_var.set("Polling: idle")
+        self.root.after(1000, self.update_poll_stats_gui)
 
     def start_preview(self):
         """
@@ -941,20 +1319,28 @@ class PipRerollerApp:
             return
     
         self.preview_active = True
-        self.preview_thread = threading.Thread(target=self.preview_loop, daemon=True)
+        self.preview_thread = threading.Thread(target=self.preview_loop, daemon=True, name="Preview")
         self.preview_thread.start()
 
     def preview_loop(self):
         """
         Background loop for live preview of pip detection.
     
-        Continuously captures screenshots of the game area, detects pips,
-        draws bounding boxes with labels, and displays them in an OpenCV window.
+        While the image processor runs, shows the frames and detections it already produced;
+        otherwise captures screenshots of the game area and detects pips itself.
+        Draws bounding boxes with labels into a reused buffer and displays them in an
+        OpenCV window, at most ``PREVIEW_MAX_FPS`` times per second.
         Runs until preview is deactivated.
     
         :rtype: None
         """
-        preview_capturer = ScreenCapture()
+        import cv2
+        import numpy as np
+        from app.capture import ScreenCapture
+        preview_capturer = None # Only created while the image processor is not running
+        debug_frame = None
+        interval = 1 / max(1, PREVIEW_MAX_FPS)
+        next_due = time.perf_counter()
         cv2.namedWindow("BBox Preview", cv2.WINDOW_AUTOSIZE)
         cv2.setWindowProperty("BBox Preview", cv2.WND_PROP_TOPMOST, 1)
     
@@ -963,66 +1349,81 @@ class PipRerollerApp:
                 time.sleep(0.05)
                 continue
     
-            frame = preview_capturer.capture(bbox=self.game_area)
-            if frame is None:
-                time.sleep(0.05)
-                continue
-    
-            detected_objs = self.detect_and_classify(frame)
-            # Update GUI rank counts safely on the main thread
-            self.root.after(0, lambda objs=detected_objs: self.update_rank_counts_gui(objs))
+            shared = None
+            processor = self.image_processor_thread
+            if processor is not None and processor.is_alive():
+                self.preview_tap.request()
+                shared = self.preview_tap.wait(timeout=0.2)
+            if shared is not None and shared[2] == tuple(self.game_area):
+                frame, detected_objs, _ = shared # The processor already updated the rank counts
+            else:
+                if preview_capturer is None:
+                    preview_capturer = ScreenCapture()
+                frame = preview_capturer.capture(bbox=self.game_area)
+                if frame is None:
+                    time.sleep(0.05)
+                    continue
+                detected_objs = self.detect_and_classify(frame)
+                # Update GUI rank counts safely on the main thread
+                self.post_gui_update("detections", detected_objs)
     
-            debug_frame = frame.copy()
+            if debug_frame is None or debug_frame.shape != frame.shape:
+                debug_frame = np.empty_like(frame)
+            np.copyto(debug_frame, frame)
             for obj in detected_objs:
                 x, y, w, h = obj['rect']
                 color = obj['cv2color']
                 cv2.rectangle(debug_frame, (x, y), (x+w, y+h), color, 2)
-                cv2.putText(debug_frame, obj['rank'], (x+2, y+18), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
+                label = f"{obj['rank']} #{obj['id']}" if 'id' in obj else obj['rank'] # Tracked pips come from the processor
+                cv2.putText(debug_frame, label, (x+2, y+18), cv2.FONT_HERSHEY_SIMPLEX, 0.7, color, 2)
     
             cv2.imshow("BBox Preview", debug_frame)
             # Use a very short waitKey and check preview_active frequently
             if cv2.waitKey(1) & 0xFF == ord('q'):
                 self.preview_active = False
                 break
-            time.sleep(0.01)  # Small sleep to reduce CPU usage
+            # Cap the refresh rate, independently of the polling rate
+            next_due = max(next_due + interval, time.perf_counter())
+            time.sleep(max(0.0, next_due - time.perf_counter()))
     
         cv2.destroyAllWindows()
-        preview_capturer.close()
+        if preview_capturer is not None:
+            preview_capturer.close()
 
     def detect_and_classify(self, frame):
         """
         Detect and classify pip objects within an image frame.
     
-        Processes the input frame by applying color masks for each rank,
-        performs morphological operations to clean the mask,
-        detects contours, filters by area, merges close rectangles,
-        and returns a sorted list of detected pip objects with their rank and bounding box.
+        Classifies every pixel into rank bitmasks in a single lookup-table pass,
+        then extracts the blobs of each rank present in the frame with connected
+        components, merges close rectangles, and returns a sorted list of detected
+        pip objects with their rank and bounding box.
     
         :param frame: The image frame to process (BGR color).
         :type frame: numpy.ndarray
         :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
         :rtype: list of dict
         """
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        detected = []
-        for rank, bgr, _ in RANKS:
-            mask = self.rank_mask(frame, np.array(bgr), self.tolerance)
-            # Apply morphological closing to connect nearby pixels and fill small gaps
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            # Filter contours by area to remove noise and get bounding rectangles
-            rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 1]
-            # Merge overlapping or close rectangles
-            merged_rects = self.merge_rectangles(rects, self.object_tolerance)
-            for rect in merged_rects:
-                detected.append({
-                    "rank": rank,
-                    "rect": rect,
-                    "cv2color": bgr
-                })
-        # Sort detected objects by rank order (highest rank first)
-        detected.sort(key=lambda o: -RANK_ORDER[o['rank']])
-        return detected
+        from app.detection import detect_objects
+        labels = self.get_classifier().classify(frame)
+        return detect_objects(labels, self.object_tolerance)
+
+    def get_classifier(self):
+        """
+        Return the rank classifier for the current color tolerance.
+    
+        The lookup table is only rebuilt (or loaded from the disk cache) when
+        ``tolerance`` differs from the one the current classifier was built for.
+    
+        :returns: A classifier matching ``self.tolerance``.
+        :rtype: app.classifier.RankClassifier
+        """
+        from app.classifier import RankClassifier
+        classifier = self.classifier
+        if classifier is None or classifier.tolerance != self.tolerance:
+            classifier = RankClassifier.load(self.tolerance)
+            self.classifier = classifier
+        return classifier
 
     def rank_mask(self, frame, color_bgr, tolerance):
         """
@@ -1040,6 +1441,7 @@ class PipRerollerApp:
         :returns: Binary mask image with 255 where pixels match, 0 elsewhere.
         :rtype: numpy.ndarray
         """
+        import numpy as np
         # Calculate absolute difference between frame pixels and target color
         diff = np.abs(frame.astype(np.int16) - color_bgr)
         # Create mask where all color channels are within tolerance
@@ -1050,8 +1452,7 @@ class PipRerollerApp:
         """
         Merge rectangles that are close to each other into combined bounding boxes.
     
-        Useful for merging fragmented detections of the same object by expanding bounding boxes
-        that are within the specified max_distance of each other.
+        Thin wrapper around ``app.detection.merge_rectangles``.
     
         :param rects: List of rectangles as (x, y, w, h) tuples.
         :type rects: list of tuples
@@ -1060,75 +1461,8 @@ class PipRerollerApp:
         :returns: List of merged rectangles as (x, y, w, h) tuples.
         :rtype: list of tuples
         """
-        merged = []
-        used = [False] * len(rects)
-
-        def rect_distance(r1, r2):
-            """
-            Calculate the shortest Euclidean distance between the edges of two rectangles.
-        
-            Each rectangle is defined as (x, y, width, height). The distance is zero if the rectangles overlap
-            or touch. Otherwise, it returns the straight-line distance between the closest edges.
-        
-            :param r1: First rectangle (x, y, w, h).
-            :type r1: tuple
-            :param r2: Second rectangle (x, y, w, h).
-            :type r2: tuple
-            :returns: Euclidean distance between closest points of the rectangles.
-            :rtype: float
-            """
-            x1, y1, w1, h1 = r1
-            x2, y2, w2, h2 = r2
-
-            # Determine horizontal distance
-            left = x2 + w2 < x1
-            right = x1 + w1 < x2
-            dx = 0
-            if right:
-                dx = x2 - (x1 + w1)
-            elif left:
-                dx = x1 - (x2 + w2)
-
-            # Determine vertical distance
-            above = y2 + h2 < y1
-            below = y1 + h1 < y2
-            dy = 0
-            if below:
-                dy = y2 - (y1 + h1)
-            elif above:
-                dy = y1 - (y2 + h2)
-            
-            # Return hypotenuse (closest distance)
-            return np.hypot(dx, dy)
-
-        for i, r in enumerate(rects):
-            if used[i]:
-                continue # Skip if already merged
-
-            x, y, w, h = r
-            # Initialize merged_rect with current rectangle's bounds (min_x, min_y, max_x, max_y)
-            merged_rect = [x, y, x + w, y + h]
-            used[i] = True
-
-            # Iterate through remaining rectangles to find merge candidates
-            for j in range(i + 1, len(rects)):
-                if used[j]:
-                    continue
-                dist = rect_distance(r, rects[j])
-                if dist <= max_distance:
-                    # If close enough, expand merged_rect to include rects[j]
-                    rx, ry, rw, rh = rects[j]
-                    merged_rect[0] = min(merged_rect[0], rx)
-                    merged_rect[1] = min(merged_rect[1], ry)
-                    merged_rect[2] = max(merged_rect[2], rx + rw)
-                    merged_rect[3] = max(merged_rect[3], ry + rh)
-                    used[j] = True # Mark as used
-
-            # Add the final merged rectangle (convert back to x, y, w, h format)
-            merged.append((merged_rect[0], merged_rect[1],
-                           merged_rect[2] - merged_rect[0],
-                           merged_rect[3] - merged_rect[1]))
-        return merged
+        from app.detection import merge_rectangles
+        return merge_rectangles(rects, max_distance)
 
     def click_at(self, x, y):
         """Simulates a mouse click at the specified screen coordinates using AutoHotkey (AHK).
@@ -1140,12 +1474,16 @@ class PipRerollerApp:
         :param y: The y-coordinate on the screen.
         :type y: int
         """
-        self.ahk.mouse_move(x, y, speed=0)  # Instant move
-        # Moving the cursor again when it is inside the client area
-        # makes Roblox consider it inside the game client
-        # Otherwise it might not register the click properly
-        self.ahk.mouse_move(0, -1, relative=True, speed=0)  # Nudge up 1px
-        self.ahk.click()
+        with _CLICK_SECONDS.time():
+            self.ahk.mouse_move(x, y, speed=0)  # Instant move
+            # Moving the cursor again when it is inside the client area
+            # makes Roblox consider it inside the game client
+            # Otherwise it might not register the click properly
+            self.ahk.mouse_move(0, -1, relative=True, speed=0)  # Nudge up 1px
+            self.ahk.click()
+        processor = self.image_processor_thread
+        if processor is not None and processor.is_alive():
+            processor.kick_polling() # The game is about to change, poll at full speed
 
     def reroll_loop(self):
         """
@@ -1158,7 +1496,8 @@ class PipRerollerApp:
         - Checks for stop event again to allow immediate cancellation.
         - Clicks the 'Buy' button and waits a configured delay.
         - Checks for stop event again.
-        - Waits a post-reroll delay to prevent game state glitches.
+        - Waits a post-reroll delay to prevent game state glitches, or, with ``wait_for_settle``,
+          until the image processor saw the pips change and settle (at most the post-reroll delay).
         - Updates the GUI message with the current detected pip counts.
         - Waits briefly to throttle the loop and let image processing catch up.
     
@@ -1173,6 +1512,7 @@ class PipRerollerApp:
         ss_count = 0
         filtered_count = 0
 
+        roll_start = None
         while not self.stop_reroll_event.is_set():   
             # Brief pause before the next iteration, to prevent clicking too fast
             # and allow the image processor to catch up if needed
@@ -1192,23 +1532,15 @@ class PipRerollerApp:
                 self.log_event(
                     detected_objs,
                     self.image_processor_thread.get_current_rank_counts(),
-                    {
-                        "min_quality": self.min_quality,
-                        "min_objects": self.min_objects,
-                        "stop_at_ss": self.stop_at_ss,
-                        "tolerance": self.tolerance,
-                        "object_tolerance": self.object_tolerance,
-                        "click_delay_ms": self.click_delay_ms,
-                        "post_reroll_delay": self.post_reroll_delay_ms,
-                        "image_poll_delay_ms": self.image_poll_delay_ms,
-                        "game_area": self.game_area,
-                        "chisel_button_pos": self.chisel_button_pos,
-                        "buy_button_pos": self.buy_button_pos,
-                    },
+                    self.logged_settings(),
                     decision="Rolling"
                 )
 
             # If not stopped, perform the reroll clicks
+            now = time.perf_counter()
+            if roll_start is not None:
+                _ROLL_SECONDS.record(now - roll_start)
+            roll_start = now
             self.click_at(*self.chisel_button_pos)
             time.sleep(self.click_delay_ms / 1000) # Delay after first click
             
@@ -1216,8 +1548,13 @@ class PipRerollerApp:
             if self.stop_reroll_event.wait(timeout=0.01):
                 break
 
+            settle = self.image_processor_thread.settle if self.settle_enabled else None
+            if settle is not None:
+                settle.arm() # Only changes after the buy click count
             self.click_at(*self.buy_button_pos)
-            time.sleep(self.click_delay_ms / 1000) # Delay after second click
+            _ROLLS.inc()
+            if settle is None:
+                time.sleep(self.click_delay_ms / 1000) # Delay after second click
             
             # Re-check stop condition after the second click
             if self.stop_reroll_event.wait(timeout=0.01):
@@ -1226,7 +1563,11 @@ class PipRerollerApp:
             # Post-click safety delay
             # Prevents inventory shift issue where the charm below moves up temporarily.
             # This delay gives the game time to fully update/return the charm slot.
-            time.sleep(self.post_reroll_delay_ms / 1000)
+            if settle is not None:
+                # The pips must stay unchanged for SETTLE_QUIET_MS, and a stop being confirmed holds it back
+                settle.wait(self.post_reroll_delay_ms / 1000)
+            else:
+                time.sleep(self.post_reroll_delay_ms / 1000)
 
             current_counts = self.image_processor_thread.get_current_rank_counts()
             ss_count = current_counts.get("SS", 0)
@@ -1236,11 +1577,11 @@ class PipRerollerApp:
             )
 
             # Update message on the main thread
-            self.root.after(0, lambda: self.message_var.set(
+            self.post_gui_update("message",
                 f"Detected: {filtered_count} ≥{self.min_quality}" +
                 (f", {ss_count} SS" if self.stop_at_ss > 0 else "") +
                 ". Rolling..."
-            ))
+            )
 
             # Update Discord RPC live status
             if ENABLE_DISCORD_RPC:
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+"""
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+def frame_fingerprint(frame, stride=4):
+    """
+    Computes a cheap fingerprint of a frame from a downsampled checksum.
+
+    Only every ``stride``-th pixel on both axes is hashed, which is plenty to notice
+    a pip changing color while costing a small fraction of a detection pass.
+
+    :param numpy.ndarray frame: The image frame.
+    :param int stride: Sampling step in pixels on both axes (1 hashes every pixel).
+    :returns: A hashable fingerprint that also encodes the frame shape.
+    :rtype: tuple
+    """
+    sample = np.ascontiguousarray(frame[::stride, ::stride])
+    return frame.shape, zlib.crc32(sample)
+
+class DetectionCache:
+    """
+    Bounded LRU cache mapping frame fingerprints to detection results.
+
+    Lets the image processor skip detection entirely while the pip area is static,
+    e.g. between rerolls, and when the game flips back to a recently seen frame.
+
+    :ivar maxsize: Maximum number of cached results.
+    :vartype maxsize: int
+
+    :ivar stride: Sampling step passed to ``frame_fingerprint``.
+    :vartype stride: int
+
+    :ivar hits: Number of lookups answered from the cache.
+    :vartype hits: int
+
+    :ivar misses: Number of lookups that required a full detection.
+    :vartype misses: int
+    """
+    def __init__(self, maxsize=16, stride=4):
+        """
+        Initializes an empty cache.
+
+        :param int maxsize: Maximum number of cached results.
+        :param int stride: Sampling step passed to ``frame_fingerprint``.
+        :rtype: None
+        """
+        self.maxsize = maxsize
+        self.stride = stride
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_detect(self, frame, detect, settings=(), fingerprint=None):
+        """
+        Returns the cached detections for ``frame``, running ``detect`` on a miss.
+
+        :param numpy.ndarray frame: The image frame.
+        :param callable detect: Function called as ``detect(frame)`` on a cache miss.
+        :param tuple settings: Detection settings that affect the result (e.g. tolerances).
+            They are part of the key so changing them never returns stale detections.
+        :param fingerprint: Fingerprint of ``frame`` if the caller already computed it with
+            ``frame_fingerprint(frame, self.stride)``.
+        :returns: The detection result, shared with the cache (treat it as read-only).
+        :rtype: list of dict
+        """
+        if fingerprint is None:
+            fingerprint = frame_fingerprint(frame, self.stride)
+        key = (fingerprint, settings)
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        result = detect(frame)
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False) # Evict the least recently used entry
+        return result
+
+    def stats(self):
+        """
+        Returns the hit and miss counters.
+
+        :returns: A dict with ``hits``, ``misses``, ``size`` and ``hit_rate`` (0.0 when unused).
+        :rtype: dict
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def clear(self):
+        """
+        Drops all cached results. The counters are kept.
+
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.clear()
@@ -2,19 +2,140 @@
 """
 capture.py
 """
-import win32gui
-import win32ui
-import win32con
+import ctypes
+import threading
+import time
+
 import numpy as np
 import cv2
 
-class ScreenCapture:
+from app.metrics import REGISTRY, stage
+
+try:
+    import win32gui
+    import win32ui
+    import win32con
+    from ctypes import wintypes
+except ImportError: # Not on Windows: only file-based backends such as app.replay are usable
+    win32gui = win32ui = win32con = wintypes = None
+
+_CAPTURE_SECONDS = stage("capture")
+_CAPTURE_FAILURES = REGISTRY.counter("capture_failures_total", "Screen captures that failed")
+
+if wintypes is not None:
+    class BITMAPINFOHEADER(ctypes.Structure):
+        _fields_ = [
+            ("biSize", wintypes.DWORD), ("biWidth", wintypes.LONG), ("biHeight", wintypes.LONG),
+            ("biPlanes", wintypes.WORD), ("biBitCount", wintypes.WORD), ("biCompression", wintypes.DWORD),
+            ("biSizeImage", wintypes.DWORD), ("biXPelsPerMeter", wintypes.LONG),
+            ("biYPelsPerMeter", wintypes.LONG), ("biClrUsed", wintypes.DWORD), ("biClrImportant", wintypes.DWORD),
+        ]
+
+    class BITMAPINFO(ctypes.Structure):
+        _fields_ = [("bmiHeader", BITMAPINFOHEADER), ("bmiColors", wintypes.DWORD * 3)]
+
+    # Handles are pointer-sized, without a prototype ctypes would pass them as 32-bit ints
+    _GetDIBits = ctypes.windll.gdi32.GetDIBits
+    _GetDIBits.argtypes = [wintypes.HDC, wintypes.HBITMAP, wintypes.UINT, wintypes.UINT, ctypes.c_void_p,
+                           ctypes.POINTER(BITMAPINFO), wintypes.UINT]
+    _GetDIBits.restype = ctypes.c_int
+
+class BufferPool:
+    """
+    Ring of preallocated frame buffers, so steady-state capture allocates nothing per frame.
+
+    Each ``acquire`` hands out the next buffer of the ring. A buffer is only reused after
+    ``count - 1`` further acquisitions, so a consumer can keep the previous frames that long
+    without copying them. Buffers are reallocated only when the requested shape changes.
+
+    :ivar count: Number of buffers in the ring.
+    :vartype count: int
+
+    :ivar allocations: Number of buffers allocated so far, useful to check for steady state.
+    :vartype allocations: int
+    """
+    def __init__(self, count=3):
+        """
+        Initializes an empty pool.
+
+        :param int count: Number of buffers in the ring, at least 1.
+        :rtype: None
+        """
+        self.count = max(1, count)
+        self.allocations = 0
+        self._buffers = [None] * self.count
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Returns the next buffer of the ring, (re)allocated if its shape or type differs.
+
+        :param tuple shape: Shape of the buffer.
+        :param dtype: NumPy data type of the buffer.
+        :returns: An uninitialized array of the requested shape.
+        :rtype: numpy.ndarray
+        """
+        with self._lock:
+            k = self._next
+            self._next = (k + 1) % self.count
+            buffer = self._buffers[k]
+            if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+                buffer = np.empty(shape, dtype=dtype)
+                self._buffers[k] = buffer
+                self.allocations += 1
+            return buffer
+
+    def clear(self):
+        """
+        Releases all buffers.
+
+        :rtype: None
+        """
+        with self._lock:
+            self._buffers = [None] * self.count
+
+class CaptureBackend:
+    """
+    Interface shared by all frame sources of the detection pipeline.
+
+    A backend returns the pixels of a screen region as a BGR NumPy array, or ``None``
+    when no frame is available. ``ScreenCapture`` grabs the live screen, while
+    ``app.replay.ReplayCapture`` plays back recorded sessions so the pipeline can run
+    headless.
+    """
+    def capture(self, bbox=None):
+        """
+        Captures the region ``bbox`` given as (left, top, right, bottom) in screen coordinates.
+
+        :param tuple[int, int, int, int] bbox: The region to capture.
+        :returns: The captured image as a BGR NumPy array, or ``None`` if no frame is available.
+        :rtype: numpy.ndarray or None
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Releases any resources held by the backend.
+
+        :rtype: None
+        """
+
+class ScreenCapture(CaptureBackend):
     """
     Provides optimized screen capture functionality for Windows using ``win32gui`` and ``win32ui``.
 
     This class manages low-level Windows GDI resources such as Device Contexts (DC) and bitmaps
     to enable fast and efficient screen captures. It is designed for repeated capturing operations
-    with minimal overhead.
+    with minimal overhead: pixels are copied with ``GetDIBits`` straight into buffers from a
+    ``BufferPool``, and frames can be returned as BGRA without any conversion.
+
+    :ivar bgr: Whether frames are converted to BGR. When False, BGRA frames are returned,
+        which the detection pipeline reads directly.
+    :vartype bgr: bool
+
+    :ivar pool: Buffers the captured pixels are written into.
+    :vartype pool: BufferPool
 
     :ivar hwnd: Handle to the desktop window.
     :vartype hwnd: int
@@ -46,7 +167,7 @@ class ScreenCapture:
     :raises win32gui.error: If obtaining the desktop window handle fails.
     :rtype: None
     """
-    def __init__(self):
+    def __init__(self, bgr=True, pool=None):
         """
         Initialize the ScreenCapture object and set up internal state.
 
@@ -54,9 +175,16 @@ class ScreenCapture:
         and initializes internal attributes related to GDI device contexts and screen capture.
         Capture resources (DCs and bitmap) are not created until ``_initialize_dc`` is called.
 
+        :param bool bgr: Convert frames to BGR. Pass False to receive BGRA frames without a conversion.
+        :param BufferPool pool: Buffer pool to write frames into, e.g. a ``app.pipeline.FrameRing``. A frame stays valid until
+            the pool has handed out ``pool.count - 1`` further buffers.
         :raises win32gui.error: If obtaining the desktop window handle fails.
         :rtype: None
         """
+        self.bgr = bgr
+        self.pool = pool or BufferPool()
+        self._bgra = BufferPool(1) # Scratch BGRA buffer when converting to BGR
+        self._bmi = None
         self.hwnd = win32gui.GetDesktopWindow() # Handle to the desktop window
         self.hwindc = None
         self.srcdc = None
@@ -93,6 +221,15 @@ class ScreenCapture:
             # Create a compatible bitmap with the specified dimensions
             self.bmp.CreateCompatibleBitmap(self.srcdc, width, height)
             self.memdc.SelectObject(self.bmp) # Select the bitmap into the memory DC
+            # Describe the 32-bit top-down layout GetDIBits should copy the bitmap into
+            self._bmi = BITMAPINFO()
+            header = self._bmi.bmiHeader
+            header.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+            header.biWidth = width
+            header.biHeight = -height # Negative height means rows are stored top to bottom
+            header.biPlanes = 1
+            header.biBitCount = 32
+            header.biCompression = 0 # BI_RGB
             self._initialized = True
             self._last_width = width
             self._last_height = height
@@ -146,14 +283,17 @@ class ScreenCapture:
         This method captures a portion of the screen defined by the given bounding box.
         It manages GDI resource re-initialization if the bounding box or its dimensions
         differ from the previous capture. The captured image is returned as a BGR NumPy
-        array suitable for use with OpenCV.
+        array suitable for use with OpenCV, or as BGRA when ``bgr`` is False.
+
+        The returned array is a buffer of ``pool`` and is overwritten after ``count - 1``
+        further captures.
     
         If `bbox` is `None`, or if width/height are invalid or capture fails,
         `None` is returned.
     
         :param tuple[int, int, int, int] bbox: Optional. The bounding box of the region to
             capture in the format (left, top, right, bottom).
-        :returns: The captured image as a BGR NumPy array, or ``None`` if the capture failed.
+        :returns: The captured image as a BGR (or BGRA) NumPy array, or ``None`` if the capture failed.
         :rtype: numpy.ndarray or None
         :raises Exception: If a GDI call fails unexpectedly during capture.
         """
@@ -171,16 +311,25 @@ class ScreenCapture:
         if not self._initialized:
             if not self._initialize_dc(width, height): return None
 
+        start = time.perf_counter()
         try:
             # BitBlt copies the pixel data from the screen DC to the memory DC
             self.memdc.BitBlt((0, 0), (width, height), self.srcdc, (left, top), win32con.SRCCOPY)
-            # Get the bitmap bits
-            signedIntsArray = self.bmp.GetBitmapBits(True)
-            # Convert to NumPy array and reshape to HxWx4 (BGRA)
-            img = np.frombuffer(signedIntsArray, dtype='uint8').reshape((height, width, 4))
-            # Convert BGRA to BGR for OpenCV compatibility
-            return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+            # Copy the bitmap bits straight into an HxWx4 (BGRA) buffer, pooled unless converted below
+            img = (self._bgra if self.bgr else self.pool).acquire((height, width, 4))
+            lines = _GetDIBits(
+                self.memdc.GetSafeHdc(), self.bmp.GetHandle(), 0, height,
+                img.ctypes.data_as(ctypes.c_void_p), ctypes.byref(self._bmi), win32con.DIB_RGB_COLORS
+            )
+            if lines != height:
+                raise OSError(f"GetDIBits copied {lines} of {height} lines")
+            if self.bgr:
+                # Convert BGRA to BGR for OpenCV compatibility, into a pooled buffer
+                img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR, dst=self.pool.acquire((height, width, 3)))
+            _CAPTURE_SECONDS.record(time.perf_counter() - start)
+            return img
         except Exception as e:
+            _CAPTURE_FAILURES.inc()
             print(f"Capture error: {e}")
             self._cleanup() # Cleanup on error to force re-initialization next time
             return None
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+classifier.py
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from app.config import CLASSIFIER_CACHE_DIR
+from app.constants import RANKS
+from app.metrics import stage
+
+_LUT_VERSION = 1 # Bump when the table layout changes so stale cache files are ignored
+
+# Position of the red, green and blue channels in each supported pixel layout
+CHANNEL_LAYOUTS = {
+    "BGR": (2, 1, 0),
+    "BGRA": (2, 1, 0),
+    "RGB": (0, 1, 2),
+    "RGBA": (0, 1, 2),
+}
+
+_MASK_SECONDS = stage("mask")
+
+class RankClassifier:
+    """
+    Classifies every pixel of a frame into pip ranks in a single pass using a 3D lookup table.
+
+    The table is indexed by the (optionally quantized) R, G and B values of a pixel and holds
+    a bitmask of the ranks whose color is within ``tolerance`` of that pixel on every channel.
+    Bit ``i`` corresponds to ``RANKS[i]``, so a pixel that matches several ranks at high
+    tolerances keeps all of them, exactly like running one ``rank_mask`` per rank.
+
+    The table only depends on ``tolerance``, ``bits`` and the colors in ``RANKS``, so it is
+    built once per combination and can be cached on disk. Cached tables are memory-mapped
+    on load, which makes startup cost independent of the table size.
+
+    :ivar tolerance: Maximum allowed absolute difference per channel.
+    :vartype tolerance: int
+
+    :ivar bits: Number of bits kept per channel when indexing the table (8 = exact).
+    :vartype bits: int
+
+    :ivar lut: Flattened lookup table of ``2 ** (3 * bits)`` rank bitmasks.
+    :vartype lut: numpy.ndarray
+    """
+    def __init__(self, tolerance, bits=8, lut=None):
+        """
+        Initializes the classifier, building the lookup table if none is given.
+
+        :param int tolerance: Maximum allowed absolute difference per channel.
+        :param int bits: Bits per channel used to index the table, between 1 and 8.
+            Lower values shrink the table at the cost of matching slightly more
+            leniently at the tolerance edges.
+        :param numpy.ndarray lut: Optional prebuilt table, e.g. loaded from the disk cache.
+        :raises ValueError: If ``bits`` is out of range.
+        :rtype: None
+        """
+        if not 1 <= bits <= 8:
+            raise ValueError(f"bits must be between 1 and 8, got {bits}")
+        self.tolerance = tolerance
+        self.bits = bits
+        self.lut = lut if lut is not None else self.build_lut(tolerance, bits)
+        self._scratch = threading.local() # Per-thread index buffers, grown as needed and reused between frames
+
+    @staticmethod
+    def cache_key(tolerance, bits=8):
+        """
+        Computes the cache key identifying a lookup table.
+
+        The key covers everything the table depends on, so editing ``RANKS`` or the
+        tolerance automatically selects (or builds) a different table.
+
+        :param int tolerance: Maximum allowed absolute difference per channel.
+        :param int bits: Bits per channel used to index the table.
+        :returns: A short hexadecimal digest.
+        :rtype: str
+        """
+        colors = tuple(bgr for _, bgr, _ in RANKS)
+        return hashlib.sha1(repr((_LUT_VERSION, colors, tolerance, bits)).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def build_lut(tolerance, bits=8):
+        """
+        Builds the flattened 3D rank lookup table.
+
+        The tolerance test is applied per channel, so the table is the bitwise AND
+        of three 256-entry per-channel tables broadcast over the R, G and B axes.
+
+        :param int tolerance: Maximum allowed absolute difference per channel.
+        :param int bits: Bits per channel used to index the table.
+        :returns: A contiguous uint8 array of length ``2 ** (3 * bits)``.
+        :rtype: numpy.ndarray
+        """
+        values = np.arange(256, dtype=np.int16)
+        channel_tables = np.zeros((3, 256), dtype=np.uint8) # B, G, R
+        for i, (_, bgr, _) in enumerate(RANKS):
+            for c in range(3):
+                channel_tables[c][np.abs(values - bgr[c]) <= tolerance] |= np.uint8(1 << i)
+
+        # Collapse each bin of quantized values into a single entry
+        size = 1 << bits
+        tb, tg, tr = np.bitwise_or.reduce(channel_tables.reshape(3, size, -1), axis=2)
+        lut = tr[:, None, None] & tg[None, :, None] & tb[None, None, :]
+        return np.ascontiguousarray(lut).reshape(-1)
+
+    @classmethod
+    def load(cls, tolerance, bits=8, cache_dir=None):
+        """
+        Returns a classifier for ``tolerance``, using the on-disk table cache when possible.
+
+        If a cached table exists it is memory-mapped instead of rebuilt. Otherwise the
+        table is built and written to the cache for the next start. Cache I/O failures
+        are reported but never prevent the classifier from being created.
+
+        :param int tolerance: Maximum allowed absolute difference per channel.
+        :param int bits: Bits per channel used to index the table.
+        :param str cache_dir: Directory holding cached tables. Defaults to
+            ``CLASSIFIER_CACHE_DIR`` or a folder in the system temp directory.
+        :returns: A ready-to-use classifier.
+        :rtype: RankClassifier
+        """
+        cache_dir = cache_dir or CLASSIFIER_CACHE_DIR or os.path.join(tempfile.gettempdir(), "auto_chiseler_lut")
+        path = os.path.join(cache_dir, f"ranklut_{cls.cache_key(tolerance, bits)}.npy")
+        expected_size = 1 << (3 * bits)
+
+        if os.path.exists(path):
+            try:
+                lut = np.load(path, mmap_mode='r')
+                if lut.dtype == np.uint8 and lut.shape == (expected_size,):
+                    return cls(tolerance, bits, lut=lut)
+            except Exception as e:
+                print(f"Classifier cache read error: {e}")
+
+        classifier = cls(tolerance, bits)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, classifier.lut)
+            os.replace(tmp_path, path) # Atomic, so concurrent instances never read a partial file
+        except Exception as e:
+            print(f"Classifier cache write error: {e}")
+        return classifier
+
+    def classify(self, frame, out=None, layout=None):
+        """
+        Produces the rank label image of a frame.
+
+        Each output pixel is the bitmask of ranks matching the corresponding input pixel,
+        with bit ``i`` set for ``RANKS[i]`` and 0 for background.
+
+        Frames are read in place in any of the ``CHANNEL_LAYOUTS``, so a BGRA screen capture
+        needs no conversion. With full precision tables, a BGRA pixel read as a little-endian
+        32-bit word is already ``r << 16 | g << 8 | b`` plus the alpha byte, so its table index
+        takes a single mask operation.
+
+        :param numpy.ndarray frame: The image frame (uint8, HxWx3 or HxWx4).
+        :param numpy.ndarray out: Optional HxW uint8 array to write the labels into.
+        :param str layout: Channel order of ``frame``, one of ``CHANNEL_LAYOUTS``.
+            Defaults to BGR for 3 channels and BGRA for 4 channels.
+        :returns: The HxW uint8 label image.
+        :rtype: numpy.ndarray
+        :raises ValueError: If ``layout`` is unknown or does not match the channel count.
+        """
+        start = time.perf_counter()
+        height, width, channels = frame.shape
+        if layout is None:
+            layout = "BGRA" if channels == 4 else "BGR"
+        if layout not in CHANNEL_LAYOUTS or len(layout) != channels:
+            raise ValueError(f"Unsupported layout {layout!r} for a frame with {channels} channels")
+        red, green, blue = CHANNEL_LAYOUTS[layout]
+
+        scratch = self._scratch
+        size = height * width
+        if getattr(scratch, "idx", None) is None or scratch.idx.size < size:
+            scratch.idx = np.empty(size, dtype=np.uint32)
+            scratch.tmp = np.empty(size, dtype=np.uint32)
+        idx = scratch.idx[:size].reshape(height, width)
+        if out is None:
+            out = np.empty((height, width), dtype=np.uint8)
+
+        if layout == "BGRA" and self.bits == 8 and sys.byteorder == "little":
+            packed = _packed_pixels(frame)
+            if packed is not None:
+                np.bitwise_and(packed, 0xFFFFFF, out=idx) # Drop the alpha byte
+                np.take(self.lut, idx, out=out, mode='clip')
+                _MASK_SECONDS.record(time.perf_counter() - start)
+                return out
+
+        tmp = scratch.tmp[:size].reshape(height, width)
+        shift = 8 - self.bits
+        # idx = (r >> shift) << 2*bits | (g >> shift) << bits | (b >> shift)
+        np.right_shift(frame[..., red], shift, out=idx, dtype=np.uint32)
+        np.left_shift(idx, 2 * self.bits, out=idx)
+        np.right_shift(frame[..., green], shift, out=tmp, dtype=np.uint32)
+        np.left_shift(tmp, self.bits, out=tmp)
+        np.bitwise_or(idx, tmp, out=idx)
+        np.right_shift(frame[..., blue], shift, out=tmp, dtype=np.uint32)
+        np.bitwise_or(idx, tmp, out=idx)
+        np.take(self.lut, idx, out=out, mode='clip')
+        _MASK_SECONDS.record(time.perf_counter() - start)
+        return out
+
+def _packed_pixels(frame):
+    """
+    Views a 4-channel uint8 frame as one 32-bit word per pixel, without copying.
+
+    :param numpy.ndarray frame: HxWx4 uint8 frame whose pixels are contiguous.
+    :returns: An HxW uint32 view, or ``None`` if the memory layout does not allow it.
+    :rtype: numpy.ndarray or None
+    """
+    if frame.dtype != np.uint8 or frame.strides[-1] != 1 or frame.strides[-2] != 4:
+        return None
+    try:
+        return frame.view(np.uint32)[..., 0]
+    except ValueError:
+        return None
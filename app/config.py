@@ -9,9 +9,34 @@ import sys
 _DEFAULTS = {
     "THEME": "dark",                  # Theme names are listed in theme.py (defaults to dark if invalid)
     "ENABLE_LOGGING": False,          # Set to True to enable logging
+    "LOG_FILE": "auto_chiseler_events.jsonl", # Event log file (JSON Lines) written when logging is enabled
+    "LOG_MAX_RECORDS": 10000,         # Events kept in memory while waiting to be written; the oldest are dropped beyond that
+    "LOG_MAX_BYTES": 5000000,         # Size after which the event log is rotated (0 = never)
+    "LOG_BACKUPS": 5,                 # Number of rotated event logs to keep
+    "LOG_COMPRESS": True,             # Set to False to keep rotated event logs uncompressed
     "ENABLE_DISCORD_RPC": False,      # Set to True to enable Discord Rich Presence
-    "ENABLE_SLOTS_SOCKET": False,     # Set to True to enable slots socket functionality (Required to pass objects to slots.py over IPC)
-    "SLOTS_SOCKET_PORT": 54171,       # Port for the slots socket connection
+    "ENABLE_SLOTS_SOCKET": False,     # Set to True to enable the detection hub (Required to pass objects to slots.py and other subscribers over IPC)
+    "SLOTS_SOCKET_PORT": 54171,       # Port the detection hub listens on
+    "ENABLE_METRICS_ENDPOINT": False, # Set to True to serve timings and counters on http://127.0.0.1:<METRICS_PORT>/metrics (Prometheus text format)
+    "METRICS_PORT": 54172,            # Port the metrics endpoint listens on
+    "PROFILE_DIR": "profiles",        # Folder for the results of the profiler (F6 or the Profile button)
+    "PROFILE_INTERVAL_MS": 10,        # Time between the profiler's stack samples
+    "CLASSIFIER_CACHE_DIR": "",       # Folder for cached rank lookup tables (empty = system temp folder)
+    "WAIT_FOR_SETTLE": False,         # Set to True to continue rerolling once the pips settled instead of after the fixed post reroll delay
+    "SETTLE_QUIET_MS": 60,            # How long the pips must stay unchanged after a reroll to count as settled
+    "STOP_CONFIRM_FRAMES": 3,         # Frames in a row that must show the same pips meeting a stop condition before stopping
+    "ADAPTIVE_POLLING": True,         # Set to False to always wait the Image Poll Delay between captures
+    "POLL_MAX_DELAY_MS": 100,         # Longest delay between captures while nothing changes (adaptive polling)
+    "POLL_IDLE_DELAY_MS": 250,        # Delay between captures while suspended (adaptive polling)
+    "SLOT_ROIS": True,                # Set to False to always scan the whole area instead of only the learned pip slots
+    "SLOT_ROI_FILE": "slot_rois.json", # Learned pip slots and exclusion areas, kept between sessions
+    "SLOT_ROI_PADDING": 12,           # Pixels scanned around each learned pip slot
+    "SLOT_ROI_VERIFY_FRAMES": 60,     # Frames between full scans looking for pips outside the learned slots
+    "DETECTION_MODE": "exact",        # "exact" classifies every pixel; "pyramid" samples every PYRAMID_STRIDE-th pixel first and refines only around matches
+    "PYRAMID_STRIDE": 4,              # Sampling step of the pyramid mode; pips and fragments smaller than this may be missed
+    "OUT_OF_PROCESS_DETECTION": False, # Set to True to detect pips in a separate process, keeping the GUI and clicks smooth
+    "PREVIEW_MAX_FPS": 30,            # Refresh rate cap of the preview window
+    "GUI_REFRESH_HZ": 30,             # How often the GUI applies updates from the background threads
 }
 
 # Set module-level variables from the _DEFAULTS dictionary.
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+detection.py
+"""
+import time
+
+import cv2
+import numpy as np
+
+from app.constants import RANKS, RANK_ORDER
+from app.metrics import stage
+
+# Structuring element used to close small gaps inside pip masks
+KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+CLOSE_ITERATIONS = 2
+# Distance in pixels over which closing can spread a change (dilations then erosions)
+HALO = 2 * CLOSE_ITERATIONS
+
+_MORPHOLOGY_SECONDS = stage("morphology")
+_CONTOURS_SECONDS = stage("contours")
+_MERGE_SECONDS = stage("merge")
+
+def present_ranks(labels):
+    """
+    Returns the bitmask of every rank that has at least one pixel in a label image.
+
+    :param numpy.ndarray labels: HxW uint8 label image produced by ``RankClassifier.classify``.
+    :returns: The bitwise OR of all labels.
+    :rtype: int
+    """
+    return int(np.bitwise_or.reduce(labels, axis=None)) if labels.size else 0
+
+def find_blobs(labels, bit):
+    """
+    Finds the connected blobs of a single rank in a label image.
+
+    Blobs whose outline encloses an area of at most one pixel are discarded, matching the
+    ``contourArea > 1`` noise filter of the contour-based detector.
+
+    :param numpy.ndarray labels: HxW uint8 label image.
+    :param int bit: The rank bit to extract (``1 << rank_index``).
+    :returns: An Nx4 int32 array of ``(x, y, w, h)`` rows, one per blob.
+    :rtype: numpy.ndarray
+    """
+    rects, keep = component_stats(labels, bit)
+    return rects[keep]
+
+def component_stats(labels, bit, window=None):
+    """
+    Extracts every connected component of a single rank, optionally within a window.
+
+    Runs ``close_rank_mask`` followed by ``mask_components``.
+
+    :param numpy.ndarray labels: HxW uint8 label image.
+    :param int bit: The rank bit to extract (``1 << rank_index``).
+    :param tuple[int, int, int, int] window: Optional (left, top, right, bottom) region in pixels.
+    :returns: An Nx4 int32 array of ``(x, y, w, h)`` rows in image coordinates, and an N-long
+        boolean array that is False for blobs filtered out as noise.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    """
+    closed = close_rank_mask(labels, bit, window)
+    if closed is None:
+        return np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=bool)
+    return mask_components(*closed)
+
+def close_rank_mask(labels, bit, window=None):
+    """
+    Builds the closed mask of a single rank, optionally within a window.
+
+    The rank's mask is closed with ``KERNEL`` to connect nearby pixels and fill small gaps.
+    Work is confined to the bounding box of the rank's pixels. When a window is given, the
+    closing reads ``HALO`` extra pixels around it so the mask inside the window is identical
+    to the one computed on the whole image.
+
+    :param numpy.ndarray labels: HxW uint8 label image.
+    :param int bit: The rank bit to extract (``1 << rank_index``).
+    :param tuple[int, int, int, int] window: Optional (left, top, right, bottom) region in pixels.
+    :returns: The closed mask and the image coordinates (left, top) of its first pixel,
+        or ``None`` if the rank has no pixel in the window.
+    :rtype: tuple[numpy.ndarray, int, int] or None
+    """
+    height, width = labels.shape
+    left, top, right, bottom = window or (0, 0, width, height)
+    crop_left, crop_top = max(0, left - HALO), max(0, top - HALO)
+    crop_right, crop_bottom = min(width, right + HALO), min(height, bottom + HALO)
+    mask = np.bitwise_and(labels[crop_top:crop_bottom, crop_left:crop_right], bit)
+
+    # Closing only reaches past the bounding box of the mask near the image border (where
+    # erosion treats outside pixels as set), and never by more than HALO, so only that part is processed
+    bx, by, bw, bh = cv2.boundingRect(mask)
+    if bw == 0 or bh == 0:
+        return None
+    left, top = max(left, crop_left + bx - HALO), max(top, crop_top + by - HALO)
+    right, bottom = min(right, crop_left + bx + bw + HALO), min(bottom, crop_top + by + bh + HALO)
+    in_left, in_top = max(crop_left, left - HALO), max(crop_top, top - HALO)
+    in_right, in_bottom = min(crop_right, right + HALO), min(crop_bottom, bottom + HALO)
+
+    mask = mask[in_top - crop_top:in_bottom - crop_top, in_left - crop_left:in_right - crop_left]
+    start = time.perf_counter()
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, KERNEL, iterations=CLOSE_ITERATIONS)
+    mask = np.ascontiguousarray(mask[top - in_top:bottom - in_top, left - in_left:right - in_left])
+    _MORPHOLOGY_SECONDS.record(time.perf_counter() - start)
+    return mask, left, top
+
+def mask_components(mask, left=0, top=0):
+    """
+    Extracts the connected components of a closed mask.
+
+    Every 8-connected component is extracted together with its statistics in a single
+    ``cv2.connectedComponentsWithStats`` call. The outline area of all components is
+    computed at once with ``outline_areas`` to flag the noise blobs.
+
+    :param numpy.ndarray mask: Closed mask from ``close_rank_mask``.
+    :param int left: Image x coordinate of the mask's first column.
+    :param int top: Image y coordinate of the mask's first row.
+    :returns: An Nx4 int32 array of ``(x, y, w, h)`` rows in image coordinates, and an N-long
+        boolean array that is False for blobs filtered out as noise.
+    :rtype: tuple[numpy.ndarray, numpy.ndarray]
+    """
+    start = time.perf_counter()
+    count, components, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    keep = outline_areas(mask, components, count)[1:] > 1 # Component 0 is the background
+    rects = stats[1:, :4] + np.array([left, top, 0, 0], dtype=stats.dtype)
+    _CONTOURS_SECONDS.record(time.perf_counter() - start)
+    return rects, keep
+
+# Outline area contributed by a 2x2 pixel window, indexed by how many of its pixels are set
+_WINDOW_AREA = np.array([0.0, 0.0, 0.0, 0.5, 1.0])
+
+def outline_areas(mask, components, count):
+    """
+    Computes the area enclosed by the outer contour of every connected component.
+
+    The contour traced by ``cv2.findContours`` runs through pixel centers, so the area it
+    encloses is the sum over all 2x2 pixel windows of 1 for a full window and 0.5 for a
+    window with three pixels set. This gives the same value as ``cv2.contourArea`` for
+    hole-free blobs (holes only make the true value larger) without tracing any contour.
+
+    :param numpy.ndarray mask: HxW mask, non-zero where the rank is present.
+    :param numpy.ndarray components: HxW component labels from ``cv2.connectedComponentsWithStats``.
+    :param int count: Number of components including the background.
+    :returns: Array of ``count`` enclosed areas, indexed by component label.
+    :rtype: numpy.ndarray
+    """
+    if mask.shape[0] < 2 or mask.shape[1] < 2:
+        return np.zeros(count)
+    filled = (mask != 0).view(np.uint8)
+    per_window = filled[:-1, :-1] + filled[1:, :-1] + filled[:-1, 1:] + filled[1:, 1:]
+    # Windows with three or more pixels set always belong to a single component
+    owner = np.maximum(np.maximum(components[:-1, :-1], components[1:, :-1]),
+                       np.maximum(components[:-1, 1:], components[1:, 1:]))
+    return np.bincount(owner.ravel(), weights=_WINDOW_AREA[per_window.ravel()], minlength=count)
+
+def detect_objects(labels, object_tolerance):
+    """
+    Detects and classifies pip objects in a rank label image.
+
+    Blobs are extracted per rank present in the image, merged with ``merge_rectangles``
+    and returned highest rank first, in the same format as
+    ``PipRerollerApp.detect_and_classify``.
+
+    :param numpy.ndarray labels: HxW uint8 label image produced by ``RankClassifier.classify``.
+    :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+    :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+    :rtype: list of dict
+    """
+    present = present_ranks(labels)
+    detected = []
+    for i, (rank, bgr, _) in enumerate(RANKS):
+        bit = 1 << i
+        if not present & bit:
+            continue # No pixel of this rank, skip the mask entirely
+        rects = [tuple(r) for r in find_blobs(labels, bit).tolist()]
+        for rect in merge_rectangles(rects, object_tolerance):
+            detected.append({
+                "rank": rank,
+                "rect": rect,
+                "cv2color": bgr
+            })
+    # Sort detected objects by rank order (highest rank first)
+    detected.sort(key=lambda o: -RANK_ORDER[o['rank']])
+    return detected
+
+def merge_rectangles(rects, max_distance):
+    """
+    Merge rectangles that are close to each other into combined bounding boxes.
+
+    Useful for merging fragmented detections of the same object. Two rectangles belong to
+    the same object when the shortest distance between their edges is at most ``max_distance``,
+    and this relation is transitive: a chain of fragments, each close to the next, is merged
+    into a single box even if its ends are far apart.
+
+    Candidate pairs come from a sweep over the rectangles sorted by left edge, so only
+    rectangles whose horizontal extents are within ``max_distance`` are ever compared.
+    Distances are checked for all candidates at once with NumPy and the close pairs are
+    clustered with a union-find.
+
+    :param rects: List of rectangles as (x, y, w, h) tuples.
+    :type rects: list of tuples
+    :param max_distance: Maximum distance between rectangles to consider merging.
+    :type max_distance: float
+    :returns: List of merged rectangles as (x, y, w, h) tuples, ordered by their first fragment.
+    :rtype: list of tuples
+    """
+    start = time.perf_counter()
+    merged = _merge_rectangles(rects, max_distance)
+    _MERGE_SECONDS.record(time.perf_counter() - start)
+    return merged
+
+def _merge_rectangles(rects, max_distance):
+    """
+    Untimed implementation of ``merge_rectangles``.
+    """
+    n = len(rects)
+    if n < 2 or max_distance < 0:
+        return [tuple(r) for r in rects]
+
+    boxes = np.asarray(rects, dtype=np.int64).reshape(n, 4)
+    x0, y0 = boxes[:, 0], boxes[:, 1]
+    x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+
+    # Sweep line: after sorting by left edge, rectangle k can only reach the ones up to limit[k]
+    order = np.argsort(x0, kind='stable')
+    limit = np.searchsorted(x0[order], x1[order] + max_distance, side='right')
+    counts = np.maximum(limit - np.arange(1, n + 1), 0)
+    total = int(counts.sum())
+    if total == 0:
+        return [tuple(r) for r in rects]
+
+    # Expand every (k, k+1..limit[k]) window into flat candidate pairs
+    first = np.repeat(np.arange(n), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = order[first], order[first + 1 + offsets]
+
+    dx = np.maximum(np.maximum(x0[j] - x1[i], x0[i] - x1[j]), 0)
+    dy = np.maximum(np.maximum(y0[j] - y1[i], y0[i] - y1[j]), 0)
+    close = dx * dx + dy * dy <= max_distance * max_distance
+
+    # Union-find with path halving; the smallest index becomes the root of each cluster
+    parent = list(range(n))
+    def find(k):
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+    for a, b in zip(i[close].tolist(), j[close].tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            if ra < rb:
+                parent[rb] = ra
+            else:
+                parent[ra] = rb
+
+    roots = np.array([find(k) for k in range(n)])
+    left = np.full(n, np.iinfo(np.int64).max)
+    top = np.full(n, np.iinfo(np.int64).max)
+    right = np.full(n, np.iinfo(np.int64).min)
+    bottom = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(left, roots, x0)
+    np.minimum.at(top, roots, y0)
+    np.maximum.at(right, roots, x1)
+    np.maximum.at(bottom, roots, y1)
+
+    cluster_ids = np.flatnonzero(roots == np.arange(n)) # Roots in order of first fragment
+    return [(l, t, r - l, b - t) for l, t, r, b in zip(left[cluster_ids].tolist(), top[cluster_ids].tolist(),
+                                                       right[cluster_ids].tolist(), bottom[cluster_ids].tolist())]
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+eventlog.py
+"""
+import collections
+import datetime
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+
+class EventLog(threading.Thread):
+    """
+    Writes detection events to a JSON Lines file from a background thread.
+
+    ``record`` only stores references to the event's data in a bounded ring buffer, so it
+    is cheap enough to call from the reroll and detection loops; formatting and writing
+    happen in the log's own thread. If the writer falls behind, the oldest unwritten events
+    are dropped. Settings are written as a separate ``settings`` record whenever they change
+    instead of with every event, and again at the start of every file.
+
+    Once the file grows past ``max_bytes``, it is rotated to ``<name>.1.jsonl`` (or
+    ``<name>.1.jsonl.gz`` when compressing), shifting older files up to ``backups``.
+
+    :ivar path: File the events are written to.
+    :vartype path: str
+
+    :ivar written: Number of records written.
+    :vartype written: int
+
+    :ivar dropped: Number of records dropped because the buffer was full.
+    :vartype dropped: int
+    """
+    def __init__(self, path, max_records=10000, max_bytes=5_000_000, backups=5, compress=True,
+                 flush_interval=1.0):
+        """
+        :param str path: File to write the events to, usually ending in ``.jsonl``.
+        :param int max_records: Maximum number of records waiting to be written.
+        :param int max_bytes: Size in bytes after which the file is rotated, 0 to never rotate.
+        :param int backups: Number of rotated files to keep.
+        :param bool compress: Whether to gzip rotated files.
+        :param float flush_interval: Longest time in seconds a record waits before it is written.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name="EventLog")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._records = collections.deque(maxlen=max(1, max_records))
+        self._lock = threading.Lock()
+        self._last_settings = None
+        self._file_settings = None # Settings last written to the current file
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+
+    def record(self, decision, objects, rank_counts=None, settings=None):
+        """
+        Queues a detection event. Safe to call from any thread.
+
+        :param str decision: What the app decided, e.g. ``"Rolling"``.
+        :param list[dict] objects: Detected objects with 'rank' and 'rect' keys. The list is
+            formatted later and must not be changed afterwards.
+        :param dict rank_counts: Number of pips per rank, if known.
+        :param dict settings: Snapshot of the current settings, a new dict only when they
+            changed; written once per snapshot. It must not be changed afterwards.
+        :rtype: None
+        """
+        with self._lock:
+            if settings is not None and settings is not self._last_settings:
+                self._last_settings = settings # Events share this snapshot until the settings change
+            if len(self._records) == self._records.maxlen:
+                self.dropped += 1 # The deque evicts the oldest record
+            self._records.append((time.time(), decision, objects, rank_counts, self._last_settings))
+
+    def _format(self, record):
+        """
+        Formats a record as JSON lines, preceded by its settings if they were not written yet.
+
+        :param tuple record: A record queued by ``record``.
+        :rtype: str
+        """
+        timestamp, decision, objects, rank_counts, settings = record
+        now = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        now = now.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        text = ""
+        if settings is not None and settings is not self._file_settings:
+            self._file_settings = settings
+            text = json.dumps({"time": now, "type": "settings", "settings": settings}, default=str) + "\n"
+        entry = {
+            "time": now,
+            "type": "event",
+            "decision": decision,
+            "objects": [{"rank": o['rank'], "rect": list(o['rect'])} for o in objects],
+        }
+        if rank_counts is not None:
+            entry["counts"] = rank_counts
+        return text + json.dumps(entry, default=str) + "\n"
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_pending()
+        self._write_pending()
+
+    def _write_pending(self):
+        """
+        Writes every queued record, rotating the file when it grows too large.
+
+        :rtype: None
+        """
+        lines = []
+        while True:
+            try:
+                lines.append(self._format(self._records.popleft()))
+            except IndexError:
+                break
+        if not lines:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                size = f.tell()
+            self.written += len(lines)
+            if self.max_bytes and size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            print(f"[ERROR] Could not write event log {self.path}: {e}")
+
+    def _backup_path(self, index):
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{index}{ext}" + (".gz" if self.compress else "")
+
+    def _rotate(self):
+        """
+        Moves the current file to the first backup, shifting the older ones.
+
+        :rtype: None
+        """
+        self._file_settings = None # Repeat the settings in the next file
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(self._backup_path(index)):
+                os.replace(self._backup_path(index), self._backup_path(index + 1))
+        if self.compress:
+            with open(self.path, "rb") as src, gzip.open(self._backup_path(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._backup_path(1))
+
+    def flush(self):
+        """
+        Asks the writer thread to write the queued records now, without waiting for it.
+
+        :rtype: None
+        """
+        self._wake.set()
+
+    def pending(self):
+        """
+        :returns: Number of records waiting to be written.
+        :rtype: int
+        """
+        return len(self._records)
+
+    def stats(self):
+        """
+        Returns the log counters.
+
+        :returns: A dict with the number of ``pending``, ``written`` and ``dropped`` records.
+        :rtype: dict
+        """
+        return {"pending": self.pending(), "written": self.written, "dropped": self.dropped}
+
+    def stop(self, timeout=2.0):
+        """
+        Writes the remaining records and stops the writer thread.
+
+        :param float timeout: Maximum time to wait for the writer in seconds.
+        :rtype: None
+        """
+        self._stopped.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout)
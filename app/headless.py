@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+headless.py
+"""
+from app.classifier import RankClassifier
+from app.config import STOP_CONFIRM_FRAMES
+from app.constants import RANKS
+from app.detection import detect_objects
+
+class MessageVar:
+    """
+    Stand-in for the Tkinter ``StringVar`` holding the status message.
+
+    :ivar value: The last message set.
+    :vartype value: str
+
+    :ivar echo: Whether new messages are printed to stdout.
+    :vartype echo: bool
+    """
+    def __init__(self, value="", echo=False):
+        """
+        :param str value: Initial message.
+        :param bool echo: Print new messages to stdout.
+        :rtype: None
+        """
+        self.value = value
+        self.echo = echo
+
+    def set(self, value):
+        """
+        Replaces the message, printing it if ``echo`` is set and it changed.
+
+        :param str value: The new message.
+        :rtype: None
+        """
+        if self.echo and value != self.value:
+            print(value)
+        self.value = value
+
+    def get(self):
+        """
+        :returns: The last message set.
+        :rtype: str
+        """
+        return self.value
+
+class HeadlessApp:
+    """
+    Minimal application object that lets ``ImageProcessor`` run without Tkinter, AHK or pywin32.
+
+    It carries the same detection and stop settings as ``PipRerollerApp`` (with the same defaults)
+    and records what the processor reports instead of drawing it. Together with a
+    ``ReplayCapture`` this runs the detection pipeline on recorded sessions, e.g. on Linux.
+
+    :ivar root: Always ``None``, there is no window.
+    :vartype root: None
+
+    :ivar message_var: Latest status message from the processor.
+    :vartype message_var: MessageVar
+
+    :ivar last_detected_objs: Detections of the most recent frame.
+    :vartype last_detected_objs: list
+
+    :ivar rank_counts: Pip counts per rank of the most recent frame.
+    :vartype rank_counts: dict
+
+    :ivar stops: Number of times the processor signalled the stop condition.
+    :vartype stops: int
+    """
+    def __init__(self, game_area, running=True, verbose=False):
+        """
+        Initializes the headless app with the default settings of the GUI.
+
+        :param tuple[int, int, int, int] game_area: Region to analyze (left, top, right, bottom).
+        :param bool running: Whether the reroll loop is considered active, which the processor
+            requires before it signals a stop.
+        :param bool verbose: Print status messages as they change.
+        :rtype: None
+        """
+        self.root = None
+        self.game_area = game_area
+        self.chisel_button_pos = None
+        self.buy_button_pos = None
+        self.running = running
+
+        self.tolerance = 10
+        self.stop_at_ss = 0
+        self.click_delay_ms = 50
+        self.post_reroll_delay_ms = 500
+        self.object_tolerance = 10
+        self.image_poll_delay_ms = 10
+        self.stop_confirm_frames = STOP_CONFIRM_FRAMES
+        self.min_quality = "F"
+        self.min_objects = 1
+        self.exclusion_areas = [] # Screen areas whose pips are ignored
+
+        self.classifier = RankClassifier.load(self.tolerance)
+        self.message_var = MessageVar(echo=verbose)
+        self.last_detected_objs = []
+        self.rank_counts = {rank: 0 for rank, _, _ in RANKS}
+        self.stops = 0
+
+    def get_classifier(self):
+        """
+        Return the rank classifier for the current color tolerance.
+
+        :returns: A classifier matching ``self.tolerance``.
+        :rtype: app.classifier.RankClassifier
+        """
+        if self.classifier.tolerance != self.tolerance:
+            self.classifier = RankClassifier.load(self.tolerance)
+        return self.classifier
+
+    def detect_and_classify(self, frame):
+        """
+        Detect and classify pip objects within an image frame.
+
+        :param numpy.ndarray frame: The image frame (BGR).
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        return detect_objects(self.get_classifier().classify(frame), self.object_tolerance)
+
+    def update_rank_counts_gui(self, detected_objs):
+        """
+        Record the latest detections.
+
+        :param list detected_objs: List of detected pip objects with 'rank' keys.
+        :rtype: None
+        """
+        self.last_detected_objs = detected_objs
+        self.rank_counts = {rank: 0 for rank, _, _ in RANKS}
+        for obj in detected_objs:
+            self.rank_counts[obj['rank']] += 1
+
+    def post_gui_update(self, key, value):
+        """
+        Apply an update posted by the processor right away.
+
+        :param str key: ``"detections"`` or ``"message"``.
+        :param value: The detected objects or the message text.
+        :rtype: None
+        """
+        if key == "detections":
+            self.update_rank_counts_gui(value)
+        elif key == "message":
+            self.message_var.set(value)
+
+    def stop_running_async(self):
+        """
+        Record a stop signal from the processor.
+
+        :rtype: None
+        """
+        self.running = False
+        self.stops += 1
+
+    def log_event(self, *args, **kwargs):
+        """
+        Ignore an event, there is no event log.
+
+        :rtype: None
+        """
+
+    def logged_settings(self):
+        """
+        Return the settings an event log would record, none without one.
+
+        :rtype: dict
+        """
+        return {}
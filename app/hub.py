@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+hub.py
+"""
+import asyncio
+import socket
+import struct
+import threading
+
+from app.constants import RANKS, RANK_ORDER
+
+HEADER = struct.Struct(">H") # Payload length in bytes
+EVENT = struct.Struct(">BH") # Event kind, number of objects
+OBJECT = struct.Struct(">B4H") # Rank ID (index in RANKS), x, y, w, h
+EVENT_DETECTIONS = 1
+
+DROP_POLICIES = ("drop_oldest", "drop_newest")
+
+def encode_message(payload):
+    """
+    Frames a payload with its length.
+
+    :param bytes payload: The payload, at most 65535 bytes.
+    :rtype: bytes
+    """
+    return HEADER.pack(len(payload)) + payload
+
+def encode_detections(detected_objs):
+    """
+    Encodes detections as one framed event.
+
+    :param list[dict] detected_objs: Detected objects with 'rank' and 'rect' keys.
+    :returns: The framed event.
+    :rtype: bytes
+    """
+    parts = [EVENT.pack(EVENT_DETECTIONS, len(detected_objs))]
+    for obj in detected_objs:
+        x, y, w, h = obj['rect']
+        parts.append(OBJECT.pack(RANK_ORDER[obj['rank']], x, y, w, h))
+    return encode_message(b"".join(parts))
+
+def decode_detections(payload):
+    """
+    Decodes the payload of an event written by ``encode_detections``.
+
+    :param bytes payload: The payload, without the length prefix.
+    :returns: Detected objects, each a dict with 'rank' and 'rect' keys.
+    :rtype: list[dict]
+    :raises ValueError: If the payload is not a valid detection event.
+    """
+    if len(payload) < EVENT.size:
+        raise ValueError("Truncated event")
+    kind, count = EVENT.unpack_from(payload)
+    if kind != EVENT_DETECTIONS or len(payload) != EVENT.size + count * OBJECT.size:
+        raise ValueError(f"Unexpected event of kind {kind} and {len(payload)} bytes")
+    objs = []
+    for rank_id, x, y, w, h in OBJECT.iter_unpack(payload[EVENT.size:]):
+        if rank_id >= len(RANKS):
+            raise ValueError(f"Unknown rank ID {rank_id}")
+        objs.append({'rank': RANKS[rank_id][0], 'rect': (x, y, w, h)})
+    return objs
+
+def _recv_exactly(conn, size):
+    """
+    Reads exactly ``size`` bytes from a socket.
+
+    :param socket.socket conn: Connected socket.
+    :param int size: Number of bytes to read.
+    :returns: The bytes, or ``None`` if the connection closed first.
+    :rtype: bytes or None
+    """
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def subscribe(host, port, policy="drop_oldest", timeout=1.0):
+    """
+    Connects to a ``DetectionHub`` as a subscriber.
+
+    :param str host: Host of the hub.
+    :param int port: Port of the hub.
+    :param str policy: What the hub drops when this subscriber falls behind, one of ``DROP_POLICIES``.
+    :param float timeout: Connection timeout in seconds.
+    :returns: The connected socket, to read events from with ``recv_detections``.
+    :rtype: socket.socket
+    :raises OSError: If the hub is not running.
+    :raises ValueError: If the policy is unknown.
+    """
+    if policy not in DROP_POLICIES:
+        raise ValueError(f"Unknown drop policy: {policy}")
+    conn = socket.create_connection((host, port), timeout=timeout)
+    conn.settimeout(None)
+    conn.sendall(encode_message(policy.encode("ascii")))
+    return conn
+
+def recv_detections(conn):
+    """
+    Reads the next detection event from a subscription.
+
+    :param socket.socket conn: Socket returned by ``subscribe``.
+    :returns: Detected objects, each a dict with 'rank' and 'rect' keys,
+        or ``None`` if the hub closed the connection.
+    :rtype: list[dict] or None
+    :raises ValueError: If the hub sent an invalid event.
+    """
+    header = _recv_exactly(conn, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    payload = _recv_exactly(conn, size)
+    if payload is None:
+        return None
+    return decode_detections(payload)
+
+class _Subscriber:
+    """
+    Outgoing queue of one connected subscriber.
+
+    :ivar policy: What to drop when the queue is full, one of ``DROP_POLICIES``.
+    :vartype policy: str
+
+    :ivar dropped: Number of events dropped because the subscriber fell behind.
+    :vartype dropped: int
+    """
+    def __init__(self, policy, queue_size):
+        """
+        :param str policy: What to drop when the queue is full, one of ``DROP_POLICIES``.
+        :param int queue_size: Maximum number of queued events.
+        :rtype: None
+        """
+        self.policy = policy
+        self.dropped = 0
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    def offer(self, message):
+        """
+        Queues an event without ever waiting, dropping one event if the queue is full.
+
+        :param bytes message: The framed event.
+        :rtype: None
+        """
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+class DetectionHub(threading.Thread):
+    """
+    Publishes detection events to any number of local subscribers.
+
+    The hub runs an asyncio server in its own thread. The image processor ``publish``\\es
+    every frame's detections once; the hub drops repeats and fans changes out to one bounded
+    queue per subscriber, so a slow subscriber only loses its own events and never slows
+    down detection. New subscribers receive the latest event right away.
+
+    Subscribers connect with ``subscribe`` and read events with ``recv_detections``.
+
+    :ivar host: Interface the hub listens on.
+    :vartype host: str
+
+    :ivar port: Port the hub listens on.
+    :vartype port: int
+
+    :ivar queue_size: Maximum number of queued events per subscriber.
+    :vartype queue_size: int
+
+    :ivar published: Number of distinct events published.
+    :vartype published: int
+
+    :ivar error: Error that stopped the server, e.g. the port being in use.
+    :vartype error: OSError or None
+
+    :ivar ready: Set once the server listens, or failed to.
+    :vartype ready: threading.Event
+    """
+    def __init__(self, host="localhost", port=54171, queue_size=8):
+        """
+        :param str host: Interface to listen on.
+        :param int port: Port to listen on.
+        :param int queue_size: Maximum number of queued events per subscriber.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name="DetectionHub")
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.published = 0
+        self.error = None
+        self.ready = threading.Event()
+        self._subscribers = set()
+        self._handlers = set() # Tasks serving a subscriber
+        self._last_key = None
+        self._last_message = None
+        self._loop = None
+        self._stopped = None
+        self._stop_requested = False
+
+    def run(self):
+        try:
+            asyncio.run(self._serve())
+        except OSError as e:
+            self.error = e
+            print(f"[ERROR] Detection hub could not listen on port {self.port}: {e}")
+        finally:
+            self.ready.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        if self._stop_requested:
+            return # Stopped before the loop was up
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.ready.set()
+        async with server:
+            await self._stopped.wait()
+            server.close()
+            await asyncio.gather(*self._handlers, return_exceptions=True) # Let subscribers disconnect cleanly
+
+    async def _handle(self, reader, writer):
+        """
+        Serves one subscriber until it disconnects or the hub stops.
+
+        :param asyncio.StreamReader reader: Stream from the subscriber, carrying its drop policy.
+        :param asyncio.StreamWriter writer: Stream to the subscriber.
+        :rtype: None
+        """
+        self._handlers.add(asyncio.current_task())
+        try:
+            await self._serve_subscriber(reader, writer)
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _serve_subscriber(self, reader, writer):
+        """
+        Reads the subscriber's drop policy, then writes its queued events until it disconnects
+        or the hub stops.
+
+        :param asyncio.StreamReader reader: Stream from the subscriber.
+        :param asyncio.StreamWriter writer: Stream to the subscriber.
+        :rtype: None
+        """
+        try:
+            header = await asyncio.wait_for(reader.readexactly(HEADER.size), timeout=1.0)
+            policy = (await reader.readexactly(HEADER.unpack(header)[0])).decode("ascii", "replace")
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            return
+        if policy not in DROP_POLICIES:
+            return
+
+        subscriber = _Subscriber(policy, self.queue_size)
+        if self._last_message is not None:
+            subscriber.offer(self._last_message) # Start from the current state
+        self._subscribers.add(subscriber)
+        stopped = asyncio.ensure_future(self._stopped.wait())
+        try:
+            while True:
+                get = asyncio.ensure_future(subscriber.queue.get())
+                await asyncio.wait((get, stopped), return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    get.cancel()
+                    break
+                writer.write(get.result())
+                await writer.drain()
+        except ConnectionError:
+            pass # Subscriber went away
+        finally:
+            stopped.cancel()
+            self._subscribers.discard(subscriber)
+
+    def publish(self, detected_objs):
+        """
+        Publishes detections to every subscriber, unless they equal the previous ones.
+
+        Safe to call from any thread; it never waits for subscribers.
+
+        :param list[dict] detected_objs: Detected objects with 'rank' and 'rect' keys.
+        :returns: True if the detections changed.
+        :rtype: bool
+        """
+        key = tuple((obj['rank'], tuple(obj['rect'])) for obj in detected_objs)
+        if key == self._last_key:
+            return False
+        self._last_key = key
+        message = encode_detections(detected_objs)
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            self._last_message = message # Sent to subscribers once the server is up
+            return True
+        try:
+            loop.call_soon_threadsafe(self._fan_out, message)
+        except RuntimeError:
+            pass # The hub stopped
+        return True
+
+    def _fan_out(self, message):
+        """
+        Queues an event for every subscriber. Runs in the hub's event loop.
+
+        :param bytes message: The framed event.
+        :rtype: None
+        """
+        self._last_message = message
+        self.published += 1
+        for subscriber in self._subscribers:
+            subscriber.offer(message)
+
+    def stats(self):
+        """
+        Returns the subscriber counters.
+
+        :returns: A dict with ``published``, the number of ``subscribers`` and their
+            total ``dropped`` events.
+        :rtype: dict
+        """
+        subscribers = list(self._subscribers)
+        return {
+            "published": self.published,
+            "subscribers": len(subscribers),
+            "dropped": sum(subscriber.dropped for subscriber in subscribers),
+        }
+
+    def stop(self):
+        """
+        Disconnects every subscriber and stops the server.
+
+        :rtype: None
+        """
+        self._stop_requested = True
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(self._stopped.set)
+            except RuntimeError:
+                pass # Already stopped
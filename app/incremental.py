@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+incremental.py
+"""
+import time
+
+import cv2
+import numpy as np
+
+from app.constants import RANKS, RANK_ORDER
+from app.detection import HALO, component_stats, merge_rectangles, present_ranks
+from app.metrics import stage
+
+_TILE_DIFF_SECONDS = stage("tile_diff")
+
+class IncrementalDetector:
+    """
+    Pip detector that only re-analyzes the tiles of a frame that changed since the previous one.
+
+    The frame is split into square tiles. Each call diffs the tiles against the previous frame,
+    reclassifies only the changed tiles into a persistent label image, and re-extracts blobs
+    only inside windows around the changed tiles. Blobs from unchanged areas are reused as is.
+
+    Windows are grown until no cached blob crosses their border, so a blob spanning tile
+    edges (or one that a change joins to its neighbors) is always recomputed as a whole
+    and the result is identical to a full detection of the frame.
+
+    :ivar tile_size: Tile edge length in pixels.
+    :vartype tile_size: int
+
+    :ivar full_ratio: Fraction of dirty tiles above which a full detection is cheaper.
+    :vartype full_ratio: float
+
+    :ivar tiles_total: Number of tiles compared since creation.
+    :vartype tiles_total: int
+
+    :ivar tiles_dirty: Number of tiles that had to be reclassified since creation.
+    :vartype tiles_dirty: int
+    """
+    def __init__(self, tile_size=64, full_ratio=0.5):
+        """
+        Initializes the detector with no cached state.
+
+        :param int tile_size: Tile edge length in pixels.
+        :param float full_ratio: Fraction of dirty tiles above which a full detection is run.
+        :rtype: None
+        """
+        self.tile_size = tile_size
+        self.full_ratio = full_ratio
+        self.tiles_total = 0
+        self.tiles_dirty = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Drops all cached state so the next frame is fully analyzed.
+
+        :rtype: None
+        """
+        self._prev = None # Copy of the last analyzed frame
+        self._labels = None # Label image of the last analyzed frame
+        self._classifier = None
+        self._rects = np.empty((0, 4), dtype=np.int64) # Every component, including noise blobs
+        self._ranks = np.empty(0, dtype=np.int64) # Rank index of each component
+        self._keep = np.empty(0, dtype=bool) # False for components filtered out as noise
+        self._result = None
+        self._object_tolerance = None
+
+    def detect(self, frame, classifier, object_tolerance):
+        """
+        Detects and classifies pip objects, reusing the work done for unchanged tiles.
+
+        :param numpy.ndarray frame: The image frame (BGR).
+        :param app.classifier.RankClassifier classifier: Classifier for the current tolerance.
+            Passing a different classifier invalidates the cached state.
+        :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        height, width = frame.shape[:2]
+        if (self._prev is None or self._prev.shape != frame.shape or classifier is not self._classifier):
+            self._full(frame, classifier)
+        else:
+            dirty = self._dirty_tiles(frame)
+            count = int(np.count_nonzero(dirty))
+            self.tiles_total += dirty.size
+            self.tiles_dirty += count
+            if count > self.full_ratio * dirty.size:
+                self._full(frame, classifier)
+            elif count:
+                self._update(frame, dirty, classifier, width, height)
+            elif self._result is not None and object_tolerance == self._object_tolerance:
+                return self._result # Nothing changed at all
+
+        self._result = self._objects(object_tolerance)
+        self._object_tolerance = object_tolerance
+        return self._result
+
+    def stats(self):
+        """
+        Returns how much of the frame had to be reanalyzed.
+
+        :returns: A dict with ``tiles_total``, ``tiles_dirty`` and ``dirty_ratio``.
+        :rtype: dict
+        """
+        return {
+            "tiles_total": self.tiles_total,
+            "tiles_dirty": self.tiles_dirty,
+            "dirty_ratio": self.tiles_dirty / self.tiles_total if self.tiles_total else 0.0,
+        }
+
+    def _full(self, frame, classifier):
+        """
+        Analyzes the whole frame and replaces all cached state.
+
+        :param numpy.ndarray frame: The image frame (BGR).
+        :param app.classifier.RankClassifier classifier: Classifier for the current tolerance.
+        :rtype: None
+        """
+        self._classifier = classifier
+        self._prev = frame.copy()
+        self._labels = classifier.classify(frame)
+        height, width = self._labels.shape
+        self._rects = np.empty((0, 4), dtype=np.int64)
+        self._ranks = np.empty(0, dtype=np.int64)
+        self._keep = np.empty(0, dtype=bool)
+        self._extract((0, 0, width, height))
+
+    def _dirty_tiles(self, frame):
+        """
+        Compares a frame with the previous one tile by tile.
+
+        :param numpy.ndarray frame: The image frame (BGR).
+        :returns: A boolean grid with one entry per tile, True where any pixel changed.
+        :rtype: numpy.ndarray
+        """
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+        tile = self.tile_size
+        changed = cv2.absdiff(frame, self._prev).reshape(height, -1) # One row of bytes per pixel row
+        # Max over the rows of each tile strip first: contiguous rows keep this fully vectorized
+        strips = np.stack([changed[y:y + tile].max(axis=0) for y in range(0, height, tile)])
+        channels = changed.shape[1] // width
+        dirty = np.maximum.reduceat(strips, np.arange(0, width, tile) * channels, axis=1) > 0
+        _TILE_DIFF_SECONDS.record(time.perf_counter() - start)
+        return dirty
+
+    def _update(self, frame, dirty, classifier, width, height):
+        """
+        Reclassifies the dirty tiles and re-extracts blobs around them.
+
+        :param numpy.ndarray frame: The image frame (BGR).
+        :param numpy.ndarray dirty: Boolean tile grid from ``_dirty_tiles``.
+        :param app.classifier.RankClassifier classifier: Classifier for the current tolerance.
+        :param int width: Frame width in pixels.
+        :param int height: Frame height in pixels.
+        :rtype: None
+        """
+        tile = self.tile_size
+        # Reclassify each horizontal run of dirty tiles with one call
+        for row in range(dirty.shape[0]):
+            cols = np.flatnonzero(dirty[row])
+            if not cols.size:
+                continue
+            breaks = np.flatnonzero(np.diff(cols) > 1)
+            for start, end in zip(np.r_[cols[0], cols[breaks + 1]], np.r_[cols[breaks], cols[-1]]):
+                y0, y1 = row * tile, min(height, (row + 1) * tile)
+                x0, x1 = start * tile, min(width, (end + 1) * tile)
+                self._prev[y0:y1, x0:x1] = frame[y0:y1, x0:x1]
+                classifier.classify(frame[y0:y1, x0:x1], out=self._labels[y0:y1, x0:x1])
+
+        # Group touching dirty tiles into windows, padded by the distance closing can spread a change
+        count, _, stats, _ = cv2.connectedComponentsWithStats(dirty.view(np.uint8), connectivity=8)
+        windows = []
+        for tx, ty, tw, th, _ in stats[1:count].tolist():
+            windows.append(_clip((tx * tile, ty * tile, (tx + tw) * tile, (ty + th) * tile), HALO, width, height))
+
+        for window in self._settle_windows(windows, width, height):
+            self._drop_inside(window)
+            self._extract(window)
+
+    def _settle_windows(self, windows, width, height):
+        """
+        Grows windows until no cached component crosses their border and no two windows overlap.
+
+        :param list[tuple] windows: (left, top, right, bottom) regions around the dirty tiles.
+        :param int width: Frame width in pixels.
+        :param int height: Frame height in pixels.
+        :returns: Disjoint windows whose contents can be recomputed independently.
+        :rtype: list[tuple]
+        """
+        x0, y0 = self._rects[:, 0], self._rects[:, 1]
+        x1, y1 = x0 + self._rects[:, 2], y0 + self._rects[:, 3]
+        changed = True
+        while changed:
+            changed = False
+            grown = []
+            for left, top, right, bottom in windows:
+                # Components touching the window (8-connectivity) are pulled in whole
+                touching = (x0 <= right) & (x1 >= left) & (y0 <= bottom) & (y1 >= top)
+                if touching.any():
+                    new = (min(left, int(x0[touching].min())), min(top, int(y0[touching].min())),
+                           max(right, int(x1[touching].max())), max(bottom, int(y1[touching].max())))
+                    changed |= new != (left, top, right, bottom)
+                    left, top, right, bottom = new
+                grown.append((left, top, right, bottom))
+
+            # Merge overlapping windows so no component is extracted twice
+            windows = []
+            for window in grown:
+                for k, other in enumerate(windows):
+                    if window[0] <= other[2] and other[0] <= window[2] and window[1] <= other[3] and other[1] <= window[3]:
+                        windows[k] = (min(window[0], other[0]), min(window[1], other[1]),
+                                      max(window[2], other[2]), max(window[3], other[3]))
+                        changed = True
+                        break
+                else:
+                    windows.append(window)
+        return [_clip(w, 0, width, height) for w in windows]
+
+    def _drop_inside(self, window):
+        """
+        Removes cached components lying inside a window.
+
+        :param tuple[int, int, int, int] window: (left, top, right, bottom) region in pixels.
+        :rtype: None
+        """
+        left, top, right, bottom = window
+        rects = self._rects
+        inside = ((rects[:, 0] >= left) & (rects[:, 1] >= top) &
+                  (rects[:, 0] + rects[:, 2] <= right) & (rects[:, 1] + rects[:, 3] <= bottom))
+        self._rects, self._ranks, self._keep = rects[~inside], self._ranks[~inside], self._keep[~inside]
+
+    def _extract(self, window):
+        """
+        Extracts the components of every rank inside a window and adds them to the cache.
+
+        :param tuple[int, int, int, int] window: (left, top, right, bottom) region in pixels.
+        :rtype: None
+        """
+        left, top, right, bottom = window
+        present = present_ranks(self._labels[top:bottom, left:right])
+        rects, ranks, keep = [self._rects], [self._ranks], [self._keep]
+        for i in range(len(RANKS)):
+            if present & (1 << i):
+                found, flags = component_stats(self._labels, 1 << i, window)
+                rects.append(found.astype(np.int64))
+                ranks.append(np.full(len(found), i, dtype=np.int64))
+                keep.append(flags)
+        self._rects, self._ranks, self._keep = np.concatenate(rects), np.concatenate(ranks), np.concatenate(keep)
+
+    def _objects(self, object_tolerance):
+        """
+        Builds the detection result from the cached components.
+
+        :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+        :returns: List of detected objects, highest rank first.
+        :rtype: list of dict
+        """
+        detected = []
+        for i, (rank, bgr, _) in enumerate(RANKS):
+            selected = (self._ranks == i) & self._keep
+            if not selected.any():
+                continue
+            # Sort by position so the merge order does not depend on update history
+            rects = self._rects[selected]
+            rects = rects[np.lexsort((rects[:, 0], rects[:, 1]))]
+            for rect in merge_rectangles([tuple(r) for r in rects.tolist()], object_tolerance):
+                detected.append({"rank": rank, "rect": rect, "cv2color": bgr})
+        detected.sort(key=lambda o: -RANK_ORDER[o['rank']])
+        return detected
+
+def _clip(window, pad, width, height):
+    """
+    Pads a window and clips it to the frame.
+
+    :param tuple[int, int, int, int] window: (left, top, right, bottom) region in pixels.
+    :param int pad: Pixels to add on every side.
+    :param int width: Frame width in pixels.
+    :param int height: Frame height in pixels.
+    :returns: The padded and clipped window.
+    :rtype: tuple[int, int, int, int]
+    """
+    left, top, right, bottom = window
+    return max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+"""
+import math
+import threading
+import time
+
+PREFIX = "chiseler_"
+
+class Counter:
+    """
+    Monotonically increasing count, e.g. of rolls or dropped frames.
+
+    :ivar value: The current count.
+    :vartype value: int
+    """
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """
+        :param int amount: Amount to add.
+        :rtype: None
+        """
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    """
+    Value read from a callback whenever the metrics are collected.
+
+    :ivar read: Function returning the current value.
+    :vartype read: callable
+    """
+    kind = "gauge"
+
+    def __init__(self, read):
+        """
+        :param callable read: Function returning the current value as a number.
+        :rtype: None
+        """
+        self.read = read
+
+    def snapshot(self):
+        try:
+            return float(self.read())
+        except Exception:
+            return math.nan # The object behind the gauge went away
+
+class Histogram:
+    """
+    Histogram of durations with a fixed relative precision, in the style of HDR histograms.
+
+    Each power of two between ``lowest`` and ``highest`` is split into ``sub_buckets``
+    linear buckets, so every recorded value is known to within ``1 / sub_buckets`` of itself
+    whatever its magnitude. Recording is a handful of arithmetic operations and one list
+    increment, and the memory used does not grow with the number of samples.
+
+    :ivar count: Number of recorded values.
+    :vartype count: int
+
+    :ivar total: Sum of the recorded values.
+    :vartype total: float
+
+    :ivar max: Largest recorded value.
+    :vartype max: float
+    """
+    kind = "summary"
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, lowest=1e-6, highest=1e3, sub_buckets=32):
+        """
+        :param float lowest: Smallest distinguishable value; anything below falls into the first bucket.
+        :param float highest: Largest distinguishable value; anything above falls into the last bucket.
+        :param int sub_buckets: Linear buckets per power of two.
+        :rtype: None
+        """
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        self._counts = [0] * ((math.frexp(highest / lowest)[1] + 1) * sub_buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest) # value = lowest * mantissa * 2**exponent, 0.5 <= mantissa < 1
+        return min(len(self._counts) - 1, exponent * self.sub_buckets + int((mantissa * 2 - 1) * self.sub_buckets))
+
+    def _upper_bound(self, index):
+        exponent, sub = divmod(index, self.sub_buckets)
+        return self.lowest * 2.0 ** (exponent - 1) * (1 + (sub + 1) / self.sub_buckets)
+
+    def record(self, value):
+        """
+        :param float value: The value, usually a duration in seconds.
+        :rtype: None
+        """
+        index = self._index(value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        """
+        Returns a context manager recording the time spent in its block.
+
+        :rtype: _Timer
+        """
+        return _Timer(self)
+
+    def quantile(self, q):
+        """
+        Returns an upper bound of the given quantile of the recorded values.
+
+        :param float q: The quantile, between 0 and 1.
+        :returns: The quantile, or 0.0 if nothing was recorded.
+        :rtype: float
+        """
+        with self._lock:
+            return self._quantile(q)
+
+    def _quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._upper_bound(index), self.max)
+        return self.max
+
+    def snapshot(self):
+        """
+        :returns: A dict with ``count``, ``sum``, ``max`` and one entry per quantile in ``QUANTILES``.
+        :rtype: dict
+        """
+        with self._lock:
+            stats = {"count": self.count, "sum": self.total, "max": self.max}
+            for q in self.QUANTILES:
+                stats[q] = self._quantile(q)
+        return stats
+
+class _Timer:
+    """
+    Context manager recording the duration of its block into a histogram.
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms, optionally labelled, e.g. by station.
+
+    Metrics are created once (usually at import time) and updated directly, so the registry
+    itself is only involved when the metrics are collected by ``render`` or ``snapshot``.
+    """
+    def __init__(self):
+        self._metrics = {} # name -> (kind, help, {labels: metric})
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, factory):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            kind, _, series = self._metrics.setdefault(name, (cls.kind, help, {}))
+            if kind != cls.kind:
+                raise ValueError(f"Metric {name} is a {kind}, not a {cls.kind}")
+            metric = series.get(key)
+            if metric is None:
+                metric = series[key] = factory()
+            return metric
+
+    def counter(self, name, help="", labels=None):
+        """
+        Returns the counter of a name and labels, creating it if needed.
+
+        :param str name: Metric name without the ``PREFIX``, e.g. ``"rolls_total"``.
+        :param str help: Description of the metric.
+        :param dict labels: Label names and values telling series of the same metric apart.
+        :rtype: Counter
+        """
+        return self._get(Counter, name, help, labels, Counter)
+
+    def histogram(self, name, help="", labels=None):
+        """
+        Returns the histogram of a name and labels, creating it if needed.
+
+        :param str name: Metric name without the ``PREFIX``, e.g. ``"stage_seconds"``.
+        :param str help: Description of the metric.
+        :param dict labels: Label names and values telling series of the same metric apart.
+        :rtype: Histogram
+        """
+        return self._get(Histogram, name, help, labels, Histogram)
+
+    def gauge(self, name, read, help="", labels=None):
+        """
+        Registers a gauge, replacing any previous one of the same name and labels.
+
+        :param str name: Metric name without the ``PREFIX``.
+        :param callable read: Function returning the current value.
+        :param str help: Description of the metric.
+        :param dict labels: Label names and values telling series of the same metric apart.
+        :rtype: Gauge
+        """
+        gauge = self._get(Gauge, name, help, labels, lambda: Gauge(read))
+        gauge.read = read
+        return gauge
+
+    def snapshot(self):
+        """
+        Collects the current value of every metric.
+
+        :returns: name -> {labels tuple: value}, where the value is an int for counters,
+            a float for gauges and a ``Histogram.snapshot`` dict for histograms.
+        :rtype: dict
+        """
+        with self._lock:
+            metrics = {name: dict(series) for name, (_, _, series) in self._metrics.items()}
+        return {name: {key: metric.snapshot() for key, metric in series.items()}
+                for name, series in metrics.items()}
+
+    def render(self):
+        """
+        Formats every metric in the Prometheus text exposition format. Histograms are
+        exposed as summaries with quantiles.
+
+        :rtype: str
+        """
+        with self._lock:
+            metrics = [(name, kind, help, dict(series)) for name, (kind, help, series) in sorted(self._metrics.items())]
+        lines = []
+        for name, kind, help, series in metrics:
+            full = PREFIX + name
+            if help:
+                lines.append(f"# HELP {full} {help}")
+            lines.append(f"# TYPE {full} {kind}")
+            for key, metric in sorted(series.items()):
+                value = metric.snapshot()
+                if kind != "summary":
+                    lines.append(f"{full}{_labels(key)} {'NaN' if value != value else value}")
+                    continue
+                for q in Histogram.QUANTILES:
+                    lines.append(f"{full}{_labels(key + (('quantile', str(q)),))} {value[q]!r}")
+                lines.append(f"{full}_sum{_labels(key)} {value['sum']!r}")
+                lines.append(f"{full}_count{_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+def _labels(key):
+    if not key:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+# Registry of the whole process, shared by every module
+REGISTRY = MetricsRegistry()
+
+# Duration of each step from capturing a frame to clicking; the stage label names the step
+STAGE_HELP = "Time spent in each processing stage in seconds"
+
+def stage(name, labels=None):
+    """
+    Returns the ``stage_seconds`` histogram of a stage.
+
+    :param str name: The stage, e.g. ``"capture"`` or ``"mask"``.
+    :param dict labels: Additional labels, e.g. the station.
+    :rtype: Histogram
+    """
+    return REGISTRY.histogram("stage_seconds", STAGE_HELP, dict(labels or {}, stage=name))
+
+class MetricsServer(threading.Thread):
+    """
+    Serves the metrics of a registry as text on ``http://<host>:<port>/metrics``, for
+    Prometheus or a quick look in the browser.
+
+    :ivar error: Error that stopped the server, e.g. the port being in use.
+    :vartype error: OSError or None
+
+    :ivar ready: Set once the server listens, or failed to.
+    :vartype ready: threading.Event
+    """
+    def __init__(self, registry=REGISTRY, host="127.0.0.1", port=54172):
+        """
+        :param MetricsRegistry registry: Registry to serve.
+        :param str host: Interface to listen on; keep it local, the metrics are not protected.
+        :param int port: Port to listen on.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name="MetricsServer")
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.error = None
+        self.ready = threading.Event()
+        self._server = None
+
+    def run(self):
+        import http.server # Only needed when the endpoint is enabled
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # Scraped every few seconds, keep the console clean
+
+        try:
+            self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.error = e
+            print(f"[ERROR] Metrics endpoint could not listen on port {self.port}: {e}")
+            return
+        finally:
+            self.ready.set()
+        self._server.serve_forever(poll_interval=0.5)
+        self._server.server_close()
+
+    def stop(self):
+        """
+        Stops the server.
+
+        :rtype: None
+        """
+        self.ready.wait(1.0)
+        if self._server is not None:
+            self._server.shutdown()
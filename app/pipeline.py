@@ -0,0 +1,656 @@
+# -*- coding: utf-8 -*-
+"""
+pipeline.py
+"""
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from app.metrics import REGISTRY
+
+_FRAMES_CAPTURED = REGISTRY.counter("frames_captured_total", "Frames added to a frame ring")
+_FRAMES_ANALYZED = REGISTRY.counter("frames_analyzed_total", "Frames taken from a frame ring for detection")
+_FRAMES_DROPPED = REGISTRY.counter("frames_dropped_total", "Frames replaced by newer ones before they were analyzed")
+
+class Frame:
+    """
+    A captured image together with its position in the capture sequence.
+
+    :ivar seq: Sequence number, increasing by one per captured frame.
+    :vartype seq: int
+
+    :ivar timestamp: ``time.perf_counter()`` value at capture time.
+    :vartype timestamp: float
+
+    :ivar image: The captured pixels.
+    :vartype image: numpy.ndarray
+
+    :ivar area: Screen area (left, top, right, bottom) the pixels were captured from, if known.
+    :vartype area: tuple[int, int, int, int] or None
+    """
+    __slots__ = ("seq", "timestamp", "image", "area", "_slot")
+
+    def __init__(self, seq, timestamp, image, area=None, slot=None):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.image = image
+        self.area = area
+        self._slot = slot # Index of the ring buffer holding the pixels, if any
+
+class FrameRing:
+    """
+    Bounded buffer between the capture and detection stages with drop-oldest semantics.
+
+    The capture stage ``put``\\s frames as fast as it captures them; when ``capacity`` frames
+    are already waiting, the oldest one is dropped. The detection stage calls ``latest``,
+    which returns the newest frame and skips everything older, so decisions are always made
+    on the freshest pixels no matter how long the previous detection took.
+
+    The ring also works as a buffer pool for ``ScreenCapture``: ``acquire`` hands out one of
+    ``capacity + 2`` preallocated buffers that is neither queued nor being read by the consumer,
+    so frames are captured in place and never overwritten while detection still uses them.
+
+    :ivar capacity: Maximum number of frames waiting for the consumer.
+    :vartype capacity: int
+
+    :ivar count: Number of preallocated buffers (``capacity`` queued, one written, one read).
+    :vartype count: int
+
+    :ivar produced: Number of frames put into the ring.
+    :vartype produced: int
+
+    :ivar consumed: Number of frames returned by ``latest``.
+    :vartype consumed: int
+
+    :ivar dropped: Number of frames discarded without being consumed.
+    :vartype dropped: int
+
+    :ivar allocations: Number of buffers allocated so far.
+    :vartype allocations: int
+    """
+    def __init__(self, capacity=2):
+        """
+        Initializes an empty ring.
+
+        :param int capacity: Maximum number of frames waiting for the consumer, at least 1.
+        :rtype: None
+        """
+        self.capacity = max(1, capacity)
+        self.count = self.capacity + 2
+        self.produced = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.allocations = 0
+        self._queue = deque()
+        self._buffers = [None] * self.count
+        self._writing = None # Slot handed out by acquire and not put yet
+        self._reading = None # Slot of the frame last returned by latest
+        self._seq = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Returns a buffer to capture the next frame into.
+
+        :param tuple shape: Shape of the buffer.
+        :param dtype: NumPy data type of the buffer.
+        :returns: An uninitialized array of the requested shape.
+        :rtype: numpy.ndarray
+        """
+        with self._cond:
+            busy = {frame._slot for frame in self._queue}
+            busy.add(self._reading)
+            free = [k for k in range(self.count) if k not in busy]
+            slot = free[0] # capacity + 2 buffers, so one is always free
+            buffer = self._buffers[slot]
+            if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+                buffer = self._allocate(slot, shape, dtype)
+                self._buffers[slot] = buffer
+                self.allocations += 1
+            self._writing = slot
+            return buffer
+
+    def _allocate(self, slot, shape, dtype):
+        """
+        Allocates the buffer of a slot. Subclasses override it to place frames elsewhere.
+
+        :param int slot: Index of the slot.
+        :param tuple shape: Shape of the buffer.
+        :param dtype: NumPy data type of the buffer.
+        :rtype: numpy.ndarray
+        """
+        return np.empty(shape, dtype=dtype)
+
+    def put(self, image, timestamp=None, area=None):
+        """
+        Adds a captured frame, dropping the oldest waiting frame if the ring is full.
+
+        :param numpy.ndarray image: The captured pixels. If it is not the buffer last handed
+            out by ``acquire``, the ring keeps a reference, so it must not be reused by the caller.
+        :param float timestamp: Capture time from ``time.perf_counter()``. Defaults to now.
+        :param tuple[int, int, int, int] area: Screen area the pixels were captured from.
+        :returns: The queued frame.
+        :rtype: Frame
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        with self._cond:
+            slot = self._writing if self._writing is not None and image is self._buffers[self._writing] else None
+            self._writing = None
+            frame = Frame(self._seq, timestamp, image, area, slot)
+            self._seq += 1
+            self.produced += 1
+            _FRAMES_CAPTURED.inc()
+            self._queue.append(frame)
+            if len(self._queue) > self.capacity:
+                self._queue.popleft()
+                self.dropped += 1
+                _FRAMES_DROPPED.inc()
+            self._cond.notify_all()
+            return frame
+
+    def latest(self, after_seq=-1, timeout=None):
+        """
+        Returns the newest frame, waiting for one newer than ``after_seq`` if necessary.
+
+        Older waiting frames are dropped. The returned frame's pixels stay valid until the
+        next call to ``latest``.
+
+        :param int after_seq: Only return frames with a higher sequence number.
+        :param float timeout: Maximum time to wait in seconds, or ``None`` to wait forever.
+        :returns: The newest frame, or ``None`` on timeout or after ``close``.
+        :rtype: Frame or None
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._closed or (self._queue and self._queue[-1].seq > after_seq), timeout
+            )
+            if not ready or self._closed:
+                return None
+            frame = self._queue.pop()
+            self.dropped += len(self._queue)
+            _FRAMES_DROPPED.inc(len(self._queue))
+            self._queue.clear()
+            self._reading = frame._slot
+            self.consumed += 1
+            _FRAMES_ANALYZED.inc()
+            return frame
+
+    def pending(self):
+        """
+        Returns the number of frames waiting for the consumer.
+
+        :rtype: int
+        """
+        with self._cond:
+            return len(self._queue)
+
+    def close(self):
+        """
+        Wakes up every waiting consumer; ``latest`` returns ``None`` from now on.
+
+        :rtype: None
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Returns the frame counters.
+
+        :returns: A dict with ``produced``, ``consumed``, ``dropped`` and ``pending``.
+        :rtype: dict
+        """
+        with self._cond:
+            return {
+                "produced": self.produced,
+                "consumed": self.consumed,
+                "dropped": self.dropped,
+                "pending": len(self._queue),
+            }
+
+class CaptureStage(threading.Thread):
+    """
+    Thread that captures the game area at a fixed cadence and feeds a ``FrameRing``.
+
+    Capture never waits for detection, so the capture rate only depends on the capture
+    backend and the poll delay.
+
+    :ivar capturer: Frame source.
+    :vartype capturer: app.capture.CaptureBackend
+
+    :ivar ring: Ring the captured frames are put into.
+    :vartype ring: FrameRing
+
+    :ivar failing: True while the last capture attempt failed.
+    :vartype failing: bool
+
+    :ivar capture_seconds: Duration of the last successful capture.
+    :vartype capture_seconds: float
+
+    :ivar stop_event: Event used to signal this thread to stop.
+    :vartype stop_event: threading.Event
+    """
+    def __init__(self, capturer, ring, get_area, get_delay_ms):
+        """
+        Initializes the capture thread.
+
+        :param app.capture.CaptureBackend capturer: Frame source. It is closed when the thread exits.
+        :param FrameRing ring: Ring to put the captured frames into.
+        :param callable get_area: Returns the current (left, top, right, bottom) game area, or ``None``.
+        :param callable get_delay_ms: Returns the current delay between captures in milliseconds.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name="CaptureStage")
+        self.capturer = capturer
+        self.ring = ring
+        self.get_area = get_area
+        self.get_delay_ms = get_delay_ms
+        self.failing = False
+        self.capture_seconds = 0.0
+        self.stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                area = self.get_area()
+                if area is None:
+                    self.stop_event.wait(0.1) # Wait if area not set by user
+                    continue
+                timestamp = time.perf_counter()
+                image = self.capturer.capture(bbox=area)
+                self.failing = image is None
+                if image is None:
+                    self.stop_event.wait(0.1) # Short delay before retrying capture
+                    continue
+                self.capture_seconds = time.perf_counter() - timestamp
+                self.ring.put(image, timestamp, area)
+                delay_ms = self.get_delay_ms()
+                if delay_ms > 0:
+                    self._wake.wait(delay_ms / 1000)
+                    self._wake.clear()
+        finally:
+            self.capturer.close()
+
+    def stop(self):
+        """
+        Signals the thread to stop. The capturer is closed once the current capture completes.
+
+        :rtype: None
+        """
+        self.stop_event.set()
+        self._wake.set()
+
+    def wake(self):
+        """
+        Cuts the current delay between captures short, e.g. right after a click.
+
+        :rtype: None
+        """
+        self._wake.set()
+
+class PreviewTap:
+    """
+    Hands frames and detections the image processor already produced to the preview window.
+
+    The preview ``request``\\s a frame whenever it is ready to draw one, and the processor
+    ``offer``\\s every analyzed frame. Only a requested frame is copied, into a buffer that is
+    reused from frame to frame, so an open preview costs one copy per displayed frame and
+    a closed one costs nothing.
+    """
+    def __init__(self):
+        """
+        Initializes a tap with no frame requested.
+
+        :rtype: None
+        """
+        self._image = None # Reused copy of the last offered frame
+        self._objs = None
+        self._area = None
+        self._requested = False
+        self._ready = False
+        self._cond = threading.Condition()
+
+    def request(self):
+        """
+        Asks for the next analyzed frame. The frame returned by ``wait`` before is invalid from now on.
+
+        :rtype: None
+        """
+        with self._cond:
+            self._requested = True
+            self._ready = False
+
+    def offer(self, image, detected_objs, area=None):
+        """
+        Provides an analyzed frame, copied only if the preview requested one.
+
+        :param numpy.ndarray image: The frame.
+        :param list[dict] detected_objs: Detections on the frame.
+        :param tuple[int, int, int, int] area: Screen area of the frame.
+        :rtype: None
+        """
+        if not self._requested:
+            return
+        with self._cond:
+            if not self._requested:
+                return
+            if self._image is None or self._image.shape != image.shape or self._image.dtype != image.dtype:
+                self._image = np.empty_like(image)
+            np.copyto(self._image, image)
+            self._objs = detected_objs
+            self._area = area
+            self._requested = False
+            self._ready = True
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        """
+        Waits for the requested frame.
+
+        :param float timeout: Maximum time to wait in seconds.
+        :returns: (frame, detected_objs, area), or ``None`` if no frame was offered in time.
+            The frame stays valid until the next ``request``.
+        :rtype: tuple or None
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._ready, timeout):
+                return None
+            return self._image, self._objs, self._area
+
+_RUN = 4 # Capture intervals averaged into one full-speed measurement
+
+class PollController:
+    """
+    Chooses the delay between captures from what the frames are doing.
+
+    Captures run at the fastest allowed rate right after a click or a change of the frame
+    and keep that rate for ``hold_ms``. While frames stay static the delay grows by ``backoff``
+    per capture up to ``max_delay_ms``, and while the reroller is suspended it is
+    ``idle_delay_ms``. The delay never drops below the measured detection time minus the
+    capture time, since detection would only skip the extra frames.
+
+    :ivar max_delay_ms: Longest delay while running.
+    :vartype max_delay_ms: int
+
+    :ivar idle_delay_ms: Delay while the reroller is suspended.
+    :vartype idle_delay_ms: int
+
+    :ivar backoff: Factor the delay grows by per static capture.
+    :vartype backoff: float
+
+    :ivar hold_ms: How long to stay at full speed after a click or change.
+    :vartype hold_ms: int
+    """
+    def __init__(self, max_delay_ms=100, idle_delay_ms=250, backoff=1.5, hold_ms=500, window=2.0):
+        """
+        :param int max_delay_ms: Longest delay while running.
+        :param int idle_delay_ms: Delay while the reroller is suspended.
+        :param float backoff: Factor the delay grows by per static capture.
+        :param int hold_ms: How long to stay at full speed after a click or change.
+        :param float window: Seconds of captures the rate statistics cover.
+        :rtype: None
+        """
+        self.max_delay_ms = max_delay_ms
+        self.idle_delay_ms = idle_delay_ms
+        self.backoff = backoff
+        self.hold_ms = hold_ms
+        self.window = window
+        self._delay_ms = 0.0 # Current delay on top of the floor, 0 at full speed
+        self._kicked_at = time.perf_counter()
+        self._detect_ms = 0.0 # Moving average of the detection time
+        self._captures = deque() # Timestamps of recent captures
+        self._fastest_interval = None # Shortest time seen between captures, see stats
+        self._min_delay_ms = None # Shortest delay the fastest interval was measured with
+        self._lock = threading.Lock()
+
+    def kick(self):
+        """
+        Goes back to full speed, e.g. after a click or a change of the frame.
+
+        :rtype: None
+        """
+        with self._lock:
+            self._delay_ms = 0.0
+            self._kicked_at = time.perf_counter()
+
+    def observe(self, changed, detect_seconds):
+        """
+        Records the outcome of analyzing a frame.
+
+        :param bool changed: Whether the frame differed from the previous one.
+        :param float detect_seconds: Time spent analyzing the frame.
+        :rtype: None
+        """
+        if changed:
+            self.kick()
+        with self._lock:
+            self._detect_ms += (detect_seconds * 1000 - self._detect_ms) * 0.2
+
+    def delay_ms(self, min_delay_ms, capture_seconds=0.0, running=True):
+        """
+        Returns the delay before the next capture, and records that a capture happened.
+
+        :param int min_delay_ms: Shortest delay, used at full speed.
+        :param float capture_seconds: Duration of the capture that just completed.
+        :param bool running: Whether the reroller is running.
+        :returns: The delay in milliseconds.
+        :rtype: float
+        """
+        now = time.perf_counter()
+        capture_ms = capture_seconds * 1000
+        with self._lock:
+            self._captures.append(now)
+            while self._captures and now - self._captures[0] > self.window:
+                self._captures.popleft()
+            if min_delay_ms != self._min_delay_ms:
+                self._min_delay_ms = min_delay_ms
+                self._fastest_interval = None # Measured with another shortest delay
+            if len(self._captures) > _RUN:
+                # Averaged over a few captures, so a single early wake-up does not count as the full speed
+                interval = (now - self._captures[-1 - _RUN]) / _RUN
+                if self._fastest_interval is None or interval < self._fastest_interval:
+                    self._fastest_interval = interval
+            fastest = max(min_delay_ms, self._detect_ms - capture_ms)
+            if not running:
+                return max(fastest, self.idle_delay_ms)
+            if (now - self._kicked_at) * 1000 >= self.hold_ms:
+                self._delay_ms = min(self.max_delay_ms, max(self._delay_ms, 1.0) * self.backoff)
+            return max(fastest, min(self.max_delay_ms, self._delay_ms))
+
+    def stats(self):
+        """
+        Summarizes the recent capture rate.
+
+        :returns: A dict with the recent ``fps``, the ``full_speed_fps`` that polling at the
+            shortest delay would reach, the share of captures ``saved`` by backing off (0.0 to 1.0)
+            and the average ``detect_ms``.
+        :rtype: dict
+        """
+        with self._lock:
+            captures = list(self._captures)
+            fastest = self._fastest_interval
+            detect_ms = self._detect_ms
+        if len(captures) < 2:
+            return {"fps": 0.0, "full_speed_fps": 0.0, "saved": 0.0, "detect_ms": detect_ms}
+        span = captures[-1] - captures[0]
+        fps = (len(captures) - 1) / span if span > 0 else 0.0
+        # The fastest rate measured since the shortest delay last changed, including the capture,
+        # the detection limit and the scheduling overhead. It is kept across windows, so the
+        # savings still show after polling backed off for longer than one window; the current
+        # rate is a measured rate too, so the full speed is never below it
+        full_speed_fps = max(fps, 1 / fastest if fastest else 0.0)
+        return {
+            "fps": fps,
+            "full_speed_fps": full_speed_fps,
+            "saved": 1 - fps / full_speed_fps if full_speed_fps else 0.0,
+            "detect_ms": detect_ms,
+        }
+
+class SettleMonitor:
+    """
+    Tells the reroll loop when the pip area changed and then stayed still after a click.
+
+    The reroll loop ``arm``\\s the monitor right before clicking and ``wait``\\s for it; the
+    image processor ``observe``\\s the fingerprint of every frame it analyzes. The area counts as
+    settled once it changed after arming and then stayed identical for ``quiet_ms``, so cycle
+    time follows how fast the game actually responds instead of a fixed delay.
+
+    :ivar quiet_ms: How long the area must stay unchanged to count as settled.
+    :vartype quiet_ms: int
+
+    :ivar settles: Number of waits that ended because the area settled.
+    :vartype settles: int
+
+    :ivar timeouts: Number of waits that ended on the timeout.
+    :vartype timeouts: int
+    """
+    def __init__(self, quiet_ms=60):
+        """
+        :param int quiet_ms: How long the area must stay unchanged to count as settled.
+        :rtype: None
+        """
+        self.quiet_ms = quiet_ms
+        self.settles = 0
+        self.timeouts = 0
+        self._settle_times = LatencyTracker(window=128)
+        self._fingerprint = None
+        self._changed_at = 0.0 # Capture time of the last frame that differed from the one before
+        self._armed_at = None # perf_counter() of the last arm, None when not armed
+        self._changed = False # Whether the area changed since arming
+        self._settled = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def arm(self):
+        """
+        Starts waiting for a change. Call it right before the click that changes the area.
+
+        :rtype: None
+        """
+        with self._cond:
+            self._armed_at = time.perf_counter()
+            self._changed = False
+            self._settled = False
+
+    def observe(self, fingerprint, timestamp, hold=False):
+        """
+        Records the fingerprint of an analyzed frame.
+
+        :param fingerprint: Hashable fingerprint of the frame, see ``app.cache.frame_fingerprint``.
+        :param float timestamp: Capture time of the frame from ``time.perf_counter()``.
+        :param bool hold: Do not report the area as settled yet, e.g. while a stop
+            condition is being confirmed.
+        :rtype: None
+        """
+        with self._cond:
+            if fingerprint != self._fingerprint:
+                self._fingerprint = fingerprint
+                self._changed_at = timestamp
+                if self._armed_at is not None and timestamp >= self._armed_at:
+                    self._changed = True
+            if self._armed_at is None or not self._changed or hold:
+                return
+            if (timestamp - self._changed_at) * 1000 >= self.quiet_ms:
+                self._settle_times.add(timestamp - self._armed_at)
+                self._armed_at = None
+                self._settled = True
+                self._cond.notify_all()
+
+    def wait(self, timeout):
+        """
+        Waits until the area settled after the last ``arm``.
+
+        :param float timeout: Maximum time to wait in seconds.
+        :returns: True if the area settled, False on timeout or after ``close``.
+        :rtype: bool
+        """
+        with self._cond:
+            settled = self._cond.wait_for(lambda: self._settled or self._closed, timeout) and self._settled
+            self._armed_at = None
+            if settled:
+                self.settles += 1
+            elif not self._closed:
+                self.timeouts += 1
+            return settled
+
+    def close(self):
+        """
+        Wakes up every waiting caller; ``wait`` returns False from now on.
+
+        :rtype: None
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Summarizes how the waits ended.
+
+        :returns: A dict with ``settles``, ``timeouts`` and the arm-to-settle time
+            (``mean_ms``, ``p50_ms``, ``p99_ms``, ``max_ms``) of recent settles.
+        :rtype: dict
+        """
+        stats = self._settle_times.stats()
+        del stats["count"]
+        with self._cond:
+            stats.update(settles=self.settles, timeouts=self.timeouts)
+        return stats
+
+class LatencyTracker:
+    """
+    Keeps the most recent latency samples and summarizes them.
+
+    :ivar window: Number of recent samples kept.
+    :vartype window: int
+
+    :ivar count: Number of samples recorded since creation.
+    :vartype count: int
+    """
+    def __init__(self, window=512):
+        """
+        :param int window: Number of recent samples kept.
+        :rtype: None
+        """
+        self.window = window
+        self.count = 0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        """
+        Records one latency sample.
+
+        :param float seconds: The latency in seconds.
+        :rtype: None
+        """
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def stats(self):
+        """
+        Summarizes the recent samples.
+
+        :returns: A dict with ``count`` and the ``mean_ms``, ``p50_ms``, ``p99_ms`` and
+            ``max_ms`` of the recent samples (0.0 when empty).
+        :rtype: dict
+        """
+        with self._lock:
+            samples = np.array(self._samples)
+            count = self.count
+        if not samples.size:
+            return {"count": count, "mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        return {
+            "count": count,
+            "mean_ms": float(samples.mean() * 1000),
+            "p50_ms": float(np.percentile(samples, 50) * 1000),
+            "p99_ms": float(np.percentile(samples, 99) * 1000),
+            "max_ms": float(samples.max() * 1000),
+        }
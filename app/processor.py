@@ -2,18 +2,71 @@
 """
 processor.py
 """
+import functools
 import threading
 import time
 
-import cv2
-
+from app.cache import DetectionCache, frame_fingerprint
 from app.capture import ScreenCapture
-from app.config import ENABLE_LOGGING, ENABLE_SLOTS_SOCKET, SLOTS_SOCKET_PORT
+from app.config import (
+    ADAPTIVE_POLLING, DETECTION_MODE, ENABLE_LOGGING, OUT_OF_PROCESS_DETECTION, POLL_IDLE_DELAY_MS,
+    POLL_MAX_DELAY_MS, PYRAMID_STRIDE, SETTLE_QUIET_MS, SLOT_ROI_PADDING, SLOT_ROI_VERIFY_FRAMES, SLOT_ROIS
+)
 from app.constants import RANKS, RANK_ORDER
+from app.detection import detect_objects
+from app.incremental import IncrementalDetector
+from app.metrics import REGISTRY, stage
+from app.pipeline import CaptureStage, FrameRing, LatencyTracker, PollController, SettleMonitor
+from app.pyramid import CoarseToFineDetector
+from app.regions import Region, union_area
+from app.roi import RoiStore, SlotCache, drop_excluded
+from app.tracking import PipTracker
+from app.worker import DetectionWorker, SharedFrameRing
+
+_DETECT_SECONDS = stage("detect")
+_STOP_SECONDS = stage("stop")
+_DECISION_SECONDS = REGISTRY.histogram("decision_latency_seconds", "Time from capturing a frame to deciding on it in seconds")
+
+def stop_condition_met(detected_objs, min_quality, min_objects, stop_at_ss):
+    """
+    Evaluate the stop rules against the pips detected in one frame.
+
+    At least ``min_objects`` pips must be of rank ``min_quality`` or better and, when
+    ``stop_at_ss`` is above 0, at least that many of them must be SS.
+
+    :param list detected_objs: Detected pip objects with 'rank' keys.
+    :param str min_quality: Lowest rank that counts towards ``min_objects``.
+    :param int min_objects: Required number of pips of ``min_quality`` or better.
+    :param int stop_at_ss: Required number of SS pips, 0 to ignore SS.
+    :returns: True if the reroll loop should stop.
+    :rtype: bool
+    """
+    min_rank_idx = RANK_ORDER[min_quality]
+    filtered_count = sum(1 for obj in detected_objs if RANK_ORDER[obj['rank']] >= min_rank_idx)
+    if stop_at_ss > 0:
+        ss_count = sum(1 for obj in detected_objs if obj['rank'] == "SS")
+        return filtered_count >= min_objects and ss_count >= stop_at_ss
+    return filtered_count >= min_objects
+
+def make_stop_rule(min_quality="F", min_objects=1, stop_at_ss=0):
+    """
+    Create a stop predicate with fixed settings, e.g. for a ``Region`` with rules of its own.
+
+    :param str min_quality: Lowest rank that counts towards ``min_objects``.
+    :param int min_objects: Required number of pips of ``min_quality`` or better.
+    :param int stop_at_ss: Required number of SS pips, 0 to ignore SS.
+    :returns: A function called as ``rule(detected_objs)`` returning True to stop.
+    :rtype: callable
+    """
+    return lambda detected_objs: stop_condition_met(detected_objs, min_quality, min_objects, stop_at_ss)
+
+def _where(region, regions):
+    # Names the region in status messages, unless it is the only one watched
+    return f" in {region.name}" if len(regions) > 1 else ""
 
 class ImageProcessor(threading.Thread):
     """
-    Thread that continuously captures screenshots, detects pips, and signals when reroll conditions are met.
+    Thread that continuously detects pips in captured screenshots and signals when reroll conditions are met.
 
     This class runs as a daemon thread to perform background image processing tasks
     independently from the main application flow. It captures screen regions, processes
@@ -32,88 +85,243 @@ class ImageProcessor(threading.Thread):
     :ivar lock: Lock to synchronize access to shared data like rank counts.
     :vartype lock: threading.Lock
 
-    :ivar screen_capturer: Instance of the ScreenCapture class used for optimized screenshot capture.
-    :vartype screen_capturer: ScreenCapture
+    :ivar ring: Buffer between the capture stage and this thread; detection always takes the newest frame.
+    :vartype ring: app.pipeline.FrameRing
+
+    :ivar capture_stage: Thread that captures the game area into ``ring`` at the poll delay cadence.
+    :vartype capture_stage: app.pipeline.CaptureStage
+
+    :ivar latency: Time from the capture of a frame to the stop decision made on it.
+    :vartype latency: app.pipeline.LatencyTracker
+
+    :ivar screen_capturer: Frame source, the live ``ScreenCapture`` unless another backend is given.
+    :vartype screen_capturer: app.capture.CaptureBackend
+
+    :ivar frames_processed: Number of frames captured and analyzed since the thread started.
+    :vartype frames_processed: int
+
+    :ivar detection_cache: LRU cache of detections keyed by frame fingerprint, so unchanged frames skip detection.
+    :vartype detection_cache: app.cache.DetectionCache
+
+    :ivar detector: Tile-based detector that only reanalyzes the parts of the frame that changed.
+    :vartype detector: app.incremental.IncrementalDetector
+
+    :ivar regions: Named areas watched in one capture of their union, or ``None`` to watch
+        ``app.game_area`` with the app's stop settings.
+    :vartype regions: list[app.regions.Region] or None
+
+    :ivar region_results: Detections of the latest frame, by region name.
+    :vartype region_results: dict[str, list]
+
+    :ivar settle: Reports to the reroll loop when the watched area settled after a click.
+    :vartype settle: app.pipeline.SettleMonitor
+
+    :ivar worker: Process that runs detection outside this process's GIL, if enabled.
+    :vartype worker: app.worker.DetectionWorker or None
+
+    :ivar hub: Hub that detections are published to for the slot display and other subscribers, if enabled.
+    :vartype hub: app.hub.DetectionHub or None
+
+    :ivar preview: Tap the preview window takes analyzed frames from, if any.
+    :vartype preview: app.pipeline.PreviewTap or None
+
+    :ivar poll: Adapts the delay between captures, from ``app.image_poll_delay_ms`` at full speed
+        up to ``POLL_MAX_DELAY_MS`` while nothing changes.
+    :vartype poll: app.pipeline.PollController
+
+    :ivar slot_rois: Whether detection learns the pip slots of each region and scans only them.
+    :vartype slot_rois: bool
+
+    :ivar roi_store: Where learned slots are loaded from and saved to, if anywhere.
+    :vartype roi_store: app.roi.RoiStore or None
+
+    :ivar detection_mode: ``"exact"`` to classify every pixel of the frames that changed, or
+        ``"pyramid"`` to classify a strided view first and refine around the matches.
+    :vartype detection_mode: str
+
+    :ivar pyramid: Detector used in the ``"pyramid"`` mode.
+    :vartype pyramid: app.pyramid.CoarseToFineDetector
+
+    :ivar trackers: Pips followed across frames, by region name. A stop condition is confirmed
+        once it is met by pips seen with the same rank on ``app.stop_confirm_frames`` frames.
+    :vartype trackers: dict[str, app.tracking.PipTracker]
+
+    :ivar confirming: Names of the regions whose stop condition is being confirmed.
+    :vartype confirming: set[str]
+
+    :ivar stops_confirmed: Number of stop conditions confirmed and signalled.
+    :vartype stops_confirmed: int
+
+    :ivar stops_lost: Number of stop conditions lost before they were confirmed.
+    :vartype stops_lost: int
     """
-    def __init__(self, app_ref):
+    def __init__(self, app_ref, capturer=None, regions=None, hub=None, out_of_process=None, preview=None,
+                 slot_rois=None, roi_store=None, detection_mode=None):
         """
         Initializes the ImageProcessor thread.
     
         :param object app_ref: Reference to the main application instance.
+        :param app.capture.CaptureBackend capturer: Frame source to use instead of the live screen,
+            e.g. an ``app.replay.ReplayCapture`` for headless runs.
+        :param list[app.regions.Region] regions: Named areas to watch instead of ``app.game_area``.
+            Their union is captured once per poll and each region is detected on a view of it.
+        :param app.hub.DetectionHub hub: Hub to publish every frame's detections to.
+        :param bool out_of_process: Run detection in a worker process reading frames from shared
+            memory. Defaults to ``OUT_OF_PROCESS_DETECTION``.
+        :param app.pipeline.PreviewTap preview: Tap to offer every analyzed frame to.
+        :param bool slot_rois: Learn the pip slots and scan only them. Defaults to ``SLOT_ROIS``.
+        :param app.roi.RoiStore roi_store: Store to reuse learned slots from and save them to.
+        :param str detection_mode: ``"exact"`` or ``"pyramid"``. Defaults to ``DETECTION_MODE``.
         :rtype: None
+        :raises ValueError: If two regions share a name or the detection mode is unknown.
         """
-        super().__init__(daemon=True) # Daemon thread exits when main program exits
+        super().__init__(daemon=True, name="ImageProcessor") # Daemon thread exits when main program exits
         self.app = app_ref # Reference to the main app instance
         self.stop_event = threading.Event() # Event to signal this thread to stop
         self.current_rank_counts = {rank: 0 for rank, _, _ in RANKS}
         self.lock = threading.Lock() # Lock for safely accessing shared data (rank counts)
-        self.screen_capturer = ScreenCapture() # Instantiate the optimized screen capturer
-
-        self.pending_stop = None  # Stores a tuple (timestamp, detected_objs) or None
+        if out_of_process is None:
+            out_of_process = OUT_OF_PROCESS_DETECTION
+        if out_of_process:
+            self.ring = SharedFrameRing() # Frames are captured straight into memory the worker can read
+            self.worker = DetectionWorker(self.ring)
+        else:
+            self.ring = FrameRing() # Latest-frame-wins buffer between capture and detection
+            self.worker = None
+        # BGRA frames are captured straight into the ring buffers and go to the classifier as is
+        self.screen_capturer = capturer or ScreenCapture(bgr=False, pool=self.ring)
+        if regions is not None and len({region.name for region in regions}) != len(regions):
+            raise ValueError("Region names must be unique")
+        self.regions = regions
+        self.region_results = {}
+        self.capture_stage = CaptureStage(
+            self.screen_capturer, self.ring,
+            self.capture_area, self.poll_delay_ms
+        )
+        self.latency = LatencyTracker()
+        self.settle = SettleMonitor(SETTLE_QUIET_MS)
+        self.poll = PollController(POLL_MAX_DELAY_MS, POLL_IDLE_DELAY_MS)
+        self.frames_processed = 0
+        self.detection_cache = DetectionCache() # Reuses detections while the pip area is static
+        self.detector = IncrementalDetector() # Reanalyzes only the tiles that changed between frames
+        self._region_detectors = {} # One incremental detector per named region
+        self.slot_rois = SLOT_ROIS if slot_rois is None else slot_rois
+        self.roi_store = roi_store
+        self._slot_caches = {} # RoiStore key of a region -> its learned slots
+        self.detection_mode = detection_mode or DETECTION_MODE
+        if self.detection_mode not in ("exact", "pyramid"):
+            raise ValueError(f"Unknown detection mode {self.detection_mode!r}")
+        self.pyramid = CoarseToFineDetector(PYRAMID_STRIDE) # Keeps no state between frames, shared by regions
 
-        self.ipc_host = None
-        self.ipc_port = None
+        self.trackers = {} # Region name -> pips followed across its frames
+        self._tracked_areas = {} # Region name -> screen area its tracker follows pips in
+        self.confirming = set() # Region names whose stop condition is being confirmed
+        self.stops_confirmed = 0
+        self.stops_lost = 0
 
-        # IPC (Inter-Process Communication) settings for slots display
-        if ENABLE_SLOTS_SOCKET:
-            ipc_host = "localhost"
-            ipc_port = SLOTS_SOCKET_PORT
-            self.ipc_host = ipc_host
-            self.ipc_port = ipc_port
-
-    @property
-    def delay_ms(self):
-        # Always get the current delay from the app
-        return self.app.stop_confirm_delay_ms
-
-    @delay_ms.setter
-    def delay_ms(self, value):
-        # Update the app’s delay value when set here
-        self.app.stop_confirm_delay_ms = value
+        self.hub = hub # Publishes detections to the slot display and other subscribers over IPC
+        self.preview = preview # Lets the preview window show our frames instead of capturing its own
 
     def run(self):
         """
-        Main loop for continuous image capturing and pip detection.
+        Main loop for continuous pip detection.
     
         This method runs in a dedicated daemon thread and performs the following:
-        - Continuously captures screenshots of the defined game area.
-        - Processes the captured images to detect and classify pips.
+        - Starts the capture stage, which captures the defined game area into ``ring``.
+        - Takes the newest captured frame, skipping older ones, and detects and classifies pips.
         - Updates shared rank counts with thread-safe locking.
         - Signals the main reroll loop to stop based on configurable stop conditions.
         - Updates the GUI asynchronously using Tkinter's `after` method.
         - Logs events if logging is enabled and conditions are met.
     
-        The loop respects a polling delay and handles exceptions gracefully
-        by logging errors and preventing tight looping on repeated failures.
+        Capture runs at the polling delay independently of detection time, so the
+        delay between a change on screen and the stop decision is one capture interval
+        plus one detection. Exceptions are handled gracefully by logging errors and
+        preventing tight looping on repeated failures.
     
         The thread will stop running when `stop_event` is set or when the stop
         conditions are satisfied and the main loop is signaled to stop.
     
         :rtype: None
         """
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+        if self.worker is not None:
+            try:
+                self.worker.start()
+            except RuntimeError as e:
+                self.app.post_gui_update("message", f"{e}, detecting in-process")
+                self.worker = None # The shared ring works like a normal one
+        self.capture_stage.start()
+        try:
+            self._detect_loop()
+        finally:
+            self.capture_stage.stop()
+            self.ring.close()
+            if self.worker is not None:
+                self.worker.stop()
+            if isinstance(self.ring, SharedFrameRing):
+                self.capture_stage.join(timeout=1.0)
+                if not self.capture_stage.is_alive():
+                    self.ring.release() # Only once nothing captures into the shared buffers anymore
 
+    def _detect_loop(self):
+        """
+        Detection and decision loop of ``run``, fed by the capture stage.
+    
+        :rtype: None
+        """
+        last_seq = -1
+        last_fingerprints = None
         while not self.stop_event.is_set():
-            if self.app.game_area is None:
-                time.sleep(0.1) # Wait if area not set by user
-                continue
-
             try:
-                # Capture screenshot using the optimized ScreenCapture class
-                frame = self.screen_capturer.capture(bbox=self.app.game_area)
-                if frame is None:
-                    # Handle capture failure (e.g., invalid area, GDI error)
-                    self.app.root.after(0, lambda: self.app.message_var.set("Screenshot capture failed. Retrying..."))
-                    time.sleep(0.1) # Short delay before retrying capture
+                captured = self.ring.latest(after_seq=last_seq, timeout=0.1)
+                if captured is None:
+                    if self.capture_stage.failing:
+                        # Handle capture failure (e.g., invalid area, GDI error)
+                        self.app.post_gui_update("message", "Screenshot capture failed. Retrying...")
                     continue
+                last_seq = captured.seq
+                self.frames_processed += 1
 
-                # Perform pip detection and classification
-                detected_objs = self.app.detect_and_classify(frame)
-
-                # Send detected ranks to slot display if IPC is enabled
-                if self.ipc_host and self.ipc_port:
-                    rank_list = [obj['rank'] for obj in detected_objs[:4]]
-                    self.send_to_slot_display(rank_list)
+                # Perform pip detection and classification per region on views of the capture,
+                # unless a region's pixels were seen recently
+                regions = self.watched_regions(captured.area)
+                settings = (self.app.tolerance, self.app.object_tolerance, tuple(self.app.exclusion_areas))
+                detect_start = time.perf_counter()
+                results = {}
+                fingerprints = []
+                for region in regions:
+                    view = region.view(captured.image, captured.area[:2])
+                    if view is None:
+                        continue # The regions changed since this frame was captured
+                    detect = functools.partial(self._detect_region, region=region)
+                    fingerprint = frame_fingerprint(view, self.detection_cache.stride)
+                    fingerprints.append(fingerprint)
+                    results[region.name] = self.detection_cache.get_or_detect(
+                        view, detect, settings=settings, fingerprint=fingerprint
+                    )
+                self.region_results = results
+                fingerprints = tuple(fingerprints)
+                detect_seconds = time.perf_counter() - detect_start
+                _DETECT_SECONDS.record(detect_seconds)
+                self.poll.observe(fingerprints != last_fingerprints, detect_seconds)
+                last_fingerprints = fingerprints
+                # Follow the pips across frames, so each one keeps its ID and counts the frames it was seen
+                tracked = {}
+                for region in regions:
+                    if region.name not in results:
+                        continue
+                    tracker = self.trackers.get(region.name)
+                    if tracker is None:
+                        tracker = self.trackers[region.name] = PipTracker()
+                    elif self._tracked_areas[region.name] != region.area:
+                        tracker.reset() # Same name, other place on screen: the positions do not carry over
+                    self._tracked_areas[region.name] = region.area
+                    tracked[region.name] = tracker.update(results[region.name])
+                if len(regions) == 1:
+                    detected_objs = tracked.get(regions[0].name, [])
+                else:
+                    detected_objs = [dict(obj, region=name) for name, objs in tracked.items() for obj in objs]
+                    detected_objs.sort(key=lambda o: -RANK_ORDER[o['rank']])
 
                 # Update shared rank counts safely for the GUI
                 with self.lock:
@@ -122,78 +330,266 @@ class ImageProcessor(threading.Thread):
                         new_counts[obj['rank']] += 1
                     self.current_rank_counts = new_counts
 
-                # Schedule GUI update on the main thread (Tkinter is not thread-safe)
-                self.app.root.after(0, lambda: self.app.update_rank_counts_gui(detected_objs))
+                # Post the GUI update for the main thread (Tkinter is not thread-safe); only the newest is drawn
+                self.app.post_gui_update("detections", detected_objs)
 
-                # Check stop conditions based on detected pips
-                min_rank_idx = RANK_ORDER[self.app.min_quality]
-                filtered_objs = [obj for obj in detected_objs if RANK_ORDER[obj['rank']] >= min_rank_idx]
-                ss_objs = [obj for obj in detected_objs if obj['rank'] == "SS"]
+                # Check stop conditions per region, on the latest pips and on those seen on enough frames
+                stop_start = time.perf_counter()
+                confirm_frames = max(1, self.app.stop_confirm_frames)
+                met = []
+                confirmed = []
+                for region in regions:
+                    if region.name not in tracked:
+                        continue
+                    if region.stop_rule is not None:
+                        rule = region.stop_rule
+                    else:
+                        rule = make_stop_rule(self.app.min_quality, self.app.min_objects, self.app.stop_at_ss)
+                    if rule(self.trackers[region.name].confirmed(confirm_frames)):
+                        confirmed.append(region)
+                    elif rule(tracked[region.name]):
+                        met.append(region)
+                decided = time.perf_counter()
+                _STOP_SECONDS.record(decided - stop_start)
+                _DECISION_SECONDS.record(decided - captured.timestamp)
+                self.latency.add(decided - captured.timestamp)
+                signalled = False
 
-                should_stop = False
-                if self.app.stop_at_ss > 0:
-                    if len(filtered_objs) >= self.app.min_objects and len(ss_objs) >= self.app.stop_at_ss:
-                        should_stop = True
-                else:
-                    if len(filtered_objs) >= self.app.min_objects:
-                        should_stop = True
-
-                # If conditions are met AND the main loop is currently running, signal it to stop
-                current_time = time.time()
-
-                # Check if a stop condition is freshly detected
-                if should_stop:
-                    # If a stop is pending, and delay has passed, re-evaluate
-                    if self.pending_stop is None:
-                        # Start pending stop timer
-                        self.pending_stop = (current_time, detected_objs)
-                        self.app.root.after(0, lambda: self.app.message_var.set(f"Detected stop condition, confirming in {self.delay_ms} ms..."))
+                # Cancel confirmations whose condition is no longer met
+                lost = self.confirming - {region.name for region in met + confirmed}
+                self.confirming -= lost
+                self.stops_lost += len(lost)
+                if lost and not self.confirming:
+                    self.app.post_gui_update("message", "Stop condition lost, continuing...")
+
+                for region in met:
+                    if region.name not in self.confirming:
+                        self.confirming.add(region.name)
+                        message = f"Detected stop condition{_where(region, regions)}, confirming over {confirm_frames} frames..."
+                        self.app.post_gui_update("message", message)
+
+                if self.confirming:
+                    self.poll.kick() # Capture the frames that confirm it at full speed
+
+                # If a condition held on enough frames AND the main loop is currently running, signal it to stop
+                for region in confirmed:
+                    self.confirming.add(region.name) # Held back until the main loop runs
+                    if not self.app.running:
+                        continue
+                    self.stops_confirmed += 1
+                    if ENABLE_LOGGING and detected_objs:
+                        self.app.log_event(
+                            detected_objs,
+                            self.current_rank_counts.copy(),
+                            self.app.logged_settings(),
+                            decision=f"StopConditionMet{_where(region, regions)}: Signalling reroll thread to suspend"
+                        )
+                    if region.stop_rule is not None:
+                        message = f"Stop rule of {region.name} met. Signalling stop."
                     else:
-                        # Check if delay passed
-                        timestamp, _ = self.pending_stop
-                        elapsed_ms = (current_time - timestamp) * 1000
-                        if elapsed_ms >= self.delay_ms:
-                            # Confirmed stop condition stable, signal stop
-                            if self.app.running:
-                                if ENABLE_LOGGING and detected_objs:
-                                    self.app.log_event(
-                                        detected_objs,
-                                        self.current_rank_counts.copy(),
-                                        {
-                                            "min_quality": self.app.min_quality,
-                                            "min_objects": self.app.min_objects,
-                                            "stop_at_ss": self.app.stop_at_ss,
-                                            "tolerance": self.app.tolerance,
-                                            "object_tolerance": self.app.object_tolerance,
-                                            "click_delay_ms": self.app.click_delay_ms,
-                                            "post_reroll_delay_ms": self.app.post_reroll_delay_ms,
-                                            "image_poll_delay_ms": self.app.image_poll_delay_ms,
-                                            "game_area": self.app.game_area,
-                                            "chisel_button_pos": self.app.chisel_button_pos,
-                                            "buy_button_pos": self.app.buy_button_pos,
-                                        },
-                                        decision="StopConditionMet: Signalling reroll thread to suspend"
-                                    )
-                                self.app.root.after(0, lambda: self.app.message_var.set(
-                                    f"Min: {self.app.min_quality} x{self.app.min_objects}" +
-                                    (f", SS: {self.app.stop_at_ss}" if self.app.stop_at_ss > 0 else "") +
-                                    " met. Signalling stop."
-                                ))
-                                self.app.stop_running_async()
-                                self.stop_event.set()
-                                break
-                else:
-                    # Condition no longer met, cancel pending stop
-                    if self.pending_stop is not None:
-                        self.pending_stop = None
-                        self.app.root.after(0, lambda: self.app.message_var.set("Stop condition lost, continuing..."))
+                        message = (f"Min: {self.app.min_quality} x{self.app.min_objects}" +
+                                   (f", SS: {self.app.stop_at_ss}" if self.app.stop_at_ss > 0 else "") +
+                                   f" met{_where(region, regions)}. Signalling stop.")
+                    self.app.post_gui_update("message", message)
+                    self.app.stop_running_async()
+                    self.stop_event.set()
+                    signalled = True
+                    break
 
-                time.sleep(self.app.image_poll_delay_ms / 1000)
+                # Let a reroll loop waiting for the area to settle continue, unless a stop is being confirmed
+                self.settle.observe(fingerprints, captured.timestamp, hold=bool(self.confirming))
+
+                # Publish detections to the slot display and other subscribers if IPC is enabled,
+                # after the decision so it never delays it; the hub only sends changes
+                if self.hub is not None:
+                    self.hub.publish(detected_objs)
+                if self.preview is not None:
+                    self.preview.offer(captured.image, detected_objs, captured.area)
+                if signalled:
+                    break
 
             except Exception as e:
-                self.app.root.after(0, lambda: self.app.message_var.set(f"ImageProc Error: {e}"))
+                self.app.post_gui_update("message", f"ImageProc Error: {e}")
                 time.sleep(0.5)
 
+    def capture_area(self):
+        """
+        Return the screen area to capture: the union of the regions, or the app's game area.
+    
+        :returns: (left, top, right, bottom), or ``None`` if nothing is selected yet.
+        :rtype: tuple[int, int, int, int] or None
+        """
+        if self.regions is not None:
+            return union_area(self.regions)
+        return self.app.game_area
+
+    def watched_regions(self, area):
+        """
+        Return the regions to detect in a frame captured from ``area``.
+    
+        :param tuple[int, int, int, int] area: Screen area of the frame.
+        :returns: The configured regions, or a single region covering ``area`` that uses
+            the app's stop settings.
+        :rtype: list[app.regions.Region]
+        """
+        if self.regions is not None:
+            return self.regions
+        return [Region("game_area", area)]
+
+    def _detector_for(self, region):
+        """
+        Return the incremental detector keeping the state of one region.
+    
+        :param app.regions.Region region: The region.
+        :rtype: app.incremental.IncrementalDetector
+        """
+        if self.regions is None:
+            return self.detector
+        detector = self._region_detectors.get(region.name)
+        if detector is None:
+            detector = self._region_detectors[region.name] = IncrementalDetector()
+        return detector
+
+    def _slot_cache_for(self, region):
+        """
+        Return the learned slots of one region, loading them from ``roi_store`` the first time.
+    
+        :param app.regions.Region region: The region.
+        :rtype: app.roi.SlotCache
+        """
+        key = RoiStore.key(region.name, region.area)
+        cache = self._slot_caches.get(key)
+        if cache is None:
+            # Slots are learned per area, so selecting another area starts from scratch
+            slots, size = self.roi_store.slots(key) if self.roi_store is not None else (None, None)
+            on_learned = None
+            if self.roi_store is not None:
+                on_learned = functools.partial(self.roi_store.set_slots, key)
+            cache = self._slot_caches[key] = SlotCache(
+                SLOT_ROI_PADDING, verify_every=SLOT_ROI_VERIFY_FRAMES, slots=slots, size=size, on_learned=on_learned
+            )
+        cache.exclusions = self._exclusions_in(region)
+        return cache
+
+    def _exclusions_in(self, region):
+        """
+        Return the app's exclusion areas relative to a region.
+    
+        :param app.regions.Region region: The region.
+        :returns: (left, top, right, bottom) boxes relative to the region's top-left corner.
+        :rtype: list[tuple[int, int, int, int]]
+        """
+        left, top = region.area[:2] # Exclusions are drawn in screen coordinates
+        return [(l - left, t - top, r - left, b - top) for l, t, r, b in self.app.exclusion_areas]
+
+    def reset_slots(self):
+        """
+        Forget the learned slots of every region, e.g. after the user reset them.
+    
+        :rtype: None
+        """
+        self._slot_caches = {}
+
+    def _detect_region(self, frame, region):
+        """
+        Detect and classify pips in the view of one region, only in its learned slots if enabled.
+    
+        :param numpy.ndarray frame: The region's pixels (BGR or BGRA).
+        :param app.regions.Region region: The region.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        full_detect = functools.partial(self._detect_full, region=region)
+        if not self.slot_rois:
+            return drop_excluded(full_detect(frame), self._exclusions_in(region))
+        slot_detect = functools.partial(self._detect_slot, region=region)
+        return self._slot_cache_for(region).detect(frame, full_detect, slot_detect, self.app.object_tolerance)
+
+    def _detect_full(self, frame, region):
+        """
+        Detect and classify pips in the whole view of one region, in the worker process if enabled.
+    
+        :param numpy.ndarray frame: The region's pixels (BGR or BGRA).
+        :param app.regions.Region region: The region.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        if self.worker is not None:
+            objs = self._detect_in_worker(frame, region.name, self.detection_mode)
+            if objs is not None:
+                return objs
+        if self.detection_mode == "pyramid":
+            return self.pyramid.detect(frame, self.app.get_classifier(), self.app.object_tolerance)
+        return self.detect(frame, self._detector_for(region))
+
+    def _detect_slot(self, crop, index, region):
+        """
+        Detect and classify pips in the crop of one learned slot, in the worker process if enabled.
+    
+        :param numpy.ndarray crop: The padded slot's pixels (BGR or BGRA).
+        :param int index: Index of the slot within the region.
+        :param app.regions.Region region: The region.
+        :returns: List of detected objects with rectangles relative to the crop.
+        :rtype: list of dict
+        """
+        if self.worker is not None:
+            objs = self._detect_in_worker(crop, f"{region.name}#slot{index}")
+            if objs is not None:
+                return objs
+        return detect_objects(self.app.get_classifier().classify(crop), self.app.object_tolerance)
+
+    def _detect_in_worker(self, frame, key, mode="exact"):
+        """
+        Detect and classify pips in the worker process, and stop using it once it fails.
+    
+        A worker that hangs, exits or keeps failing would otherwise leave every later frame
+        undecided, so the processor goes on detecting in-process instead.
+    
+        :param numpy.ndarray frame: The image frame (BGR or BGRA).
+        :param str key: Identifies the area the frame shows, see ``DetectionWorker.detect``.
+        :param str mode: ``"exact"`` or ``"pyramid"``.
+        :returns: List of detected objects, or ``None`` if the worker failed.
+        :rtype: list of dict or None
+        """
+        try:
+            return self.worker.detect(frame, self.app.tolerance, self.app.object_tolerance, key=key, mode=mode)
+        except (RuntimeError, EOFError, OSError) as e:
+            self.worker.stop()
+            self.worker = None # The shared ring works like a normal one
+            self.app.post_gui_update("message", f"{str(e) or 'Detection worker exited'}, detecting in-process")
+            return None
+
+    def get_region_results(self):
+        """
+        Retrieve the detections of the latest frame for every region.
+    
+        Rectangles are relative to the top-left corner of their region.
+    
+        :returns: Detected objects by region name.
+        :rtype: dict[str, list[dict]]
+        """
+        return dict(self.region_results)
+
+    def poll_delay_ms(self):
+        """
+        Return the delay before the next capture, called by the capture stage after every capture.
+    
+        :returns: The delay in milliseconds.
+        :rtype: float
+        """
+        if not ADAPTIVE_POLLING:
+            return self.app.image_poll_delay_ms
+        return self.poll.delay_ms(self.app.image_poll_delay_ms, self.capture_stage.capture_seconds, self.app.running)
+
+    def kick_polling(self):
+        """
+        Poll at full speed again and capture right away, e.g. after a click.
+    
+        :rtype: None
+        """
+        self.poll.kick()
+        self.capture_stage.wake()
+
     def get_current_rank_counts(self):
         """
         Retrieve a thread-safe copy of the latest detected rank counts.
@@ -207,47 +603,131 @@ class ImageProcessor(threading.Thread):
         with self.lock:
             return self.current_rank_counts.copy()
 
-    def stop(self):
+    def detect(self, frame, detector=None):
         """
-        Signals the image processing thread to stop and releases resources.
+        Detect and classify pips in a frame, reanalyzing only the tiles that changed.
     
-        This method sets the internal stop event, which causes the thread's
-        main loop to exit gracefully. It also closes the screen capturer,
-        cleaning up any allocated GDI resources.
+        Produces the same objects as ``PipRerollerApp.detect_and_classify``.
     
-        :rtype: None
+        :param numpy.ndarray frame: The image frame (BGR or BGRA).
+        :param app.incremental.IncrementalDetector detector: Detector holding the state of the
+            frame's previous version, ``self.detector`` by default.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
         """
-        self.stop_event.set()
-        self.screen_capturer.close() # Close the screen capturer resources
+        detector = detector or self.detector
+        return detector.detect(frame, self.app.get_classifier(), self.app.object_tolerance)
 
-    def send_to_slot_display(self, ranks):
+    def get_latency_stats(self):
         """
-        Send the current detected ranks to the slot machine display application via IPC socket.
+        Retrieve the frame-to-decision latency and the capture ring counters.
     
-        This method attempts to establish a TCP connection to the configured IPC host and port,
-        then serializes the provided list of rank strings as JSON and sends it over the socket.
+        :returns: The ``LatencyTracker.stats`` dict, plus the ring's ``produced``,
+            ``consumed``, ``dropped`` and ``pending`` frame counts under ``frames``.
+        :rtype: dict
+        """
+        stats = self.latency.stats()
+        stats["frames"] = self.ring.stats()
+        return stats
+
+    def get_poll_stats(self):
+        """
+        Retrieve the recent capture rate and how many captures adaptive polling saved.
     
-        If IPC host or port are not set (None or falsy), the method returns immediately without sending.
+        :returns: The ``PollController.stats`` dict.
+        :rtype: dict
+        """
+        return self.poll.stats()
+
+    def get_settle_stats(self):
+        """
+        Retrieve how the reroll loop's waits for the area to settle ended.
     
-        Handles `ConnectionRefusedError` silently, which typically means the slot machine
-        display is not running or not listening, so no error is raised in that case.
+        :returns: The ``SettleMonitor.stats`` dict.
+        :rtype: dict
+        """
+        return self.settle.stats()
+
+    def get_stop_stats(self):
+        """
+        Retrieve how the stop conditions detected were confirmed or lost.
     
-        Any other exceptions during socket connection or send are caught and logged to the console.
+        :returns: A dict with ``confirm_frames``, ``confirmed``, ``lost`` and ``confirming``.
+        :rtype: dict
+        """
+        return {
+            "confirm_frames": self.app.stop_confirm_frames,
+            "confirmed": self.stops_confirmed,
+            "lost": self.stops_lost,
+            "confirming": len(self.confirming),
+        }
+
+    def get_tile_stats(self):
+        """
+        Retrieve how much of the captured area had to be reanalyzed.
     
-        :param ranks: List of rank strings to send to the slot display.
-        :type ranks: list[str]
-        :rtype: None
+        :returns: A dict with ``tiles_total``, ``tiles_dirty`` and ``dirty_ratio``, summed over regions.
+            The counters stay at 0 while the worker process detects.
+        :rtype: dict
         """
-        import socket
-        import json
-        if not self.ipc_host or not self.ipc_port:
-            return  # IPC is disabled
+        detectors = list(self._region_detectors.values()) if self.regions is not None else [self.detector]
+        total = sum(detector.tiles_total for detector in detectors)
+        dirty = sum(detector.tiles_dirty for detector in detectors)
+        return {"tiles_total": total, "tiles_dirty": dirty, "dirty_ratio": dirty / total if total else 0.0}
+
+    def get_roi_stats(self):
+        """
+        Retrieve how often detection could scan only the learned pip slots.
     
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((self.ipc_host, self.ipc_port))
-                s.sendall(json.dumps(ranks).encode('utf-8'))
-        except ConnectionRefusedError:
-            pass  # Slot machine not running
-        except Exception as e:
-            print(f"IPC send error: {e}")
+        :returns: The ``SlotCache.stats`` counters summed over regions, with ``hit_rate``
+            and ``enabled``.
+        :rtype: dict
+        """
+        stats = {"slots": 0, "hits": 0, "misses": 0, "learning": 0, "relearns": 0}
+        for cache in list(self._slot_caches.values()):
+            for name, value in cache.stats().items():
+                if name in stats:
+                    stats[name] += value
+        total = stats["hits"] + stats["misses"] + stats["learning"]
+        stats["hit_rate"] = stats["hits"] / total if total else 0.0
+        stats["enabled"] = self.slot_rois
+        return stats
+
+    def get_pyramid_stats(self):
+        """
+        Retrieve how much of the frames the pyramid mode classified at full resolution.
+    
+        :returns: The ``CoarseToFineDetector.stats`` dict, with ``mode``. The counters stay at 0
+            in the exact mode and while the worker process detects.
+        :rtype: dict
+        """
+        stats = self.pyramid.stats()
+        stats["mode"] = self.detection_mode
+        return stats
+
+    def get_cache_stats(self):
+        """
+        Retrieve the detection cache hit and miss counters.
+    
+        :returns: A dict with ``hits``, ``misses``, ``size`` and ``hit_rate``.
+        :rtype: dict
+        """
+        return self.detection_cache.stats()
+
+    def stop(self):
+        """
+        Signals the image processing thread to stop and releases resources.
+    
+        This method sets the internal stop event, which causes the thread's
+        main loop to exit gracefully. It also stops the capture stage, which
+        closes the screen capturer and cleans up any allocated GDI resources.
+    
+        :rtype: None
+        """
+        self.stop_event.set()
+        self.ring.close() # Wake up the detection loop if it is waiting for a frame
+        self.settle.close() # Wake up the reroll loop if it is waiting for the area to settle
+        if self.capture_stage.is_alive():
+            self.capture_stage.stop() # Closes the screen capturer once its current capture completes
+        else:
+            self.screen_capturer.close() # Close the screen capturer resources
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+profiling.py
+"""
+import collections
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from app.config import PROFILE_DIR, PROFILE_INTERVAL_MS
+
+class Profiler:
+    """
+    Samples where every thread spends its time, and how the memory use grows, on demand.
+
+    While a session runs, a background thread records the stack of every other thread each
+    ``interval`` seconds. Samples are wall-clock time, so a thread waiting for a lock, a sleep
+    or an AHK click shows up where it waits. When the session stops, the stacks are written
+    to ``<stamp>_threads.folded`` (one ``thread;outer;...;inner count`` line per stack, opened by
+    speedscope or flamegraph.pl) and the busiest functions per thread to ``<stamp>_threads.txt``.
+
+    Memory is compared between the start and the end of the session with ``tracemalloc``: the
+    lines that grew the most go to ``<stamp>_memory.txt`` and the final snapshot to
+    ``<stamp>_memory.tracemalloc`` (load it with ``tracemalloc.Snapshot.load``).
+
+    Unlike ``cProfile``, sampling needs no cooperation from the profiled threads and works on
+    Python 3.12+, where only one ``cProfile`` profiler can be active per process.
+
+    :ivar directory: Folder the results are written to.
+    :vartype directory: str
+
+    :ivar interval: Time between samples in seconds.
+    :vartype interval: float
+
+    :ivar memory_frames: Number of stack frames stored per allocation.
+    :vartype memory_frames: int
+
+    :ivar files: Every file written so far.
+    :vartype files: list[str]
+    """
+    def __init__(self, directory="profiles", interval=0.01, memory_frames=10):
+        """
+        :param str directory: Folder the results are written to.
+        :param float interval: Time between samples in seconds.
+        :param int memory_frames: Number of stack frames stored per allocation.
+        :rtype: None
+        """
+        self.directory = directory
+        self.interval = interval
+        self.memory_frames = memory_frames
+        self.files = []
+        self._session = None # (stamp, stop event, sampler thread, stack counts, tracemalloc start snapshot)
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        """
+        Whether a session is running.
+
+        :rtype: bool
+        """
+        return self._session is not None
+
+    def start(self):
+        """
+        Starts a session, unless one is running.
+
+        :rtype: None
+        """
+        with self._lock:
+            if self._session is not None:
+                return
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start(self.memory_frames)
+            stacks = collections.Counter()
+            stopped = threading.Event()
+            sampler = threading.Thread(target=self._sample, args=(stacks, stopped), daemon=True, name="Profiler")
+            self._session = (time.strftime("%Y%m%d-%H%M%S"), stopped, sampler, stacks, tracemalloc.take_snapshot())
+            sampler.start()
+
+    def stop(self):
+        """
+        Ends the session and writes its results.
+
+        :returns: The files written.
+        :rtype: list[str]
+        """
+        with self._lock:
+            session, self._session = self._session, None
+            if session is None:
+                return []
+            stamp, stopped, sampler, stacks, memory_start = session
+            stopped.set()
+            sampler.join()
+            snapshot = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+        try:
+            files = self._write_threads(stamp, stacks) + self._write_memory(stamp, memory_start, snapshot)
+        except OSError as e:
+            print(f"[ERROR] Could not write the profile: {e}")
+            return []
+        with self._lock:
+            self.files.extend(files)
+        return files
+
+    def toggle(self):
+        """
+        Starts a session, or stops the running one.
+
+        :returns: The files written, empty if a session was started.
+        :rtype: list[str]
+        """
+        if self.active:
+            return self.stop()
+        self.start()
+        return []
+
+    def _sample(self, stacks, stopped):
+        """
+        Sampler thread: counts the stacks of all other threads until ``stopped`` is set.
+
+        :param collections.Counter stacks: (thread name, code objects from the outermost) -> samples.
+        :param threading.Event stopped: Ends the sampling.
+        :rtype: None
+        """
+        own = threading.get_ident()
+        while not stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                stacks[(names.get(ident, str(ident)), tuple(codes))] += 1
+
+    def _path(self, stamp, suffix):
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.join(self.directory, f"{stamp}_{suffix}")
+
+    def _write_threads(self, stamp, stacks, limit=25):
+        """
+        Writes the sampled stacks in the folded format and the busiest functions per thread.
+
+        :param str stamp: Prefix of the session's files.
+        :param collections.Counter stacks: Samples per (thread name, stack).
+        :param int limit: Number of functions listed per thread.
+        :returns: The files written.
+        :rtype: list[str]
+        """
+        def describe(code):
+            return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+        folded_path = self._path(stamp, "threads.folded")
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for (thread, codes), count in stacks.most_common():
+                f.write(";".join([thread.replace(";", ":")] + [describe(code) for code in codes]) + f" {count}\n")
+
+        totals = collections.Counter()
+        inclusive = collections.defaultdict(collections.Counter) # thread -> code -> samples with the code on the stack
+        own = collections.defaultdict(collections.Counter) # thread -> code -> samples with the code innermost
+        for (thread, codes), count in stacks.items():
+            totals[thread] += count
+            for code in set(codes):
+                inclusive[thread][code] += count
+            if codes:
+                own[thread][codes[-1]] += count
+
+        text_path = self._path(stamp, "threads.txt")
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write(f"Wall-clock samples every {self.interval * 1000:g} ms, busiest functions per thread\n")
+            for thread, total in totals.most_common():
+                f.write(f"\n{thread}: {total} samples\n")
+                f.write(f"  {'total':>6} {'self':>6}  function\n")
+                for code, count in inclusive[thread].most_common(limit):
+                    f.write(f"  {count / total:>6.1%} {own[thread][code] / total:>6.1%}  {describe(code)}\n")
+        return [folded_path, text_path]
+
+    def _write_memory(self, stamp, start, snapshot, limit=50):
+        """
+        Writes the allocations that grew the most during the session and the final snapshot.
+
+        :param str stamp: Prefix of the session's files.
+        :param tracemalloc.Snapshot start: Snapshot taken when the session started.
+        :param tracemalloc.Snapshot snapshot: Snapshot taken when the session stopped.
+        :param int limit: Number of source lines listed.
+        :returns: The files written.
+        :rtype: list[str]
+        """
+        ignore = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__),
+                  tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"))
+        start, snapshot = start.filter_traces(ignore), snapshot.filter_traces(ignore)
+        diff = snapshot.compare_to(start, "lineno")
+        text_path = self._path(stamp, "memory.txt")
+        with open(text_path, "w", encoding="utf-8") as f:
+            f.write(f"Memory growth by source line ({sum(stat.size_diff for stat in diff) / 1024:+.1f} KiB in total)\n")
+            for stat in diff[:limit]:
+                f.write(f"{stat}\n")
+            # Where the biggest growth came from, with the full stack
+            for stat in snapshot.compare_to(start, "traceback")[:5]:
+                f.write(f"\n{stat.size_diff / 1024:+.1f} KiB in {stat.count_diff:+d} blocks allocated at:\n")
+                f.writelines(f"    {line}\n" for line in stat.traceback.format())
+        snapshot_path = self._path(stamp, "memory.tracemalloc")
+        snapshot.dump(snapshot_path)
+        return [text_path, snapshot_path]
+
+# Profiler of the whole process, toggled from the GUI
+PROFILER = Profiler(PROFILE_DIR, interval=PROFILE_INTERVAL_MS / 1000)
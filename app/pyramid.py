@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+pyramid.py
+"""
+import time
+
+import cv2
+import numpy as np
+
+from app.constants import RANK_ORDER
+from app.detection import HALO, detect_objects
+from app.metrics import stage
+from app.roi import merge_boxes, near_edge
+
+_COARSE_SECONDS = stage("coarse")
+_REFINE_SECONDS = stage("refine")
+
+class CoarseToFineDetector:
+    """
+    Pip detector that classifies every ``stride``-th pixel first and only the areas around
+    the pixels that matched a rank at full resolution.
+
+    Pips are large flat-colored blobs, so sampling one pixel in ``stride * stride`` still
+    hits every pip. Each group of matching samples gives a window, padded by the stride,
+    the object tolerance and the closing halo, in which the exact detector runs on the
+    full-resolution pixels. A window is grown until no object lies within the object
+    tolerance and closing halo of its border, so the objects found are exactly those of a
+    full detection, as long as every blob is hit by a sample: blobs narrower or lower than
+    ``stride`` pixels (single-pixel noise, thin lines) are only found when they lie next to
+    a larger one.
+
+    :ivar stride: Sampling step in pixels on both axes.
+    :vartype stride: int
+
+    :ivar max_grow: Times a window is grown before the whole frame is detected instead.
+    :vartype max_grow: int
+
+    :ivar full_ratio: Fraction of the frame covered by windows above which the whole frame
+        is detected instead, e.g. on noisy frames.
+    :vartype full_ratio: float
+
+    :ivar pixels_total: Number of frame pixels seen since creation.
+    :vartype pixels_total: int
+
+    :ivar pixels_refined: Number of those pixels classified at full resolution.
+    :vartype pixels_refined: int
+    """
+    def __init__(self, stride=4, max_grow=3, full_ratio=0.5):
+        """
+        :param int stride: Sampling step in pixels on both axes, 1 for a plain full detection.
+        :param int max_grow: Times a window is grown before the whole frame is detected instead.
+        :param float full_ratio: Fraction of the frame covered by windows above which the
+            whole frame is detected instead.
+        :rtype: None
+        """
+        self.stride = max(1, stride)
+        self.max_grow = max_grow
+        self.full_ratio = full_ratio
+        self.pixels_total = 0
+        self.pixels_refined = 0
+
+    def detect(self, frame, classifier, object_tolerance):
+        """
+        Detects and classifies pip objects, at full resolution only around candidate pixels.
+
+        :param numpy.ndarray frame: The image frame (BGR or BGRA).
+        :param app.classifier.RankClassifier classifier: Classifier for the current tolerance.
+        :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        height, width = frame.shape[:2]
+        self.pixels_total += height * width
+        stride = self.stride
+        start = time.perf_counter()
+        coarse = classifier.classify(frame[::stride, ::stride])
+        count, _, stats, _ = cv2.connectedComponentsWithStats((coarse != 0).view(np.uint8), connectivity=8)
+        _COARSE_SECONDS.record(time.perf_counter() - start)
+        if count <= 1:
+            return []
+
+        start = time.perf_counter()
+        margin = object_tolerance + HALO # Objects closer than this to a window border may be cut or miss a fragment
+        pad = stride + margin + 1
+        windows = merge_boxes([_clip((x * stride, y * stride, (x + w) * stride, (y + h) * stride), pad, width, height)
+                               for x, y, w, h, _ in stats[1:count].tolist()], gap=object_tolerance)
+        for _ in range(self.max_grow + 1):
+            if sum((r - l) * (b - t) for l, t, r, b in windows) > self.full_ratio * width * height:
+                break # Refining would cost about as much as a full detection
+            detected = []
+            grown = []
+            for window in windows:
+                objs = self._detect_window(frame, window, classifier, object_tolerance)
+                if any(near_edge(obj['rect'], window, width, height, margin) for obj in objs):
+                    grown.append(_clip(window, pad, width, height))
+                else:
+                    detected.extend(objs)
+                    grown.append(window)
+            if grown == windows:
+                detected.sort(key=lambda o: -RANK_ORDER[o['rank']]) # Highest rank first, like a full detection
+                _REFINE_SECONDS.record(time.perf_counter() - start)
+                return detected
+            # Grown windows may now reach other ones, so every window is detected again
+            windows = merge_boxes(grown, gap=object_tolerance)
+
+        # Windows cover most of the frame, or fragments chain across it: detect it whole
+        self.pixels_refined += height * width
+        detected = detect_objects(classifier.classify(frame), object_tolerance)
+        _REFINE_SECONDS.record(time.perf_counter() - start)
+        return detected
+
+    def _detect_window(self, frame, window, classifier, object_tolerance):
+        """
+        Runs the exact detector on one window.
+
+        :returns: The objects with rectangles in frame coordinates.
+        :rtype: list of dict
+        """
+        left, top, right, bottom = window
+        self.pixels_refined += (right - left) * (bottom - top)
+        objs = detect_objects(classifier.classify(frame[top:bottom, left:right]), object_tolerance)
+        for obj in objs:
+            x, y, w, h = obj['rect']
+            obj['rect'] = (x + left, y + top, w, h)
+        return objs
+
+    def stats(self):
+        """
+        Returns how much of the frames had to be classified at full resolution.
+
+        :returns: A dict with ``pixels_total``, ``pixels_refined`` and ``refined_ratio``.
+        :rtype: dict
+        """
+        return {
+            "pixels_total": self.pixels_total,
+            "pixels_refined": self.pixels_refined,
+            "refined_ratio": self.pixels_refined / self.pixels_total if self.pixels_total else 0.0,
+        }
+
+def _clip(window, pad, width, height):
+    left, top, right, bottom = window
+    return max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)
+
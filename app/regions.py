@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+regions.py
+"""
+
+class Region:
+    """
+    A named screen area watched by the image processor, with optional stop rules of its own.
+
+    All regions of a processor are captured together in a single capture of their union,
+    and each region is detected on a view of that capture, without copying pixels.
+
+    :ivar name: Label used in messages and results.
+    :vartype name: str
+
+    :ivar area: (left, top, right, bottom) in screen coordinates.
+    :vartype area: tuple[int, int, int, int]
+
+    :ivar stop_rule: Called as ``stop_rule(detected_objs)`` to decide whether this region
+        should stop the reroll loop, or ``None`` to use the app's stop settings.
+    :vartype stop_rule: callable or None
+    """
+    def __init__(self, name, area, stop_rule=None):
+        """
+        :param str name: Label used in messages and results.
+        :param tuple[int, int, int, int] area: (left, top, right, bottom) in screen coordinates.
+        :param callable stop_rule: Optional stop predicate, see ``app.processor.make_stop_rule``.
+        :raises ValueError: If the area is empty.
+        :rtype: None
+        """
+        left, top, right, bottom = area
+        if right <= left or bottom <= top:
+            raise ValueError(f"Region {name!r} has an empty area: {area}")
+        self.name = name
+        self.area = tuple(area)
+        self.stop_rule = stop_rule
+
+    def view(self, frame, origin):
+        """
+        Returns the part of a capture covering this region, as a view of the capture.
+
+        :param numpy.ndarray frame: A capture whose top-left pixel is at ``origin``.
+        :param tuple[int, int] origin: Screen coordinates of the capture's top-left pixel.
+        :returns: The region's pixels, or ``None`` if the capture does not fully cover the region.
+        :rtype: numpy.ndarray or None
+        """
+        left, top, right, bottom = self.area
+        x0, y0 = left - origin[0], top - origin[1]
+        x1, y1 = right - origin[0], bottom - origin[1]
+        height, width = frame.shape[:2]
+        if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+            return None
+        return frame[y0:y1, x0:x1]
+
+def union_area(regions):
+    """
+    Computes the smallest area covering every region.
+
+    :param list[Region] regions: The regions.
+    :returns: (left, top, right, bottom) in screen coordinates, or ``None`` without regions.
+    :rtype: tuple[int, int, int, int] or None
+    """
+    if not regions:
+        return None
+    return (min(r.area[0] for r in regions), min(r.area[1] for r in regions),
+            max(r.area[2] for r in regions), max(r.area[3] for r in regions))
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+replay.py
+"""
+import glob
+import os
+import threading
+import time
+
+import cv2
+
+from app.capture import CaptureBackend
+
+PACING_MODES = ("realtime", "fast", "fixed")
+
+class ReplayCapture(CaptureBackend):
+    """
+    Capture backend that plays back a recorded session instead of grabbing the screen.
+
+    Sources can be a directory of PNG frames, a glob pattern, or any video file OpenCV can
+    decode. Frames are assumed to show the screen starting at ``origin``, so the usual
+    ``capture(bbox=...)`` calls with screen coordinates return the matching crop.
+
+    Pacing controls when the next recorded frame becomes current:
+
+    - ``"realtime"``: at the recording's own rate (the video FPS, or ``fps`` for images).
+    - ``"fast"``: every ``capture`` call advances one frame, as fast as the caller polls.
+    - ``"fixed"``: at ``fps`` frames per second, regardless of the source rate.
+
+    In the timed modes, calls made before the next frame is due return the current frame
+    again, like polling a static screen.
+
+    :ivar source: Path, directory or glob pattern of the recording.
+    :vartype source: str
+
+    :ivar pacing: One of ``PACING_MODES``.
+    :vartype pacing: str
+
+    :ivar fps: Playback rate for ``"fixed"`` pacing and for image sequences in ``"realtime"``.
+    :vartype fps: float
+
+    :ivar origin: Screen coordinates (left, top) of the recording's top-left pixel.
+    :vartype origin: tuple[int, int]
+
+    :ivar loop: Whether playback restarts after the last frame.
+    :vartype loop: bool
+
+    :ivar size: Width and height of the recorded frames.
+    :vartype size: tuple[int, int]
+
+    :ivar frames_read: Number of recorded frames decoded so far.
+    :vartype frames_read: int
+
+    :ivar exhausted: Set once the last frame has been played and ``loop`` is False.
+    :vartype exhausted: threading.Event
+    """
+    def __init__(self, source, pacing="realtime", fps=30.0, origin=(0, 0), loop=False):
+        """
+        Opens a recording for playback.
+
+        :param str source: Directory of PNG frames, glob pattern, or video file.
+        :param str pacing: One of ``PACING_MODES``.
+        :param float fps: Frames per second for ``"fixed"`` pacing and image sequences.
+        :param tuple[int, int] origin: Screen coordinates of the recording's top-left pixel.
+        :param bool loop: Restart from the first frame after the last one.
+        :raises ValueError: If ``pacing`` is unknown or the source contains no frames.
+        :rtype: None
+        """
+        if pacing not in PACING_MODES:
+            raise ValueError(f"Unknown pacing {pacing!r}, expected one of {PACING_MODES}")
+        self.source = source
+        self.pacing = pacing
+        self.fps = fps
+        self.origin = origin
+        self.loop = loop
+        self.frames_read = 0
+        self.exhausted = threading.Event()
+
+        self._files = None
+        self._video = None
+        if os.path.isdir(source):
+            self._files = sorted(glob.glob(os.path.join(source, "*.png")))
+        elif any(c in source for c in "*?["):
+            self._files = sorted(glob.glob(source))
+        else:
+            self._video = cv2.VideoCapture(source)
+            if not self._video.isOpened():
+                raise ValueError(f"Could not open recording: {source}")
+            source_fps = self._video.get(cv2.CAP_PROP_FPS)
+            if pacing == "realtime" and source_fps > 0:
+                self.fps = source_fps
+            self.size = (int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                         int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        if self._files is not None:
+            if not self._files:
+                raise ValueError(f"No frames found in: {source}")
+            first = cv2.imread(self._files[0], cv2.IMREAD_COLOR)
+            if first is None:
+                raise ValueError(f"Could not read frame: {self._files[0]}")
+            self.size = (first.shape[1], first.shape[0])
+
+        self._index = 0
+        self._frame = None
+        self._next_due = 0.0
+        self._lock = threading.Lock()
+
+    def _read_next(self):
+        """
+        Decodes the next recorded frame, restarting or stopping at the end.
+
+        :returns: The next BGR frame, or ``None`` when playback is over.
+        :rtype: numpy.ndarray or None
+        """
+        for _ in range(2): # Second attempt after rewinding when looping
+            if self._files is not None:
+                if self._index < len(self._files):
+                    frame = cv2.imread(self._files[self._index], cv2.IMREAD_COLOR)
+                    self._index += 1
+                    self.frames_read += 1
+                    return frame
+            else:
+                ok, frame = self._video.read()
+                if ok:
+                    self._index += 1
+                    self.frames_read += 1
+                    return frame
+            if not self.loop:
+                break
+            self._index = 0
+            if self._video is not None:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        self.exhausted.set()
+        return None
+
+    def _current_frame(self):
+        """
+        Advances playback according to the pacing mode and returns the current frame.
+
+        :returns: The current BGR frame, or ``None`` when playback is over.
+        :rtype: numpy.ndarray or None
+        """
+        if self.exhausted.is_set():
+            return None
+        now = time.perf_counter()
+        if self.pacing == "fast" or self._frame is None:
+            self._frame = self._read_next()
+            self._next_due = now + 1 / self.fps
+            return self._frame
+
+        # Timed modes: step to the frame that is due now, dropping any we fell behind on
+        while now >= self._next_due:
+            frame = self._read_next()
+            if frame is None:
+                return None
+            self._frame = frame
+            self._next_due += 1 / self.fps
+        return self._frame
+
+    def capture(self, bbox=None):
+        """
+        Returns the part of the current recorded frame under ``bbox``.
+
+        :param tuple[int, int, int, int] bbox: The region to capture in screen coordinates
+            (left, top, right, bottom).
+        :returns: The cropped BGR frame, or ``None`` if ``bbox`` is missing, empty or outside
+            the recording, or if playback is over.
+        :rtype: numpy.ndarray or None
+        """
+        if not bbox: return None
+        left, top, right, bottom = bbox
+        if right - left <= 0 or bottom - top <= 0: return None
+
+        with self._lock:
+            frame = self._current_frame()
+        if frame is None:
+            return None
+
+        x0, y0 = left - self.origin[0], top - self.origin[1]
+        x1, y1 = right - self.origin[0], bottom - self.origin[1]
+        height, width = frame.shape[:2]
+        if x0 < 0 or y0 < 0 or x1 > width or y1 > height:
+            return None
+        return frame[y0:y1, x0:x1]
+
+    def close(self):
+        """
+        Releases the video decoder, if any.
+
+        :rtype: None
+        """
+        if self._video is not None:
+            self._video.release()
+            self._video = None
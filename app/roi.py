@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+roi.py
+"""
+import json
+import os
+import threading
+
+from app.constants import RANK_ORDER
+
+def _inside(rect, box):
+    """
+    :param tuple rect: (x, y, w, h) rectangle.
+    :param tuple box: (left, top, right, bottom) box.
+    :returns: True if the rectangle lies entirely within the box.
+    :rtype: bool
+    """
+    x, y, w, h = rect
+    return box[0] <= x and box[1] <= y and x + w <= box[2] and y + h <= box[3]
+
+def near_edge(rect, box, width, height, margin):
+    """
+    Whether a rectangle comes within ``margin`` pixels of a side of a box that is not a frame edge.
+
+    Detecting only inside the box may cut such an object, or miss a fragment outside the box
+    that a full detection would merge with it.
+
+    :param tuple rect: (x, y, w, h) rectangle in frame coordinates.
+    :param tuple box: (left, top, right, bottom) box in frame coordinates.
+    :param int width: Frame width in pixels.
+    :param int height: Frame height in pixels.
+    :param int margin: Distance in pixels, e.g. the object tolerance plus the closing halo.
+    :rtype: bool
+    """
+    x, y, w, h = rect
+    left, top, right, bottom = box
+    return ((left > 0 and x - left <= margin) or (top > 0 and y - top <= margin) or
+            (right < width and right - x - w <= margin) or (bottom < height and bottom - y - h <= margin))
+
+def _center_in(rect, box):
+    x, y, w, h = rect
+    cx, cy = x + w / 2, y + h / 2
+    return box[0] <= cx < box[2] and box[1] <= cy < box[3]
+
+def drop_excluded(detected, exclusions):
+    """
+    Removes the objects centered in an exclusion box.
+
+    :param list[dict] detected: Detected objects with 'rect' keys.
+    :param list[tuple] exclusions: (left, top, right, bottom) boxes in the same coordinates.
+    :returns: The remaining objects, or ``detected`` itself without exclusions.
+    :rtype: list[dict]
+    """
+    if not exclusions:
+        return detected
+    return [obj for obj in detected if not any(_center_in(obj['rect'], box) for box in exclusions)]
+
+def merge_boxes(boxes, gap=0):
+    """
+    Merges boxes that overlap or are at most ``gap`` pixels apart, until none are.
+
+    :param list[tuple] boxes: (left, top, right, bottom) boxes.
+    :param int gap: Distance in pixels below which two boxes are merged.
+    :returns: Disjoint boxes covering the input ones.
+    :rtype: list[tuple[int, int, int, int]]
+    """
+    boxes = [tuple(box) for box in boxes]
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in boxes:
+            for k, other in enumerate(result):
+                if (box[0] <= other[2] + gap and other[0] <= box[2] + gap and
+                        box[1] <= other[3] + gap and other[1] <= box[3] + gap):
+                    result[k] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+class SlotCache:
+    """
+    Learns where the pip slots are in an area and detects only around them afterwards.
+
+    Pips always appear at the same few positions, so once the same set of pip positions was
+    detected in ``learn_frames`` consecutive frames, their boxes become the learned slots.
+    From then on each frame is classified only inside the slots padded by ``padding`` (and at
+    least by the object tolerance plus the closing halo, so a blob merged with a pip in a full
+    scan is merged in the slot too), which gives the same objects as a full scan.
+    Objects within that distance of a slot's border need a full scan.
+
+    A full scan is run instead, and the slots are learned again if it finds pips outside
+    them, when:
+
+    - no pip was found in the slots, e.g. because the layout moved away,
+    - a pip comes close to the edge of its slot, i.e. it moved or grew past the padding,
+    - the frame size changed, e.g. because the window was resized,
+    - every ``verify_every`` frames, to notice new slots.
+
+    Objects centered in an exclusion box are dropped from every result and never learned.
+
+    :ivar slots: Learned pip boxes (left, top, right, bottom) without padding, or ``None``
+        while learning.
+    :vartype slots: list[tuple[int, int, int, int]] or None
+
+    :ivar size: (width, height) of the frames the slots were learned on.
+    :vartype size: tuple[int, int] or None
+
+    :ivar exclusions: Boxes (left, top, right, bottom) in frame coordinates whose pips are ignored.
+    :vartype exclusions: list[tuple[int, int, int, int]]
+
+    :ivar hits: Frames answered from the slots alone.
+    :vartype hits: int
+
+    :ivar misses: Frames that needed a full scan although slots were learned.
+    :vartype misses: int
+
+    :ivar learning: Frames scanned fully while learning.
+    :vartype learning: int
+
+    :ivar relearns: Number of times learned slots were dropped because the layout changed.
+    :vartype relearns: int
+    """
+    def __init__(self, padding=12, learn_frames=3, verify_every=60, slots=None, size=None, on_learned=None):
+        """
+        :param int padding: Pixels added around every slot.
+        :param int learn_frames: Consecutive frames with the same pip positions needed to learn them.
+        :param int verify_every: Frames between full scans checking for new slots, 0 to never check.
+        :param list slots: Previously learned slots, e.g. from a ``RoiStore``.
+        :param tuple[int, int] size: Frame size the given slots were learned on.
+        :param callable on_learned: Called as ``on_learned(slots, size)`` whenever slots are learned.
+        :rtype: None
+        """
+        from app.detection import HALO # Keeps this module free of cv2 for the GUI's startup
+        self.padding = padding
+        self.halo = HALO
+        self.learn_frames = learn_frames
+        self.verify_every = verify_every
+        self.on_learned = on_learned
+        self.slots = [tuple(slot) for slot in slots] if slots else None
+        self.size = tuple(size) if slots and size else None
+        self.exclusions = []
+        self.hits = 0
+        self.misses = 0
+        self.learning = 0
+        self.relearns = 0
+        self._candidate = None # Slots seen in the last consecutive frames
+        self._agreeing = 0 # Number of those frames
+        self._since_verify = 0
+
+    def detect(self, frame, full_detect, slot_detect, object_tolerance):
+        """
+        Detects the pips of a frame, in the learned slots if possible.
+
+        :param numpy.ndarray frame: The image frame.
+        :param callable full_detect: Called as ``full_detect(frame)`` for a full scan.
+        :param callable slot_detect: Called as ``slot_detect(crop, index)`` to detect in the
+            crop of padded slot ``index``; rectangles are relative to the crop.
+        :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        """
+        height, width = frame.shape[:2]
+        if self.slots is not None and self.size != (width, height):
+            self._forget()
+        if self.slots is None:
+            self.learning += 1
+            detected = self._filter(full_detect(frame))
+            self._learn(detected, (width, height))
+            return detected
+
+        self._since_verify += 1
+        if not (self.verify_every and self._since_verify >= self.verify_every):
+            detected = self._detect_slots(frame, slot_detect, object_tolerance)
+            if detected:
+                self.hits += 1
+                return detected
+
+        # Nothing in the slots, a pip at a slot edge, or time to check for new slots
+        self.misses += 1
+        self._since_verify = 0
+        detected = self._filter(full_detect(frame))
+        slots = self.padded(width, height)
+        if not all(any(_inside(obj['rect'], slot) for slot in slots) for obj in detected):
+            self._forget()
+            self._learn(detected, (width, height))
+        return detected
+
+    def _detect_slots(self, frame, slot_detect, object_tolerance):
+        """
+        Detects in the padded slots only.
+
+        :returns: The detected objects in frame coordinates, or ``None`` if an object is near the
+            edge of its slot and a full scan is needed.
+        :rtype: list of dict or None
+        """
+        height, width = frame.shape[:2]
+        margin = object_tolerance + self.halo
+        detected = []
+        for index, box in enumerate(self.padded(width, height, max(self.padding, margin + 1))):
+            left, top, right, bottom = box
+            for obj in slot_detect(frame[top:bottom, left:right], index):
+                x, y, w, h = obj['rect']
+                obj = dict(obj, rect=(x + left, y + top, w, h))
+                if near_edge(obj['rect'], box, width, height, margin):
+                    return None
+                detected.append(obj)
+        detected = self._filter(detected)
+        detected.sort(key=lambda o: -RANK_ORDER[o['rank']]) # Highest rank first, like a full scan
+        return detected
+
+    def padded(self, width, height, pad=None):
+        """
+        Returns the learned slots padded and clipped to the frame, overlapping ones merged.
+
+        :param int width: Frame width in pixels.
+        :param int height: Frame height in pixels.
+        :param int pad: Padding in pixels, ``padding`` by default.
+        :rtype: list[tuple[int, int, int, int]]
+        """
+        pad = self.padding if pad is None else pad
+        boxes = [(max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad))
+                 for left, top, right, bottom in self.slots or ()]
+        return merge_boxes(boxes)
+
+    def _filter(self, detected):
+        return drop_excluded(detected, self.exclusions)
+
+    def _learn(self, detected, size):
+        """
+        Learns the slots once the same pip positions were seen in enough consecutive frames.
+
+        :param list detected: Objects of a full scan.
+        :param tuple[int, int] size: (width, height) of the frame.
+        :rtype: None
+        """
+        boxes = merge_boxes([(x, y, x + w, y + h) for x, y, w, h in (obj['rect'] for obj in detected)])
+        if not boxes:
+            self._candidate, self._agreeing = None, 0
+            return
+        boxes.sort()
+        tolerance = self.padding // 2
+        same = (self._candidate is not None and len(boxes) == len(self._candidate) and
+                all(max(abs(a - b) for a, b in zip(box, seen)) <= tolerance
+                    for box, seen in zip(boxes, self._candidate)))
+        if same:
+            # Keep the largest extent seen, pips of different ranks differ slightly in size
+            boxes = [(min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                     for a, b in zip(boxes, self._candidate)]
+            self._agreeing += 1
+        else:
+            self._agreeing = 1
+        self._candidate = boxes
+        if self._agreeing >= self.learn_frames:
+            self.slots, self.size = boxes, size
+            self._candidate, self._agreeing, self._since_verify = None, 0, 0
+            if self.on_learned is not None:
+                self.on_learned(list(self.slots), size)
+
+    def _forget(self):
+        self.slots = self.size = None
+        self.relearns += 1
+
+    def stats(self):
+        """
+        Returns the slot counters.
+
+        :returns: A dict with ``slots`` (number learned), ``hits``, ``misses``, ``learning``,
+            ``relearns`` and ``hit_rate`` (hits over all frames).
+        :rtype: dict
+        """
+        total = self.hits + self.misses + self.learning
+        return {
+            "slots": len(self.slots or ()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "learning": self.learning,
+            "relearns": self.relearns,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class RoiStore:
+    """
+    Keeps the learned slots and the exclusion boxes in a JSON file between sessions.
+
+    Slots are stored per area key (the region name and its screen area), so they are only
+    reused when the same area is watched again. Exclusions are in screen coordinates.
+
+    :ivar path: The JSON file.
+    :vartype path: str
+
+    :ivar exclusions: Boxes (left, top, right, bottom) in screen coordinates whose pips are ignored.
+    :vartype exclusions: list[tuple[int, int, int, int]]
+    """
+    def __init__(self, path):
+        """
+        Loads the file if it exists.
+
+        :param str path: The JSON file.
+        :rtype: None
+        """
+        self.path = path
+        self.exclusions = []
+        self._slots = {} # key -> {"size": [w, h], "slots": [[l, t, r, b], ...]}
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._slots = dict(data.get("slots", {}))
+            self.exclusions = [tuple(box) for box in data.get("exclusions", [])]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            print(f"[ERROR] Could not read learned slots from {path}: {e}")
+
+    @staticmethod
+    def key(name, area):
+        """
+        :param str name: Region name.
+        :param tuple[int, int, int, int] area: The region's screen area.
+        :rtype: str
+        """
+        return f"{name}@{','.join(str(v) for v in area)}"
+
+    def slots(self, key):
+        """
+        :param str key: Area key from ``key``.
+        :returns: The stored slots and the frame size they were learned on, or (None, None).
+        :rtype: tuple
+        """
+        with self._lock:
+            entry = self._slots.get(key)
+        if not entry:
+            return None, None
+        return [tuple(slot) for slot in entry["slots"]], tuple(entry["size"])
+
+    def set_slots(self, key, slots, size):
+        """
+        Stores learned slots and writes the file.
+
+        :param str key: Area key from ``key``.
+        :param list slots: Learned (left, top, right, bottom) boxes.
+        :param tuple[int, int] size: Frame size the slots were learned on.
+        :rtype: None
+        """
+        with self._lock:
+            self._slots[key] = {"size": list(size), "slots": [list(slot) for slot in slots]}
+        self.save()
+
+    def set_exclusions(self, exclusions):
+        """
+        Replaces the exclusion boxes and writes the file.
+
+        :param list exclusions: Boxes (left, top, right, bottom) in screen coordinates.
+        :rtype: None
+        """
+        with self._lock:
+            self.exclusions = [tuple(box) for box in exclusions]
+        self.save()
+
+    def clear_slots(self):
+        """
+        Forgets every learned slot and writes the file.
+
+        :rtype: None
+        """
+        with self._lock:
+            self._slots.clear()
+        self.save()
+
+    def save(self):
+        """
+        Writes the file, replacing it atomically.
+
+        :rtype: None
+        """
+        with self._lock:
+            data = {"slots": dict(self._slots), "exclusions": [list(box) for box in self.exclusions]}
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=1)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError as e:
+                print(f"[ERROR] Could not write learned slots to {self.path}: {e}")
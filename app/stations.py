@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+stations.py
+"""
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app.classifier import RankClassifier
+from app.config import STOP_CONFIRM_FRAMES
+from app.detection import detect_objects
+from app.metrics import REGISTRY, stage
+from app.pipeline import LatencyTracker
+from app.processor import stop_condition_met
+from app.tracking import PipTracker
+
+_CLICK_SECONDS = stage("click")
+
+class StationConfig:
+    """
+    Settings of one chisel station: a game window area, its buttons and its stop rules.
+
+    Defaults match the ones of ``PipRerollerApp``.
+
+    :ivar name: Label used in logs and statistics.
+    :vartype name: str
+
+    :ivar game_area: Pip area (left, top, right, bottom) in screen coordinates.
+    :vartype game_area: tuple[int, int, int, int]
+
+    :ivar chisel_button_pos: Screen position of the 'Chisel' button.
+    :vartype chisel_button_pos: tuple[int, int]
+
+    :ivar buy_button_pos: Screen position of the 'Buy' button.
+    :vartype buy_button_pos: tuple[int, int]
+    """
+    FIELDS = {
+        "min_quality": "F",
+        "min_objects": 1,
+        "stop_at_ss": 0,
+        "tolerance": 10,
+        "object_tolerance": 10,
+        "click_delay_ms": 50,
+        "post_reroll_delay_ms": 500,
+        "stop_confirm_frames": STOP_CONFIRM_FRAMES,
+    }
+
+    def __init__(self, name, game_area, chisel_button_pos, buy_button_pos, **settings):
+        """
+        :param str name: Label used in logs and statistics.
+        :param tuple[int, int, int, int] game_area: Pip area in screen coordinates.
+        :param tuple[int, int] chisel_button_pos: Screen position of the 'Chisel' button.
+        :param tuple[int, int] buy_button_pos: Screen position of the 'Buy' button.
+        :param settings: Any of ``FIELDS`` to override the defaults.
+        :raises ValueError: If an unknown setting is given.
+        :rtype: None
+        """
+        unknown = set(settings) - set(self.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown station settings: {', '.join(sorted(unknown))}")
+        self.name = name
+        self.game_area = tuple(game_area)
+        self.chisel_button_pos = tuple(chisel_button_pos)
+        self.buy_button_pos = tuple(buy_button_pos)
+        for key, default in self.FIELDS.items():
+            setattr(self, key, settings.get(key, default))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Creates a station from a dict, e.g. one entry of a stations JSON file.
+
+        :param dict data: ``name``, ``game_area``, ``chisel_button_pos``, ``buy_button_pos``
+            and optionally any of ``FIELDS``.
+        :returns: The station settings.
+        :rtype: StationConfig
+        """
+        data = dict(data)
+        return cls(data.pop("name"), data.pop("game_area"), data.pop("chisel_button_pos"),
+                   data.pop("buy_button_pos"), **data)
+
+    def to_dict(self):
+        """
+        :returns: The settings as a JSON-serializable dict.
+        :rtype: dict
+        """
+        data = {
+            "name": self.name,
+            "game_area": list(self.game_area),
+            "chisel_button_pos": list(self.chisel_button_pos),
+            "buy_button_pos": list(self.buy_button_pos),
+        }
+        data.update({key: getattr(self, key) for key in self.FIELDS})
+        return data
+
+def load_stations(path):
+    """
+    Reads station settings from a JSON file holding a list of station dicts.
+
+    :param str path: Path of the JSON file.
+    :returns: The station settings, in file order.
+    :rtype: list[StationConfig]
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return [StationConfig.from_dict(entry) for entry in json.load(f)]
+
+# Classifiers of a worker process, by tolerance
+_worker_classifiers = {}
+
+def _init_worker():
+    # Ctrl+C reaches the whole process group; let the orchestrator shut workers down instead
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def detect_in_worker(frame, tolerance, object_tolerance):
+    """
+    Detects pips in a worker process of the detection pool.
+
+    Each worker keeps its classifiers between calls, so the lookup table of a tolerance is
+    loaded (memory-mapped from the disk cache) once per process.
+
+    :param numpy.ndarray frame: The image frame (BGR or BGRA).
+    :param int tolerance: Color tolerance.
+    :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+    :returns: The detected objects and the detection time in seconds.
+    :rtype: tuple[list[dict], float]
+    """
+    start = time.perf_counter()
+    classifier = _worker_classifiers.get(tolerance)
+    if classifier is None:
+        classifier = _worker_classifiers[tolerance] = RankClassifier.load(tolerance)
+    objs = detect_objects(classifier.classify(frame), object_tolerance)
+    return objs, time.perf_counter() - start
+
+class InputController(threading.Thread):
+    """
+    Single thread that performs every click of every station, one reroll at a time.
+
+    Mouse input is global, so two stations clicking at once would move the cursor away from
+    each other's buttons. Stations queue their reroll click sequences here instead, and each
+    sequence runs to completion before the next one starts.
+
+    :ivar click: Function called as ``click(x, y)`` to click at screen coordinates.
+    :vartype click: callable
+
+    :ivar wait: Time reroll requests spent queued behind other stations' clicks.
+    :vartype wait: app.pipeline.LatencyTracker
+    """
+    def __init__(self, click):
+        """
+        :param callable click: Function called as ``click(x, y)``, e.g. ``PipRerollerApp.click_at``.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name="InputController")
+        self.click = click
+        self.wait = LatencyTracker()
+        self._requests = queue.Queue()
+
+    def run(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            steps, queued_at, done, cancel = request
+            self.wait.add(time.perf_counter() - queued_at)
+            try:
+                if cancel is not None and cancel.is_set():
+                    continue # The station stopped while its request was queued
+                for x, y, delay_ms in steps:
+                    with _CLICK_SECONDS.time():
+                        self.click(x, y)
+                    time.sleep(delay_ms / 1000)
+            except Exception as e:
+                print(f"Input error: {e}")
+            finally:
+                done.set()
+
+    def perform(self, steps, cancel=None):
+        """
+        Queues a click sequence and waits until it has been performed.
+
+        :param list[tuple[int, int, int]] steps: ``(x, y, delay_ms)`` clicks, each followed by its delay.
+        :param threading.Event cancel: Optional event that stops waiting early when set.
+            A sequence that has not started yet is then skipped.
+        :returns: True once the sequence has been performed, False if waiting was cancelled.
+        :rtype: bool
+        """
+        done = threading.Event()
+        self._requests.put((steps, time.perf_counter(), done, cancel))
+        while not done.wait(0.05):
+            if cancel is not None and cancel.is_set():
+                return False
+        return True
+
+    def stop(self):
+        """
+        Stops the thread after the queued sequences.
+
+        :rtype: None
+        """
+        self._requests.put(None)
+
+class Station(threading.Thread):
+    """
+    Reroll loop of one game window: capture, detect in the pool, decide, reroll.
+
+    Detection runs in the orchestrator's process pool, so the stations' image processing
+    uses all cores instead of sharing one GIL. Like ``ImageProcessor`` does, a stop condition
+    is confirmed once pips seen with the same rank on ``stop_confirm_frames`` frames in a row
+    meet it.
+
+    :ivar config: Station settings.
+    :vartype config: StationConfig
+
+    :ivar state: ``"idle"``, ``"rolling"``, ``"confirming"``, ``"stopped"`` or ``"error"``.
+    :vartype state: str
+
+    :ivar frames: Number of frames analyzed.
+    :vartype frames: int
+
+    :ivar rerolls: Number of rerolls performed.
+    :vartype rerolls: int
+
+    :ivar last_detected_objs: Detections of the most recent frame.
+    :vartype last_detected_objs: list
+
+    :ivar detect_time: Detection time inside the worker process.
+    :vartype detect_time: app.pipeline.LatencyTracker
+
+    :ivar round_trip: Time from submitting a frame to the pool until its result is back.
+    :vartype round_trip: app.pipeline.LatencyTracker
+    """
+    def __init__(self, config, capturer, pool, controller):
+        """
+        :param StationConfig config: Station settings.
+        :param app.capture.CaptureBackend capturer: Frame source of this station. Closed on exit.
+        :param concurrent.futures.Executor pool: Executor running ``detect_in_worker``.
+        :param InputController controller: Shared input controller.
+        :rtype: None
+        """
+        super().__init__(daemon=True, name=f"Station {config.name}")
+        self.config = config
+        self.capturer = capturer
+        self.pool = pool
+        self.controller = controller
+        self.state = "idle"
+        self.error = None
+        self.frames = 0
+        self.rerolls = 0
+        self.last_detected_objs = []
+        self.detect_time = LatencyTracker()
+        self.round_trip = LatencyTracker()
+        self.started_at = None
+        self.stopped_at = None
+        self.stop_event = threading.Event()
+        labels = {"station": config.name}
+        self._rolls = REGISTRY.counter("rolls_total", "Rerolls performed", labels)
+        self._detect_seconds = stage("detect", labels)
+        self._round_trip_seconds = stage("round_trip", labels)
+
+    def run(self):
+        config = self.config
+        self.started_at = time.perf_counter()
+        tracker = PipTracker() # The station's area never changes, so its pips are followed for the whole run
+        try:
+            while not self.stop_event.is_set():
+                objs = self.detect()
+                if objs is None:
+                    self.stop_event.wait(0.1) # Short delay before retrying capture
+                    continue
+
+                objs = tracker.update(objs)
+                confirmed = tracker.confirmed(max(1, config.stop_confirm_frames))
+                if stop_condition_met(confirmed, config.min_quality, config.min_objects, config.stop_at_ss):
+                    self.state = "stopped"
+                    break
+                if stop_condition_met(objs, config.min_quality, config.min_objects, config.stop_at_ss):
+                    self.state = "confirming"
+                    continue # Confirm on the next frames before clicking again
+                self.state = "rolling"
+
+                steps = [(*config.chisel_button_pos, config.click_delay_ms),
+                         (*config.buy_button_pos, config.click_delay_ms)]
+                if not self.controller.perform(steps, cancel=self.stop_event):
+                    continue # Stopped while waiting for the input controller
+                self.rerolls += 1
+                self._rolls.inc()
+                # Post-click safety delay, gives the game time to update the charm slot
+                self.stop_event.wait(config.post_reroll_delay_ms / 1000)
+            else:
+                self.state = "idle"
+        except Exception as e:
+            self.state = "error"
+            self.error = e
+            print(f"Station {config.name} error: {e}")
+        finally:
+            self.stopped_at = time.perf_counter()
+            self.capturer.close()
+
+    def detect(self):
+        """
+        Captures the station's area and detects its pips in the pool.
+
+        :returns: The detected objects, or ``None`` if the capture failed.
+        :rtype: list[dict] or None
+        """
+        frame = self.capturer.capture(bbox=self.config.game_area)
+        if frame is None:
+            return None
+        # The frame is pickled for the worker while we wait, so a pooled capture
+        # buffer is not reused before the result is back
+        submitted = time.perf_counter()
+        objs, seconds = self.pool.submit(
+            detect_in_worker, frame, self.config.tolerance, self.config.object_tolerance
+        ).result()
+        round_trip = time.perf_counter() - submitted
+        self.round_trip.add(round_trip)
+        self.detect_time.add(seconds)
+        self._round_trip_seconds.record(round_trip)
+        self._detect_seconds.record(seconds)
+        self.frames += 1
+        self.last_detected_objs = objs
+        return objs
+
+    def stop(self):
+        """
+        Signals the station to stop after its current step.
+
+        :rtype: None
+        """
+        self.stop_event.set()
+
+    def stats(self):
+        """
+        Returns the throughput of this station.
+
+        :returns: A dict with ``name``, ``state``, ``frames``, ``rerolls``, ``rerolls_per_min``,
+            ``frames_per_sec`` and the ``detect_ms`` and ``round_trip_ms`` latency summaries.
+        :rtype: dict
+        """
+        if self.started_at is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self.stopped_at or time.perf_counter()) - self.started_at
+        return {
+            "name": self.config.name,
+            "state": self.state,
+            "frames": self.frames,
+            "rerolls": self.rerolls,
+            "rerolls_per_min": self.rerolls * 60 / elapsed if elapsed else 0.0,
+            "frames_per_sec": self.frames / elapsed if elapsed else 0.0,
+            "detect_ms": self.detect_time.stats(),
+            "round_trip_ms": self.round_trip.stats(),
+        }
+
+class Orchestrator:
+    """
+    Runs several independent chisel stations side by side.
+
+    Each station has its own thread, frame source and stop rules. Detection for all stations
+    runs in one process pool and every click goes through a single ``InputController``.
+
+    :ivar stations: The stations, in configuration order.
+    :vartype stations: list[Station]
+
+    :ivar controller: Input controller shared by all stations.
+    :vartype controller: InputController
+
+    :ivar workers: Number of detection processes.
+    :vartype workers: int
+    """
+    def __init__(self, configs, click, capturer_factory=None, workers=None):
+        """
+        :param list[StationConfig] configs: Settings of each station.
+        :param callable click: Function called as ``click(x, y)`` to click at screen coordinates.
+        :param callable capturer_factory: Called with a ``StationConfig`` to create its frame source.
+            Defaults to a BGRA ``ScreenCapture`` per station.
+        :param int workers: Number of detection processes. Defaults to one per station,
+            capped at the number of CPUs.
+        :rtype: None
+        """
+        if capturer_factory is None:
+            from app.capture import ScreenCapture
+            capturer_factory = lambda config: ScreenCapture(bgr=False)
+        self.workers = workers or max(1, min(len(configs), os.cpu_count() or 1))
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        self.controller = InputController(click)
+        self.stations = [Station(config, capturer_factory(config), self.pool, self.controller)
+                         for config in configs]
+
+    def start(self):
+        """
+        Starts the input controller and every station.
+
+        :rtype: None
+        """
+        self.controller.start()
+        for station in self.stations:
+            station.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stops every station, then the input controller and the process pool.
+
+        :param float timeout: Maximum time to wait for each station in seconds.
+        :rtype: None
+        """
+        for station in self.stations:
+            station.stop()
+        for station in self.stations:
+            if station.is_alive():
+                station.join(timeout)
+        self.controller.stop()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def running(self):
+        """
+        :returns: True while at least one station is still rolling.
+        :rtype: bool
+        """
+        return any(station.is_alive() for station in self.stations)
+
+    def stats(self):
+        """
+        Returns per-station throughput and the input controller contention.
+
+        :returns: A dict with ``stations`` (list of ``Station.stats``), the summed
+            ``rerolls_per_min``, ``workers`` and ``input_wait_ms``.
+        :rtype: dict
+        """
+        stations = [station.stats() for station in self.stations]
+        return {
+            "stations": stations,
+            "rerolls_per_min": sum(s["rerolls_per_min"] for s in stations),
+            "workers": self.workers,
+            "input_wait_ms": self.controller.wait.stats(),
+        }
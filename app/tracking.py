@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+tracking.py
+"""
+
+class PipTracker:
+    """
+    Follows pips across frames, so a stop condition is confirmed by how many frames in a row
+    showed the same pips instead of by how much time passed.
+
+    Each detection is matched to the nearest unmatched track whose center is less than
+    ``max_distance`` away, closest pairs first. A matched track keeps its ID and counts one
+    more frame, unless its rank changed: the pip is then new and its count starts over. A
+    track that is not matched is kept for ``max_misses`` frames with its count, so a single
+    frame missing a pip (a capture torn by the game redrawing, an animation) does not restart
+    its confirmation; a track that stays unmatched longer is dropped.
+
+    :ivar max_misses: Frames in a row a track may go unmatched before it is dropped.
+    :vartype max_misses: int
+
+    :ivar max_distance: Largest distance in pixels between the centers of a track and a
+        detection to match them, or ``None`` for the larger side of the track's rectangle.
+    :vartype max_distance: float or None
+    """
+    def __init__(self, max_misses=1, max_distance=None):
+        """
+        :param int max_misses: Frames in a row a track may go unmatched before it is dropped.
+        :param float max_distance: Largest distance in pixels between the centers of a track
+            and a detection to match them. Defaults to the larger side of the track's rectangle.
+        :rtype: None
+        """
+        self.max_misses = max_misses
+        self.max_distance = max_distance
+        self._tracks = [] # dicts with 'id', 'rank', 'rect', 'age' and 'misses'
+        self._next_id = 1
+
+    def update(self, detected_objs):
+        """
+        Matches the detections of a new frame to the tracks.
+
+        :param list[dict] detected_objs: Detected objects with 'rank' and 'rect' keys.
+        :returns: Copies of the objects with the 'id' of their track and its 'age', the number
+            of frames its pip was seen with this rank.
+        :rtype: list[dict]
+        """
+        pairs = []
+        for t, track in enumerate(self._tracks):
+            tx, ty = _center(track['rect'])
+            limit = self.max_distance if self.max_distance is not None else max(track['rect'][2:])
+            for o, obj in enumerate(detected_objs):
+                ox, oy = _center(obj['rect'])
+                distance = ((tx - ox) ** 2 + (ty - oy) ** 2) ** 0.5
+                if distance <= limit:
+                    pairs.append((distance, t, o))
+        pairs.sort()
+
+        matched = {} # Detection index -> track
+        used = set()
+        for _, t, o in pairs:
+            if o in matched or t in used:
+                continue
+            matched[o] = self._tracks[t]
+            used.add(t)
+
+        tracks = []
+        tracked = []
+        for o, obj in enumerate(detected_objs):
+            track = matched.get(o)
+            if track is None:
+                track = {'id': self._next_id, 'rank': obj['rank'], 'age': 0}
+                self._next_id += 1
+            elif track['rank'] != obj['rank']:
+                track['rank'] = obj['rank']
+                track['age'] = 0 # Another pip in the same place, e.g. after a reroll
+            track['rect'] = obj['rect']
+            track['age'] += 1
+            track['misses'] = 0
+            tracks.append(track)
+            tracked.append(dict(obj, id=track['id'], age=track['age']))
+        for t, track in enumerate(self._tracks):
+            if t not in used and track['misses'] < self.max_misses:
+                track['misses'] += 1
+                tracks.append(track)
+        self._tracks = tracks
+        return tracked
+
+    def confirmed(self, frames):
+        """
+        Returns the pips seen with the same rank on at least ``frames`` frames, including
+        those missing from the latest frame but not dropped yet.
+
+        :param int frames: Number of frames a pip must have been seen.
+        :returns: Objects with 'rank', 'rect', 'id' and 'age' keys.
+        :rtype: list[dict]
+        """
+        return [{'rank': track['rank'], 'rect': track['rect'], 'id': track['id'], 'age': track['age']}
+                for track in self._tracks if track['age'] >= frames]
+
+    def reset(self):
+        """
+        Forgets every track, e.g. after the watched area moved.
+
+        :rtype: None
+        """
+        self._tracks = []
+
+def _center(rect):
+    x, y, w, h = rect
+    return x + w / 2, y + h / 2
@@ -4,6 +4,8 @@ utils.py
 """
 import os
 import ctypes
+import queue
+import threading
 import tkinter as tk
 
 class Tooltip:
@@ -89,6 +91,66 @@ class Tooltip:
             y = event.y_root + 10
             self.tipwindow.wm_geometry(f"+{x}+{y}")
 
+class GuiMailbox:
+    """
+    Thread-safe mailbox of pending GUI updates, drained by a timer on the Tkinter main thread.
+
+    Background threads ``post`` the newest value of each kind of update (e.g. the status
+    message) instead of scheduling a callback per change, so updates between two drains
+    collapse into one and the Tk event queue never grows with the detection rate.
+    One-shot commands that must run once per request, such as a key press, are ``send``
+    through a queue instead and are never merged.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._commands = queue.SimpleQueue()
+
+    def post(self, key, value):
+        """
+        Replaces the pending value of one kind of update.
+
+        :param str key: Kind of update, e.g. ``"message"``.
+        :param value: The newest value.
+        :rtype: None
+        """
+        with self._lock:
+            self._pending[key] = value
+
+    def drain(self):
+        """
+        Takes every pending update.
+
+        :returns: The newest value of each kind of update posted since the last drain.
+        :rtype: dict
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def send(self, command):
+        """
+        Queues a command to run on the main thread, once per call.
+
+        :param callable command: Called without arguments on the main thread.
+        :rtype: None
+        """
+        self._commands.put(command)
+
+    def commands(self):
+        """
+        Takes every queued command.
+
+        :returns: The commands sent since the last call, oldest first.
+        :rtype: list[callable]
+        """
+        commands = []
+        while True:
+            try:
+                commands.append(self._commands.get_nowait())
+            except queue.Empty:
+                return commands
+
 # --- DPI Awareness ---
 # This should be called as early as possible in the script execution.
 # DPI Awareness Constants
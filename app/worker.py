@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+worker.py
+"""
+import multiprocessing
+import signal
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from app.classifier import RankClassifier
+from app.config import PYRAMID_STRIDE
+from app.incremental import IncrementalDetector
+from app.pipeline import FrameRing, LatencyTracker
+from app.pyramid import CoarseToFineDetector
+
+def _attach(name):
+    """
+    Attaches to an existing shared memory block without taking ownership of it.
+
+    :param str name: Name of the block.
+    :rtype: multiprocessing.shared_memory.SharedMemory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python 3.13+
+    except TypeError:
+        # Older versions register the block again with the resource tracker, which the spawned
+        # worker shares with the app, so it is still only unlinked once by its creator
+        return shared_memory.SharedMemory(name=name)
+
+def _array_location(array, buffers):
+    """
+    Finds the shared memory block holding an array.
+
+    :param numpy.ndarray array: The array, possibly a view of one of ``buffers``.
+    :param dict buffers: Shared memory block name -> array covering the whole block.
+    :returns: (name, offset in bytes) of the block holding ``array``, or ``None``.
+    :rtype: tuple[str, int] or None
+    """
+    address = array.__array_interface__['data'][0]
+    for name, buffer in buffers.items():
+        start = buffer.__array_interface__['data'][0]
+        if start <= address < start + buffer.nbytes:
+            return name, address - start
+    return None
+
+class SharedFrameRing(FrameRing):
+    """
+    ``FrameRing`` whose buffers live in shared memory, so a worker process can read captured
+    frames without copying them.
+
+    Frames are only shared as long as the capturer writes into the ring's buffers, like
+    ``ScreenCapture`` does; ``DetectionWorker`` copies any other frame.
+    """
+    def __init__(self, capacity=2):
+        """
+        :param int capacity: Maximum number of frames waiting for the consumer, at least 1.
+        :rtype: None
+        """
+        super().__init__(capacity)
+        self._blocks = [None] * self.count
+
+    def _allocate(self, slot, shape, dtype):
+        if self._blocks[slot] is not None:
+            self._blocks[slot].close()
+            self._blocks[slot].unlink()
+        size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        self._blocks[slot] = block
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def shared_buffers(self):
+        """
+        Returns the buffers that are backed by shared memory.
+
+        :returns: Shared memory block name -> buffer.
+        :rtype: dict[str, numpy.ndarray]
+        """
+        with self._cond:
+            return {block.name: buffer for block, buffer in zip(self._blocks, self._buffers) if block is not None}
+
+    def release(self):
+        """
+        Frees the shared memory. No frame of the ring may be used afterwards.
+
+        :rtype: None
+        """
+        with self._cond:
+            self._buffers = [None] * self.count
+            for block in self._blocks:
+                if block is not None:
+                    block.close()
+                    block.unlink()
+            self._blocks = [None] * self.count
+
+def _worker_main(conn):
+    """
+    Main loop of the detection worker process.
+
+    Sends ``True`` once it is ready. Requests are (name, offset, shape, strides, dtype, key, tolerance,
+    object_tolerance, mode) tuples describing a frame in shared memory; every request is answered with
+    ``(objs, seconds)``, or ``(None, error message)`` if detection failed. ``None`` ends the loop.
+
+    :param multiprocessing.connection.Connection conn: Pipe to the image processor.
+    :rtype: None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The app shuts the worker down
+    blocks = OrderedDict() # Attached shared memory blocks, most recently used last
+    classifiers = {}
+    detectors = {} # One incremental detector per region key
+    pyramid = CoarseToFineDetector(PYRAMID_STRIDE)
+    conn.send(True) # Imports are done, ready for frames
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        name, offset, shape, strides, dtype, key, tolerance, object_tolerance, mode = request
+        start = time.perf_counter()
+        try:
+            block = blocks.get(name)
+            if block is None:
+                block = blocks[name] = _attach(name)
+                while len(blocks) > 16:
+                    blocks.popitem(last=False)[1].close() # Buffers replaced by the ring since
+            blocks.move_to_end(name)
+            frame = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset, strides=strides)
+            classifier = classifiers.get(tolerance)
+            if classifier is None:
+                classifier = classifiers[tolerance] = RankClassifier.load(tolerance)
+            if mode == "pyramid":
+                detector = pyramid
+            else:
+                detector = detectors.get(key)
+                if detector is None:
+                    detector = detectors[key] = IncrementalDetector()
+            objs = detector.detect(frame, classifier, object_tolerance)
+            del frame # Release the buffer export before the block may be closed
+            conn.send((objs, time.perf_counter() - start))
+        except Exception as e:
+            conn.send((None, f"{type(e).__name__}: {e}"))
+    for block in blocks.values():
+        block.close()
+
+class DetectionWorker:
+    """
+    Runs pip detection in a separate process so it never holds the GUI's GIL.
+
+    Frames in a ``SharedFrameRing`` are passed by reference; other frames are copied into a
+    shared scratch buffer first. Each call waits for its result, which only takes a pipe
+    round trip on top of the detection itself.
+
+    :ivar ring: Ring whose shared buffers frames may come from, if any.
+    :vartype ring: SharedFrameRing or None
+
+    :ivar round_trip: Time from sending a frame to receiving its detections.
+    :vartype round_trip: app.pipeline.LatencyTracker
+
+    :ivar copies: Number of frames that had to be copied into shared memory.
+    :vartype copies: int
+
+    :ivar timeout: Maximum time to wait for the detections of a frame in seconds.
+    :vartype timeout: float
+    """
+    def __init__(self, ring=None, timeout=5.0):
+        """
+        :param SharedFrameRing ring: Ring whose shared buffers frames may come from.
+        :param float timeout: Maximum time to wait for the detections of a frame in seconds.
+        :rtype: None
+        """
+        self.ring = ring
+        self.timeout = timeout
+        self.round_trip = LatencyTracker()
+        self.copies = 0
+        self._conn = None
+        self._process = None
+        self._scratch = None
+        self._scratch_buffer = None
+
+    def start(self, timeout=30.0):
+        """
+        Starts the worker process and waits until it is ready for frames.
+
+        :param float timeout: Maximum time to wait for the worker in seconds.
+        :rtype: None
+        :raises RuntimeError: If the worker did not start in time.
+        """
+        context = multiprocessing.get_context("spawn") # Same behavior as on Windows, and no forked threads
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child_conn,), daemon=True,
+                                        name="DetectionWorker")
+        self._process.start()
+        child_conn.close()
+        try:
+            if not self._conn.poll(timeout):
+                raise RuntimeError("Detection worker did not start")
+            self._conn.recv()
+        except (EOFError, OSError) as e:
+            self.stop()
+            raise RuntimeError("Detection worker exited while starting") from e
+        except RuntimeError:
+            self.stop()
+            raise
+
+    def _shared(self, frame):
+        """
+        Returns where a frame is in shared memory, copying it there if needed.
+
+        :param numpy.ndarray frame: The image frame.
+        :returns: (name, offset, shape, strides) of the frame in shared memory.
+        :rtype: tuple
+        """
+        buffers = self.ring.shared_buffers() if self.ring is not None else {}
+        location = _array_location(frame, buffers)
+        if location is not None:
+            return location + (frame.shape, frame.strides)
+        if self._scratch is None or self._scratch.size < frame.nbytes:
+            self._release_scratch()
+            self._scratch = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+        self._scratch_buffer = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._scratch.buf)
+        np.copyto(self._scratch_buffer, frame)
+        self.copies += 1
+        return self._scratch.name, 0, frame.shape, self._scratch_buffer.strides
+
+    def detect(self, frame, tolerance, object_tolerance, key="game_area", mode="exact"):
+        """
+        Detects and classifies pips in the worker process.
+
+        :param numpy.ndarray frame: The image frame (BGR or BGRA).
+        :param int tolerance: Color tolerance.
+        :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+        :param str key: Identifies the area the frame shows; the worker keeps one incremental
+            detector per key.
+        :param str mode: ``"exact"``, or ``"pyramid"`` for the ``CoarseToFineDetector``.
+        :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+        :rtype: list of dict
+        :raises RuntimeError: If the worker is not running, did not answer in time or detection failed.
+        :raises EOFError: If the worker exited while detecting.
+        :raises OSError: If the pipe to the worker broke.
+        """
+        if self._process is None or not self._process.is_alive():
+            raise RuntimeError("Detection worker is not running")
+        start = time.perf_counter()
+        name, offset, shape, strides = self._shared(frame)
+        self._conn.send((name, offset, shape, strides, frame.dtype.str, key, tolerance, object_tolerance, mode))
+        if not self._conn.poll(self.timeout):
+            # A late answer would be taken for the next frame's, so the worker cannot be used anymore
+            raise RuntimeError(f"Detection worker did not answer within {self.timeout:g} s")
+        objs, result = self._conn.recv()
+        if objs is None:
+            raise RuntimeError(f"Detection worker failed: {result}")
+        self.round_trip.add(time.perf_counter() - start)
+        return objs
+
+    def stats(self):
+        """
+        Returns the round trip times and the number of copied frames.
+
+        :returns: The ``LatencyTracker.stats`` dict of the round trips, plus ``copies``.
+        :rtype: dict
+        """
+        stats = self.round_trip.stats()
+        stats["copies"] = self.copies
+        return stats
+
+    def _release_scratch(self):
+        if self._scratch is not None:
+            self._scratch_buffer = None
+            self._scratch.close()
+            self._scratch.unlink()
+            self._scratch = None
+
+    def stop(self):
+        """
+        Stops the worker process and frees the scratch buffer.
+
+        :rtype: None
+        """
+        if self._process is not None:
+            try:
+                self._conn.send(None)
+            except OSError:
+                pass # Worker already gone
+            self._process.join(timeout=2.0)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(timeout=1.0)
+            if self._process.is_alive():
+                self._process.kill() # Hung or suspended, it cannot handle the termination request
+                self._process.join(timeout=1.0)
+            self._conn.close()
+            self._process = None
+        self._release_scratch()
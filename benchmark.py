@@ -0,0 +1,877 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+
+Developer tools for checking and measuring the detection pipeline.
+Runs headless (no Tkinter, AHK or pywin32 needed), e.g.:
+
+    python benchmark.py parity recordings/*.png
+    python benchmark.py merge --sizes 10 100 1000
+    python benchmark.py replay recordings/session.mp4 --pacing fast
+    python benchmark.py suite --resolutions 800x400 3840x2160 --json
+    python benchmark.py jitter --resolution 1920x1080 --seconds 5
+    python benchmark.py imports app.app --budget-ms 150
+"""
+import argparse
+import contextlib
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from app.capture import CaptureBackend
+from app.classifier import CHANNEL_LAYOUTS, RankClassifier
+from app.constants import RANKS, RANK_ORDER
+from app.detection import close_rank_mask, detect_objects, mask_components, merge_rectangles, present_ranks
+from app.headless import HeadlessApp
+from app.incremental import IncrementalDetector
+from app.metrics import REGISTRY
+from app.pipeline import LatencyTracker
+from app.processor import ImageProcessor
+from app.pyramid import CoarseToFineDetector
+from app.replay import PACING_MODES, ReplayCapture
+from app.regions import Region
+from app.roi import SlotCache
+
+# --- Reference implementation ---
+# The original per-rank detector, kept as the baseline that new engines are checked against.
+
+def legacy_rank_mask(frame, color_bgr, tolerance):
+    """
+    Create a binary mask of pixels within color tolerance of a target BGR color.
+
+    :param numpy.ndarray frame: The image frame (BGR).
+    :param numpy.ndarray color_bgr: Target BGR color as a NumPy array.
+    :param int tolerance: Maximum allowed absolute difference per channel.
+    :returns: Binary mask image with 255 where pixels match, 0 elsewhere.
+    :rtype: numpy.ndarray
+    """
+    diff = np.abs(frame.astype(np.int16) - color_bgr)
+    return np.all(diff <= tolerance, axis=2).astype(np.uint8) * 255
+
+def legacy_merge_rectangles(rects, max_distance):
+    """
+    Greedily merge rectangles that are within ``max_distance`` of a seed rectangle.
+
+    :param list[tuple] rects: Rectangles as (x, y, w, h) tuples.
+    :param float max_distance: Maximum distance between rectangles to consider merging.
+    :returns: Merged rectangles as (x, y, w, h) tuples.
+    :rtype: list[tuple]
+    """
+    def rect_distance(r1, r2):
+        x1, y1, w1, h1 = r1
+        x2, y2, w2, h2 = r2
+        dx = 0
+        if x1 + w1 < x2:
+            dx = x2 - (x1 + w1)
+        elif x2 + w2 < x1:
+            dx = x1 - (x2 + w2)
+        dy = 0
+        if y1 + h1 < y2:
+            dy = y2 - (y1 + h1)
+        elif y2 + h2 < y1:
+            dy = y1 - (y2 + h2)
+        return np.hypot(dx, dy)
+
+    merged = []
+    used = [False] * len(rects)
+    for i, r in enumerate(rects):
+        if used[i]:
+            continue
+        x, y, w, h = r
+        merged_rect = [x, y, x + w, y + h]
+        used[i] = True
+        for j in range(i + 1, len(rects)):
+            if used[j]:
+                continue
+            if rect_distance(r, rects[j]) <= max_distance:
+                rx, ry, rw, rh = rects[j]
+                merged_rect[0] = min(merged_rect[0], rx)
+                merged_rect[1] = min(merged_rect[1], ry)
+                merged_rect[2] = max(merged_rect[2], rx + rw)
+                merged_rect[3] = max(merged_rect[3], ry + rh)
+                used[j] = True
+        merged.append((merged_rect[0], merged_rect[1],
+                       merged_rect[2] - merged_rect[0],
+                       merged_rect[3] - merged_rect[1]))
+    return merged
+
+def legacy_detect(frame, tolerance, object_tolerance, merge=legacy_merge_rectangles, timer=None):
+    """
+    Detect pips with one mask, closing and contour pass per rank.
+
+    :param numpy.ndarray frame: The image frame (BGR).
+    :param int tolerance: Color tolerance.
+    :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+    :param callable merge: Rectangle merging function, so stages can be compared in isolation.
+    :param StageTimer timer: Optional timer that accumulates the time spent in each stage.
+    :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+    :rtype: list[dict]
+    """
+    timer = timer or _untimed
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    detected = []
+    for rank, bgr, _ in RANKS:
+        with timer("mask"):
+            mask = legacy_rank_mask(frame, np.array(bgr), tolerance)
+        with timer("morphology"):
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+        with timer("contours"):
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            rects = [cv2.boundingRect(c) for c in contours if cv2.contourArea(c) > 1]
+        with timer("merge"):
+            merged = merge(rects, object_tolerance)
+        for rect in merged:
+            detected.append({"rank": rank, "rect": rect, "cv2color": bgr})
+    detected.sort(key=lambda o: -RANK_ORDER[o['rank']])
+    return detected
+
+def staged_detect(frame, classifier, object_tolerance, timer=None):
+    """
+    Detect pips like ``app.detection.detect_objects``, timing each stage separately.
+
+    :param numpy.ndarray frame: The image frame (BGR).
+    :param app.classifier.RankClassifier classifier: Classifier for the color tolerance.
+    :param int object_tolerance: Maximum distance in pixels between rectangles to merge them.
+    :param StageTimer timer: Optional timer that accumulates the time spent in each stage.
+    :returns: List of detected objects, each a dict with keys 'rank', 'rect', and 'cv2color'.
+    :rtype: list[dict]
+    """
+    timer = timer or _untimed
+    with timer("mask"):
+        labels = classifier.classify(frame)
+        present = present_ranks(labels)
+    detected = []
+    for i, (rank, bgr, _) in enumerate(RANKS):
+        if not present & (1 << i):
+            continue
+        with timer("morphology"):
+            closed = close_rank_mask(labels, 1 << i)
+        with timer("contours"):
+            rects, keep = mask_components(*closed)
+            rects = [tuple(r) for r in rects[keep].tolist()]
+        with timer("merge"):
+            merged = merge_rectangles(rects, object_tolerance)
+        for rect in merged:
+            detected.append({"rank": rank, "rect": rect, "cv2color": bgr})
+    detected.sort(key=lambda o: -RANK_ORDER[o['rank']])
+    return detected
+
+# --- Helpers ---
+
+class StageTimer:
+    """
+    Accumulates wall-clock time per pipeline stage.
+
+    Used as ``with timer("mask"): ...``; repeated stages add up.
+
+    :ivar totals: Seconds spent in each stage.
+    :vartype totals: dict[str, float]
+    """
+    def __init__(self):
+        self.totals = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[stage] = self.totals.get(stage, 0.0) + time.perf_counter() - start
+
+def _untimed(stage):
+    return contextlib.nullcontext()
+
+def load_frames(paths):
+    """
+    Load recorded frames from image files or directories of images.
+
+    :param list[str] paths: Image files, directories or glob patterns.
+    :returns: List of ``(name, frame)`` tuples with BGR frames.
+    :rtype: list[tuple[str, numpy.ndarray]]
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.png"))))
+        else:
+            files.extend(sorted(glob.glob(path)) or [path])
+    frames = []
+    for name in files:
+        frame = cv2.imread(name, cv2.IMREAD_COLOR)
+        if frame is None:
+            print(f"Skipping unreadable frame: {name}", file=sys.stderr)
+            continue
+        frames.append((name, frame))
+    return frames
+
+def summarize(objs):
+    """
+    Reduce detections to a comparable, order-independent form.
+
+    :param list[dict] objs: Detected objects.
+    :returns: Sorted ``(rank, rect)`` tuples.
+    :rtype: list[tuple]
+    """
+    return sorted((o['rank'], tuple(int(v) for v in o['rect'])) for o in objs)
+
+def make_fragments(count, rng, fragment_size=6, spread=40, area=(1920, 1080)):
+    """
+    Generate fragment rectangles resembling a noisy, heavily split detection.
+
+    Fragments are scattered around pip centers so that most of them chain together
+    within a few pixels, like the pieces of a pip that is broken up by a high tolerance.
+
+    :param int count: Number of fragments to generate.
+    :param numpy.random.Generator rng: Random number generator.
+    :param int fragment_size: Maximum width and height of a fragment.
+    :param int spread: Maximum offset of a fragment from its pip center.
+    :param tuple[int, int] area: Width and height of the frame the fragments lie in.
+    :returns: List of (x, y, w, h) tuples.
+    :rtype: list[tuple]
+    """
+    pips = max(1, count // 25)
+    centers = rng.integers((spread, spread), (area[0] - spread, area[1] - spread), size=(pips, 2))
+    owner = rng.integers(0, pips, size=count)
+    pos = centers[owner] + rng.integers(-spread, spread, size=(count, 2))
+    size = rng.integers(1, fragment_size + 1, size=(count, 2))
+    return [tuple(r) for r in np.hstack([pos, size]).tolist()]
+
+def make_scene(width, height, pips, noise, rng):
+    """
+    Lay out a synthetic pip area.
+
+    Pips are placed at the centers of a grid of equal cells. The background is a dark
+    gray with a fixed Gaussian noise pattern, which is also added on top of the pips
+    when frames are rendered, like the static dithering of a captured game screen.
+
+    :param int width: Frame width in pixels.
+    :param int height: Frame height in pixels.
+    :param int pips: Number of pips.
+    :param float noise: Standard deviation of the noise in color levels.
+    :param numpy.random.Generator rng: Random number generator.
+    :returns: A dict with ``size``, ``centers``, ``radius`` and ``noise``.
+    :rtype: dict
+    """
+    cols = max(1, int(np.ceil(np.sqrt(pips * width / height))))
+    rows = max(1, int(np.ceil(pips / cols)))
+    cell_w, cell_h = width / cols, height / rows
+    centers = [(int((k % cols + 0.5) * cell_w), int((k // cols + 0.5) * cell_h)) for k in range(pips)]
+    return {
+        "size": (width, height),
+        "centers": centers,
+        "radius": max(2, int(0.35 * min(cell_w, cell_h))),
+        "noise": rng.normal(0, noise, size=(height, width, 3)).astype(np.int16) if noise > 0 else None,
+    }
+
+def render_frame(scene, fragmentation, rng, background=(40, 36, 32)):
+    """
+    Render one frame of a scene with freshly rolled pip ranks.
+
+    Every pip is drawn as a disc in the exact ``RANKS`` color of a random rank. To emulate
+    fragmented detections, ``fragmentation`` background-colored bands are cut through each
+    pip; they are wider than the closing can bridge but narrower than the default object
+    tolerance, so the pieces are only joined again by the rectangle merge.
+
+    :param dict scene: Layout from ``make_scene``.
+    :param int fragmentation: Number of cuts per pip.
+    :param numpy.random.Generator rng: Random number generator.
+    :param tuple[int, int, int] background: Background BGR color.
+    :returns: The BGR frame.
+    :rtype: numpy.ndarray
+    """
+    width, height = scene["size"]
+    radius = scene["radius"]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[:] = background
+    for cx, cy in scene["centers"]:
+        _, bgr, _ = RANKS[rng.integers(len(RANKS))]
+        cv2.circle(frame, (cx, cy), radius, bgr, thickness=-1)
+        for _ in range(fragmentation):
+            angle = rng.uniform(0, np.pi)
+            dx, dy = int(np.cos(angle) * radius), int(np.sin(angle) * radius)
+            offset = rng.integers(-radius // 2, radius // 2 + 1, size=2)
+            cv2.line(frame, (cx - dx + offset[0], cy - dy + offset[1]), (cx + dx + offset[0], cy + dy + offset[1]),
+                     background, thickness=6)
+    if scene["noise"] is not None:
+        frame = np.clip(frame + scene["noise"], 0, 255).astype(np.uint8)
+    return frame
+
+def convert_layout(frame, layout, rng=None):
+    """
+    Convert a BGR frame to another channel layout.
+
+    :param numpy.ndarray frame: The image frame (BGR).
+    :param str layout: Target layout, one of ``app.classifier.CHANNEL_LAYOUTS``.
+    :param numpy.random.Generator rng: If given, the alpha channel is filled with random values
+        so that detection is shown not to depend on it.
+    :returns: The converted frame.
+    :rtype: numpy.ndarray
+    """
+    if layout == "BGR":
+        return frame
+    if layout == "RGB":
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    converted = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA if layout == "BGRA" else cv2.COLOR_BGR2RGBA)
+    if rng is not None:
+        converted[..., 3] = rng.integers(0, 256, size=frame.shape[:2], dtype=np.uint8)
+    return converted
+
+def parse_resolution(text):
+    """
+    Parse a ``WIDTHxHEIGHT`` command line value.
+
+    :param str text: The value, e.g. ``1920x1080``.
+    :returns: Width and height.
+    :rtype: tuple[int, int]
+    """
+    try:
+        width, height = (int(v) for v in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    return width, height
+
+def time_call(func, repeat):
+    """
+    Time repeated calls of ``func`` and return the per-call durations.
+
+    :param callable func: Function to call without arguments.
+    :param int repeat: Number of calls.
+    :returns: Durations in seconds.
+    :rtype: numpy.ndarray
+    """
+    durations = np.empty(repeat)
+    for k in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations[k] = time.perf_counter() - start
+    return durations
+
+class SyntheticCapture(CaptureBackend):
+    """
+    Frame source cycling through prerendered frames, copied into the capture pool like a screen grab.
+
+    :ivar pool: Pool the frames are captured into, e.g. the processor's ring.
+    :vartype pool: app.pipeline.FrameRing
+    """
+    def __init__(self, frames, pool):
+        """
+        :param list[numpy.ndarray] frames: Frames to cycle through.
+        :param app.pipeline.FrameRing pool: Pool the frames are captured into, set before the first capture.
+        :rtype: None
+        """
+        self.frames = frames
+        self.pool = pool
+        self._index = 0
+
+    def capture(self, bbox=None):
+        frame = self.frames[self._index % len(self.frames)]
+        self._index += 1
+        buffer = self.pool.acquire(frame.shape, frame.dtype)
+        np.copyto(buffer, frame)
+        return buffer
+
+def measure_jitter(seconds, interval):
+    """
+    Measure how late a periodic timer wakes up, like the GUI's timers and the reroll loop's sleeps.
+
+    :param float seconds: Measurement duration.
+    :param float interval: Timer period in seconds.
+    :returns: The ``LatencyTracker.stats`` dict of the wake-up delays.
+    :rtype: dict
+    """
+    lateness = LatencyTracker(window=int(seconds / interval) + 1)
+    due = time.perf_counter()
+    end = due + seconds
+    while due < end:
+        due += interval
+        time.sleep(max(0.0, due - time.perf_counter()))
+        lateness.add(max(0.0, time.perf_counter() - due))
+    return lateness.stats()
+
+# --- Commands ---
+
+def cmd_suite(args):
+    """
+    Benchmark the detection engines on synthetic frames across resolutions and settings.
+
+    Every combination of resolution, pip count, noise and fragmentation is a scenario. Each
+    engine processes the same frame sequence of a scenario twice: once timed, then a few frames
+    under ``tracemalloc`` to measure the peak allocation per frame. Every detection is also
+    compared with the reference detector so a fast but wrong engine stands out. The ``legacy``
+    engine keeps the original greedy merge, which can group chains of fragments differently,
+    so its mismatches on fragmented frames are expected and not treated as failures.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code, 1 if any other engine disagreed with the reference.
+    :rtype: int
+    """
+    classifier = RankClassifier.load(args.tolerance)
+
+    # Engine factories, called once per scenario so stateful engines start fresh
+    def legacy():
+        return lambda frame, timer: legacy_detect(frame, args.tolerance, args.object_tolerance,
+                                                  legacy_merge_rectangles, timer)
+    def lut():
+        return lambda frame, timer: staged_detect(frame, classifier, args.object_tolerance, timer)
+    def incremental():
+        detector = IncrementalDetector() # Only reports the total, its stages are interleaved per window
+        return lambda frame, timer: detector.detect(frame, classifier, args.object_tolerance)
+    def pyramid():
+        detector = CoarseToFineDetector(args.stride)
+        return lambda frame, timer: detector.detect(frame, classifier, args.object_tolerance)
+    engines = {"legacy": legacy, "lut": lut, "incremental": incremental, "pyramid": pyramid}
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    mismatched = False
+    for width, height in args.resolutions:
+        for pips in args.pips:
+            for noise in args.noise:
+                for fragmentation in args.fragmentation:
+                    scene = make_scene(width, height, pips, noise, rng)
+                    frames = [render_frame(scene, fragmentation, rng) for _ in range(args.frames)]
+                    expected = [summarize(legacy_detect(f, args.tolerance, args.object_tolerance, merge_rectangles))
+                                for f in frames]
+                    for engine in args.engines:
+                        row = {"engine": engine, "resolution": f"{width}x{height}", "pips": pips,
+                               "noise": noise, "fragmentation": fragmentation, "frames": len(frames)}
+                        row.update(run_engine(engines[engine](), frames, expected))
+                        mismatched |= engine != "legacy" and row["matches"] != len(frames)
+                        results.append(row)
+                        if not args.json:
+                            print_suite_row(row)
+
+    report = {
+        "settings": {"tolerance": args.tolerance, "object_tolerance": args.object_tolerance, "seed": args.seed},
+        "versions": {"python": sys.version.split()[0], "numpy": np.__version__, "opencv": cv2.__version__},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    return 1 if mismatched else 0
+
+def run_engine(detect, frames, expected):
+    """
+    Time one engine on a frame sequence and measure its peak allocation.
+
+    :param callable detect: Called as ``detect(frame, timer)``.
+    :param list[numpy.ndarray] frames: Frames to process in order.
+    :param list expected: Reference detections of each frame, as returned by ``summarize``.
+    :returns: Throughput, latency percentiles, mean stage times, peak allocation and match count.
+    :rtype: dict
+    """
+    detect(frames[0], None) # Warm up caches and lazily built tables
+    timer = StageTimer()
+    durations = np.empty(len(frames))
+    matches = 0
+    for k, frame in enumerate(frames):
+        start = time.perf_counter()
+        with timer("total"):
+            objs = detect(frame, timer)
+        durations[k] = time.perf_counter() - start
+        matches += summarize(objs) == expected[k]
+
+    peak = 0
+    tracemalloc.start()
+    try:
+        for frame in frames[:3]:
+            tracemalloc.reset_peak()
+            detect(frame, None)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "fps": len(frames) / durations.sum(),
+        "mean_ms": float(durations.mean() * 1000),
+        "p50_ms": float(np.percentile(durations, 50) * 1000),
+        "p99_ms": float(np.percentile(durations, 99) * 1000),
+        "stages_ms": {stage: total * 1000 / len(frames) for stage, total in timer.totals.items()},
+        "peak_alloc_kb": peak / 1024,
+        "matches": matches,
+    }
+
+def print_suite_row(row):
+    """
+    Print one scenario result of the ``suite`` command as a table row.
+
+    :param dict row: Result row from ``cmd_suite``.
+    :rtype: None
+    """
+    stages = " ".join(f"{stage}={ms:.2f}" for stage, ms in row["stages_ms"].items() if stage != "total")
+    print(f"{row['engine']:<11} {row['resolution']:>9} pips={row['pips']:<3} noise={row['noise']:<4} "
+          f"frag={row['fragmentation']:<2} {row['fps']:>8.1f} fps p50={row['p50_ms']:.2f} ms "
+          f"p99={row['p99_ms']:.2f} ms peak={row['peak_alloc_kb']:.0f} KiB "
+          f"match={row['matches']}/{row['frames']} {stages}")
+
+def cmd_merge(args):
+    """
+    Compare how the greedy and the sweep-line merge scale with the number of fragments.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code.
+    :rtype: int
+    """
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for count in args.sizes:
+        rects = make_fragments(count, rng)
+        row = {"fragments": count}
+        for name, merge in (("greedy", legacy_merge_rectangles), ("sweep", merge_rectangles)):
+            durations = time_call(lambda: merge(rects, args.object_tolerance), args.repeat)
+            row[name] = {
+                "median_ms": float(np.median(durations) * 1000),
+                "boxes": len(merge(rects, args.object_tolerance)),
+            }
+        row["speedup"] = row["greedy"]["median_ms"] / row["sweep"]["median_ms"]
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'fragments':>9} {'greedy ms':>10} {'boxes':>6} {'sweep ms':>9} {'boxes':>6} {'speedup':>8}")
+        for row in results:
+            print(f"{row['fragments']:>9} {row['greedy']['median_ms']:>10.3f} {row['greedy']['boxes']:>6} "
+                  f"{row['sweep']['median_ms']:>9.3f} {row['sweep']['boxes']:>6} {row['speedup']:>7.1f}x")
+    return 0
+
+def cmd_parity(args):
+    """
+    Compare the lookup-table and connected-components detector against the reference detector.
+
+    Both detectors share the current ``merge_rectangles`` unless ``--legacy-merge`` is given,
+    so only the masking and blob extraction stages are compared by default. With ``--layout``,
+    the detector reads the frames converted to another channel layout (e.g. BGRA with random
+    alpha, like a screen capture), while the reference still reads BGR. With ``--slots``, the
+    frames are detected in order through a ``SlotCache``, which scans only the pip slots once
+    it learned them, as the image processor does. With ``--pyramid``, the frames are detected
+    by the coarse-to-fine detector with that sampling stride.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code, 0 if every frame matches.
+    :rtype: int
+    """
+    frames = load_frames(args.frames)
+    if not frames:
+        print("No frames to compare.", file=sys.stderr)
+        return 2
+    classifier = RankClassifier.load(args.tolerance)
+    rng = np.random.default_rng(0)
+    slots = SlotCache(args.slot_padding) if args.slots else None
+    pyramid = CoarseToFineDetector(args.pyramid) if args.pyramid else None
+    if pyramid is not None and args.layout not in ("BGR", "BGRA"):
+        print("--pyramid reads BGR or BGRA frames, like the image processor.", file=sys.stderr)
+        return 2
+    def detect(frame):
+        if pyramid is not None:
+            return pyramid.detect(frame, classifier, args.object_tolerance)
+        return detect_objects(classifier.classify(frame, layout=args.layout), args.object_tolerance)
+
+    mismatches = 0
+    for name, frame in frames:
+        merge = legacy_merge_rectangles if args.legacy_merge else merge_rectangles
+        expected = summarize(legacy_detect(frame, args.tolerance, args.object_tolerance, merge))
+        converted = convert_layout(frame, args.layout, rng)
+        if slots is not None:
+            actual = summarize(slots.detect(converted, detect, lambda crop, _: detect(crop), args.object_tolerance))
+        else:
+            actual = summarize(detect(converted))
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH {name}\n  reference: {expected}\n  detected:  {actual}")
+    print(f"{len(frames) - mismatches}/{len(frames)} frames match")
+    if slots is not None:
+        stats = slots.stats()
+        print(f"{stats['slots']} slots learned, {stats['hits']} frames scanned in the slots only "
+              f"({stats['hit_rate']:.0%}), {stats['misses']} full scans, {stats['relearns']} relearns")
+    if pyramid is not None:
+        print(f"{pyramid.stats()['refined_ratio']:.1%} of the pixels classified at full resolution")
+    return 1 if mismatches else 0
+
+def cmd_jitter(args):
+    """
+    Measure timer jitter in this process while the image processor detects at full speed,
+    once with detection in the processor thread and once in the worker process.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code.
+    :rtype: int
+    """
+    rng = np.random.default_rng(args.seed)
+    width, height = args.resolution
+    scene = make_scene(width, height, args.pips, 4.0, rng)
+    frames = [convert_layout(render_frame(scene, 0, rng), "BGRA") for _ in range(args.frames)]
+
+    results = {"idle": {"timer": measure_jitter(args.seconds, args.interval / 1000)}}
+    for mode, out_of_process in (("in-process", False), ("worker", True)):
+        app = HeadlessApp((0, 0, width, height), running=False)
+        app.image_poll_delay_ms = 0
+        app.min_objects = len(scene["centers"]) + 1 # Never stop
+        capturer = SyntheticCapture(frames, None)
+        processor = ImageProcessor(app, capturer=capturer, out_of_process=out_of_process)
+        capturer.pool = processor.ring # Capture into the (shared) ring buffers like ScreenCapture
+        processor.detection_cache.maxsize = 0 # Detect every frame
+        processor.poll.idle_delay_ms = 0
+        processor.start()
+        time.sleep(1.0) # Worker start and classifier load
+        frames_before = processor.frames_processed
+        timer = measure_jitter(args.seconds, args.interval / 1000)
+        fps = (processor.frames_processed - frames_before) / args.seconds
+        processor.stop()
+        processor.join()
+        results[mode] = {"timer": timer, "fps": fps}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for mode, result in results.items():
+            timer = result["timer"]
+            fps = f", detection {result['fps']:.1f} fps" if "fps" in result else ""
+            print(f"{mode:<11} {args.interval:g} ms timer late by p50 {timer['p50_ms']:.2f} ms, "
+                  f"p99 {timer['p99_ms']:.2f} ms, max {timer['max_ms']:.2f} ms{fps}")
+    return 0
+
+def cmd_replay(args):
+    """
+    Run the image processor headless on a recorded session and report its throughput.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code.
+    :rtype: int
+    """
+    capturer = ReplayCapture(args.source, pacing=args.pacing, fps=args.fps)
+    width, height = capturer.size
+    app = HeadlessApp(tuple(args.area) if args.area else (0, 0, width, height),
+                      running=args.stop, verbose=args.verbose)
+    app.tolerance = args.tolerance
+    app.object_tolerance = args.object_tolerance
+    app.image_poll_delay_ms = args.poll_delay
+    if args.confirm_frames is not None:
+        app.stop_confirm_frames = args.confirm_frames
+
+    regions = None
+    if args.region:
+        regions = [Region(name, tuple(int(v) for v in area)) for name, *area in args.region]
+    processor = ImageProcessor(app, capturer=capturer, regions=regions, out_of_process=args.worker,
+                               slot_rois=not args.full_scan, detection_mode=args.mode)
+    if not args.stop:
+        processor.poll.idle_delay_ms = 0 # Without --stop the app counts as suspended, keep polling at full speed
+    start = time.perf_counter()
+    processor.start()
+    while processor.is_alive() and not capturer.exhausted.wait(0.05):
+        pass
+    deadline = time.perf_counter() + 1.0
+    while processor.is_alive() and processor.ring.pending() and time.perf_counter() < deadline:
+        time.sleep(0.01) # Let detection pick up the last captured frame
+    processor.stop()
+    processor.join()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "frames_read": capturer.frames_read,
+        "frames_processed": processor.frames_processed,
+        "seconds": elapsed,
+        "fps": processor.frames_processed / elapsed if elapsed else 0.0,
+        "stops": app.stops,
+        "stop_confirmation": processor.get_stop_stats(),
+        "cache": processor.get_cache_stats(),
+        "slots": processor.get_roi_stats(),
+        "pyramid": processor.get_pyramid_stats(),
+        "tiles": processor.get_tile_stats(),
+        "latency": processor.get_latency_stats(),
+        "polling": processor.get_poll_stats(),
+        "last_counts": app.rank_counts,
+        "regions": {name: len(objs) for name, objs in processor.get_region_results().items()},
+        "stages": {
+            dict(labels)["stage"]: {"count": stats["count"], "p50_ms": stats[0.5] * 1000,
+                                    "p99_ms": stats[0.99] * 1000, "max_ms": stats["max"] * 1000}
+            for labels, stats in REGISTRY.snapshot().get("stage_seconds", {}).items() if stats["count"]
+        },
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"{result['frames_processed']} frames processed ({result['frames_read']} read) "
+              f"in {elapsed:.2f} s: {result['fps']:.1f} fps")
+        print(f"cache hit rate {result['cache']['hit_rate']:.1%}, "
+              f"dirty tiles {result['tiles']['dirty_ratio']:.1%}, stop signals {app.stops}")
+        confirmation = result["stop_confirmation"]
+        print(f"stop conditions confirmed over {confirmation['confirm_frames']} frames: "
+              f"{confirmation['confirmed']} confirmed, {confirmation['lost']} lost before confirmation")
+        slots = result["slots"]
+        if slots["enabled"]:
+            print(f"{slots['slots']} pip slots learned, {slots['hit_rate']:.1%} of detections in the slots only, "
+                  f"{slots['misses']} full scans, {slots['relearns']} relearns")
+        latency = result["latency"]
+        print(f"capture-to-decision latency p50 {latency['p50_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, "
+              f"max {latency['max_ms']:.2f} ms; {latency['frames']['dropped']} of "
+              f"{latency['frames']['produced']} captured frames skipped for newer ones")
+        polling = result["polling"]
+        print(f"polling {polling['fps']:.1f} fps of {polling['full_speed_fps']:.1f} at full speed "
+              f"({polling['saved']:.0%} of captures saved), detection {polling['detect_ms']:.2f} ms")
+        if regions:
+            print("pips in the last frame: " +
+                  ", ".join(f"{name} {count}" for name, count in result["regions"].items()))
+        print("stage timings (in-process stages only with --worker):")
+        for name, stats in sorted(result["stages"].items()):
+            print(f"  {name:<12} {stats['count']:>7} calls, p50 {stats['p50_ms']:.3f} ms, "
+                  f"p99 {stats['p99_ms']:.3f} ms, max {stats['max_ms']:.3f} ms")
+    return 0
+
+def import_times(module):
+    """
+    Import a module in a fresh interpreter with ``-X importtime`` and collect the cost of
+    every module it pulls in.
+
+    :param str module: Dotted module name, e.g. ``"app.app"``.
+    :returns: (module, self ms, cumulative ms) per imported module, in import order.
+    :rtype: list[tuple[str, float, float]]
+    :raises RuntimeError: If the import fails.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    times = []
+    for line in proc.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <indented module name>
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times.append((name.strip(), int(own) / 1000, int(cumulative) / 1000))
+    return times
+
+def cmd_imports(args):
+    """
+    Report what importing each module costs, and fail if the total is over the budget.
+
+    :param argparse.Namespace args: Parsed command line arguments.
+    :returns: Process exit code, 1 if a module is over the budget or fails to import.
+    :rtype: int
+    """
+    results = {}
+    status = 0
+    for module in args.modules:
+        try:
+            times = import_times(module)
+        except RuntimeError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            status = 1
+            continue
+        total = next((cumulative for name, _, cumulative in times if name == module), 0.0)
+        over = args.budget_ms is not None and total > args.budget_ms
+        status |= over
+        results[module] = {
+            "total_ms": total,
+            "over_budget": over,
+            "slowest": [{"module": name, "self_ms": own, "cumulative_ms": cumulative}
+                        for name, own, cumulative in sorted(times, key=lambda t: -t[1])[:args.top]],
+            # Modules of this repo, with everything they import themselves
+            "app": {name: cumulative for name, _, cumulative in times if name == "app" or name.startswith("app.")},
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for module, result in results.items():
+            budget = f" (budget {args.budget_ms:g} ms{', OVER' if result['over_budget'] else ''})" \
+                if args.budget_ms is not None else ""
+            print(f"import {module}: {result['total_ms']:.1f} ms{budget}")
+            print(f"  {'self ms':>8} {'cumul ms':>8}  module")
+            for entry in result["slowest"]:
+                print(f"  {entry['self_ms']:>8.1f} {entry['cumulative_ms']:>8.1f}  {entry['module']}")
+    return status
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Auto Chiseler detection benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parity = commands.add_parser("parity", help="check detections against the reference detector")
+    parity.add_argument("frames", nargs="+", help="recorded frames (PNG files, directories or globs)")
+    parity.add_argument("--tolerance", type=int, default=10)
+    parity.add_argument("--object-tolerance", type=int, default=10)
+    parity.add_argument("--legacy-merge", action="store_true", help="use the original greedy merge for the reference")
+    parity.add_argument("--layout", choices=sorted(CHANNEL_LAYOUTS), default="BGR",
+                        help="channel layout the detector reads the frames in")
+    parity.add_argument("--slots", action="store_true", help="detect only in the learned pip slots once learned")
+    parity.add_argument("--slot-padding", type=int, default=12, help="pixels scanned around each learned slot")
+    parity.add_argument("--pyramid", type=int, metavar="STRIDE", help="detect coarse-to-fine with this sampling stride")
+    parity.set_defaults(func=cmd_parity)
+
+    merge = commands.add_parser("merge", help="benchmark rectangle merging against the greedy merge")
+    merge.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 100, 200, 500, 1000])
+    merge.add_argument("--object-tolerance", type=int, default=10)
+    merge.add_argument("--repeat", type=int, default=20)
+    merge.add_argument("--seed", type=int, default=0)
+    merge.add_argument("--json", action="store_true", help="print machine-readable results")
+    merge.set_defaults(func=cmd_merge)
+
+    suite = commands.add_parser("suite", help="benchmark detection engines on synthetic frames")
+    suite.add_argument("--resolutions", type=parse_resolution, nargs="+",
+                       default=[(200, 100), (800, 400), (1920, 1080), (3840, 2160)])
+    suite.add_argument("--pips", type=int, nargs="+", default=[4])
+    suite.add_argument("--noise", type=float, nargs="+", default=[2.0], help="noise standard deviation")
+    suite.add_argument("--fragmentation", type=int, nargs="+", default=[0], help="cuts per pip")
+    suite.add_argument("--engines", nargs="+", choices=("legacy", "lut", "incremental", "pyramid"),
+                       default=["legacy", "lut", "incremental", "pyramid"])
+    suite.add_argument("--stride", type=int, default=4, help="sampling stride of the pyramid engine")
+    suite.add_argument("--frames", type=int, default=20, help="frames per scenario")
+    suite.add_argument("--tolerance", type=int, default=10)
+    suite.add_argument("--object-tolerance", type=int, default=10)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--json", action="store_true", help="print machine-readable results")
+    suite.add_argument("--output", help="also write the JSON report to this file")
+    suite.set_defaults(func=cmd_suite)
+
+    replay = commands.add_parser("replay", help="run the image processor on a recorded session")
+    replay.add_argument("source", help="video file, directory of PNG frames or glob pattern")
+    replay.add_argument("--pacing", choices=PACING_MODES, default="fast")
+    replay.add_argument("--fps", type=float, default=30.0, help="playback rate for fixed pacing and image sequences")
+    replay.add_argument("--area", type=int, nargs=4, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                        help="game area within the recording (default: whole frame)")
+    replay.add_argument("--region", nargs=5, action="append", metavar=("NAME", "LEFT", "TOP", "RIGHT", "BOTTOM"),
+                        help="watch a named region instead of the area (repeatable, captured as one union)")
+    replay.add_argument("--tolerance", type=int, default=10)
+    replay.add_argument("--object-tolerance", type=int, default=10)
+    replay.add_argument("--poll-delay", type=int, default=0, help="image poll delay in ms")
+    replay.add_argument("--stop", action="store_true", help="let the stop condition end the run like a live session")
+    replay.add_argument("--confirm-frames", type=int, help="frames a stop condition must hold (default: STOP_CONFIRM_FRAMES)")
+    replay.add_argument("--worker", action="store_true", help="detect in a worker process")
+    replay.add_argument("--full-scan", action="store_true", help="always scan the whole area, not only the learned pip slots")
+    replay.add_argument("--mode", choices=("exact", "pyramid"), help="detection mode (default: DETECTION_MODE)")
+    replay.add_argument("--verbose", action="store_true", help="print processor status messages")
+    replay.add_argument("--json", action="store_true", help="print machine-readable results")
+    replay.set_defaults(func=cmd_replay)
+
+    jitter = commands.add_parser("jitter", help="measure timer jitter with detection in-process and in a worker process")
+    jitter.add_argument("--resolution", type=parse_resolution, default=(1920, 1080))
+    jitter.add_argument("--pips", type=int, default=8)
+    jitter.add_argument("--frames", type=int, default=8, help="distinct synthetic frames to cycle through")
+    jitter.add_argument("--seconds", type=float, default=5.0, help="measurement duration per mode")
+    jitter.add_argument("--interval", type=float, default=5.0, help="timer period in ms")
+    jitter.add_argument("--seed", type=int, default=0)
+    jitter.add_argument("--json", action="store_true", help="print machine-readable results")
+    jitter.set_defaults(func=cmd_jitter)
+
+    imports = commands.add_parser("imports", help="measure import times in a fresh interpreter")
+    imports.add_argument("modules", nargs="*", default=["app.app"], help="modules to import (default: app.app)")
+    imports.add_argument("--top", type=int, default=15, help="number of slowest modules listed")
+    imports.add_argument("--budget-ms", type=float, help="exit with status 1 if an import takes longer")
+    imports.add_argument("--json", action="store_true", help="print machine-readable results")
+    imports.set_defaults(func=cmd_imports)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,24 +3,24 @@
 slots.pyw
 
 Set ENABLE_SLOTS_SOCKET to True in the config.py module
-to allow processor.py to forward detected objects over the
+to allow processor.py to publish detected objects on the
 IPC port defined in config, then run this file
 """
-import json
 import random
-import socket
 import threading
+import time
 import tkinter as tk
 
 from app.config import SLOTS_SOCKET_PORT
 from app.constants import RANK_TK_HEX
+from app.hub import recv_detections, subscribe
 from app.theme import adjust_color, bg, label_fg, entry_bg, entry_fg, btn_bg, btn_fg
 
 class SlotMachineApp:
     """
     A Tkinter-based GUI application that displays a dynamic slot machine interface.
 
-    The application listens on a TCP socket for incoming JSON-encoded rank data,
+    The application subscribes to the Auto Chiseler's detection hub for rank data,
     which it animates and displays across a configurable number of slot columns.
     Users can toggle the visibility of a control panel to adjust how many columns
     are shown in the interface (between 1 and 4) without restarting the app.
@@ -192,35 +192,39 @@ class SlotMachineApp:
 
     def listen_for_data(self):
         """
-        Continuously listen for incoming TCP connections carrying JSON-encoded slot rank data.
+        Continuously receive detection events from the Auto Chiseler's detection hub.
     
-        Binds and listens on localhost port 54171. For each accepted connection,
-        it receives data, attempts to parse it as JSON list of ranks, pads the list
-        to 4 items if shorter, then schedules the `animate_slots` method call
-        on the main Tkinter thread.
+        Subscribes to the hub on localhost port 54171, retrying with a growing delay while the
+        Auto Chiseler is not running. The hub sends one event per change of the detections
+        (see ``app.hub.recv_detections``). The ranks of the first 4 objects are padded to
+        4 items if shorter, then the `animate_slots` method call is scheduled on the main Tkinter thread.
     
-        Logs parse errors to the console but continues listening indefinitely.
+        Only the newest events are kept if the animation falls behind. Logs parse errors
+        to the console, reconnects and continues listening indefinitely.
 
         :rtype: None
         """
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.bind(("localhost", SLOTS_SOCKET_PORT))
-                s.listen(1)
-                print(f"Slot Machine Display: Listening on port {SLOTS_SOCKET_PORT}")
-                while True:
-                    conn, _ = s.accept()
-                    with conn:
-                        data = conn.recv(1024)
-                        try:
-                            ranks = json.loads(data.decode("utf-8"))
-                            ranks += [""] * (4 - len(ranks))
-                            self.root.after(0, lambda r=ranks: self.animate_slots(r))
-                        except Exception as e:
-                            print(f"IPC parse error: {e}")
-        except OSError as e:
-            print(f"[ERROR] Could not bind to port {SLOTS_SOCKET_PORT}: {e}")
-            self.root.after(0, lambda: self.show_error_popup(e))
+        backoff = 0.5
+        print(f"Slot Machine Display: Waiting for detections on port {SLOTS_SOCKET_PORT}")
+        while True:
+            try:
+                conn = subscribe("localhost", SLOTS_SOCKET_PORT, policy="drop_oldest")
+            except OSError:
+                time.sleep(backoff) # Auto Chiseler not running yet
+                backoff = min(backoff * 2, 10.0)
+                continue
+            backoff = 0.5
+            with conn:
+                try:
+                    while True:
+                        objs = recv_detections(conn)
+                        if objs is None:
+                            break # Hub stopped
+                        ranks = [obj['rank'] for obj in objs[:4]]
+                        ranks += [""] * (4 - len(ranks))
+                        self.root.after(0, lambda r=ranks: self.animate_slots(r))
+                except (OSError, ValueError) as e:
+                    print(f"IPC parse error: {e}")
 
     def animate_slots(self, final_ranks):
         """
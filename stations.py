@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+stations.py
+
+Runs several chisel stations (one per game window) from a JSON file, e.g.:
+
+    python stations.py stations.json
+
+where stations.json holds a list of stations:
+
+    [
+        {"name": "alt1", "game_area": [0, 0, 400, 120], "chisel_button_pos": [200, 300],
+         "buy_button_pos": [200, 360], "min_quality": "S", "min_objects": 2},
+        {"name": "alt2", "game_area": [960, 0, 1360, 120], "chisel_button_pos": [1160, 300],
+         "buy_button_pos": [1160, 360], "stop_at_ss": 1}
+    ]
+
+Every setting except the name, area and buttons is optional and defaults to the GUI's value.
+Per-station throughput is printed periodically until every station stopped or Ctrl+C.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from app.stations import Orchestrator, load_stations
+
+def make_clicker(dry_run):
+    """
+    Create the click function shared by all stations.
+
+    :param bool dry_run: Print clicks instead of sending them.
+    :returns: A function called as ``click(x, y)``.
+    :rtype: callable
+    """
+    if dry_run:
+        return lambda x, y: None
+    from ahk import AHK
+    ahk = AHK()
+    def click(x, y):
+        ahk.mouse_move(x, y, speed=0) # Instant move
+        ahk.mouse_move(0, -1, relative=True, speed=0) # Nudge so Roblox registers the cursor inside the client
+        ahk.click()
+    return click
+
+def print_stats(stats):
+    """
+    Print one line per station and the totals.
+
+    :param dict stats: Result of ``Orchestrator.stats``.
+    :rtype: None
+    """
+    for s in stats["stations"]:
+        print(f"{s['name']:<12} {s['state']:<10} rerolls={s['rerolls']:<6} {s['rerolls_per_min']:>7.1f}/min "
+              f"frames={s['frames']:<6} detect p50={s['detect_ms']['p50_ms']:.2f} ms "
+              f"round trip p50={s['round_trip_ms']['p50_ms']:.2f} ms")
+    print(f"total {stats['rerolls_per_min']:.1f} rerolls/min on {stats['workers']} workers, "
+          f"input wait p99={stats['input_wait_ms']['p99_ms']:.2f} ms")
+
+def toggle_profiler_on_enter():
+    """
+    Start or stop the profiler whenever Enter is pressed.
+
+    :rtype: None
+    """
+    from app.profiling import PROFILER
+    print("Press Enter to start profiling")
+    for _ in sys.stdin:
+        if PROFILER.active:
+            files = PROFILER.stop()
+            print("Profile written to " + (", ".join(files) or "nowhere, see the error above"))
+        else:
+            PROFILER.start()
+            print("Profiling... press Enter to stop")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several chisel stations side by side")
+    parser.add_argument("config", help="JSON file with the list of stations")
+    parser.add_argument("--workers", type=int, help="detection processes (default: one per station)")
+    parser.add_argument("--interval", type=float, default=5.0, help="seconds between statistics")
+    parser.add_argument("--replay", help="play back this recording for every station instead of capturing the screen")
+    parser.add_argument("--dry-run", action="store_true", help="do not send any clicks")
+    parser.add_argument("--json", action="store_true", help="print the final statistics as JSON")
+    parser.add_argument("--metrics-port", type=int, help="serve per-station metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile", action="store_true", help="press Enter to start or stop the profiler (see app.profiling)")
+    args = parser.parse_args(argv)
+
+    metrics_server = None
+    if args.metrics_port:
+        from app.metrics import MetricsServer
+        metrics_server = MetricsServer(port=args.metrics_port)
+        metrics_server.start()
+
+    capturer_factory = None
+    if args.replay:
+        from app.replay import ReplayCapture
+        capturer_factory = lambda config: ReplayCapture(args.replay, pacing="fixed", loop=True,
+                                                        origin=config.game_area[:2])
+
+    orchestrator = Orchestrator(load_stations(args.config), make_clicker(args.dry_run or bool(args.replay)),
+                                capturer_factory=capturer_factory, workers=args.workers)
+    orchestrator.start()
+    if args.profile:
+        threading.Thread(target=toggle_profiler_on_enter, daemon=True, name="ProfileToggle").start()
+    try:
+        while orchestrator.running():
+            deadline = time.perf_counter() + args.interval
+            while orchestrator.running() and time.perf_counter() < deadline:
+                time.sleep(0.1)
+            if not args.json:
+                print_stats(orchestrator.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        orchestrator.stop()
+        if metrics_server is not None:
+            metrics_server.stop()
+    if args.json:
+        print(json.dumps(orchestrator.stats(), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())